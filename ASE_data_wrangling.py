@@ -17,393 +17,563 @@ and alternative alleles.
 
 import pandas as pd
 import numpy as np
+import argparse
 import os
+import shutil
 from os import path
+from multiprocessing import Pool
+
+import Count_tensor
+import Run_report
+import Sample_pool
+import Stage_cache
+import Stage_counters
+import Table_format
+import Variant_table
+
+
+# Genotypes are stored as small integer allele codes shared by all the genotype columns. The single nucleotides and the
+# missing genotype have fixed codes and the longer alleles found in the data take the next codes.
+ALLELES = [".", "A", "C", "G", "T", "N"]
+DOT = 0  # Code of the "." genotype, SNP not expressed
+MISSING = -1  # Code of an empty genotype cell
+
+# Annotation columns that repeat across many rows and are kept as categories
+ANNOTATION_COLUMNS = Table_format.ANNOTATION_COLUMNS
+
+
+def allele_dtype(alleles=()):
+    # Categorical dtype with the table of allele codes for the alleles found in the data
+    extra = sorted(set(str(allele) for allele in alleles) - set(ALLELES))
+    return pd.CategoricalDtype(ALLELES + extra)
+
+
+def read_snps(file_name, samples=None, PSG=None, **kwargs):
+    # Read a table of SNPs with the genotypes and the annotations as categories instead of Python strings and the
+    # allele depths as 32 bit numbers. With samples, only the columns of these samples are read. The VariantsToTable
+    # outputs and the vcf files are converted to the same columns, with the pseudogenome code PSG in the column names.
+    if Variant_table.variant_format(file_name) is not None:
+        return Variant_table.read_variants(file_name, PSG, samples, chunksize=kwargs.get("chunksize"))
+    return Table_format.read_csv_typed(file_name, samples, **kwargs)
+
+
+def read_chromosomes(file_name, chunksize):
+    # Chromosome column of a table of SNPs in chunks
+    if Variant_table.variant_format(file_name) is not None:
+        return (chunk["CHROM"] for chunk in Variant_table.read_variants(file_name, "", (), (), chunksize))
+    return (chunk["CHROM"] for chunk in pd.read_csv(file_name, usecols=["CHROM"], chunksize=chunksize))
+
+
+def genotype_dtype(df):
+    # Categorical dtype with the alleles of all the genotype columns of the dataframe, or None if they are already encoded
+    gt_cols = [col for col in df.columns if str(col).endswith(".GT")]
+    dtypes = set(df[col].dtype for col in gt_cols)
+    if len(dtypes) == 1 and all(isinstance(dtype, pd.CategoricalDtype) and list(dtype.categories[:len(ALLELES)]) == ALLELES
+                                for dtype in dtypes):
+        return None  # Already encoded
+    alleles = set()
+    for col in gt_cols:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            alleles.update(df[col].cat.categories)
+        else:
+            alleles.update(df[col].dropna().unique())
+    return allele_dtype(alleles)
 
 
-# Make an iterator for the collection of multiallelic sites:
-def multiallelic_sample(df, sample, PSGs):
-    # For obtaining the column names:
-    r = "_R_"
-    a = "_A_"
-    gt = ".GT"
-    PSG1_code: str = PSGs[0]
-    PSG2_code: str = PSGs[1]
-    rPSG1_GT = int(df.columns.get_loc(str(sample + r + PSG1_code + gt)))
-    aPSG1_GT = int(df.columns.get_loc(str(sample + a + PSG1_code + gt)))
-    rPSG2_GT = int(df.columns.get_loc(str(sample + r + PSG2_code + gt)))
-    aPSG2_GT = int(df.columns.get_loc(str(sample + a + PSG2_code + gt)))
-    print("Multiallelic loop in sample: ", sample)
+def encode_genotypes(df):
+    # Put all the genotype columns of the dataframe on the same allele codes so they can be compared as integers
+    dtype = genotype_dtype(df)
+    if dtype is None:
+        return df
+    return df.assign(**{col: df[col].astype(dtype) for col in df.columns if str(col).endswith(".GT")})
 
-    sample_index = []
-    for i in range(len(df)):
-        if (((df.iloc[i, rPSG1_GT]) != df.iloc[i, rPSG2_GT]) & (df.iloc[i, rPSG1_GT] != df.iloc[i, aPSG2_GT])) | (
-                (df.iloc[i, aPSG1_GT] != df.iloc[i, rPSG2_GT]) & (df.iloc[i, aPSG1_GT] != df.iloc[i, aPSG2_GT])):
-            sample_index.append(i)
-    return sample_index
 
+def allele_codes(df, columns):
+    # SNP x column array with the allele codes of the genotype columns. Empty cells are MISSING. The codes are the ones
+    # of all the genotype columns of the dataframe, so the codes of different calls can be compared.
+    dtype = genotype_dtype(df)
+    codes = [(df[col] if dtype is None else df[col].astype(dtype)).cat.codes.to_numpy() for col in columns]
+    return np.column_stack(codes) if codes else np.empty((len(df), 0), dtype=np.int8)
+
+
+def same(x, y):
+    # Equality of allele codes. As with the strings, an empty genotype is not equal to anything.
+    return (x == y) & (x != MISSING)
+
+
+def decode(codes, dtype):
+    # Genotype column from an array of allele codes
+    return pd.Categorical.from_codes(codes, dtype=dtype)
 
-def multiallelic(df, samples, PSGs, multi_index):
-    for sample in samples:
-        multiallelic_sample_index = multiallelic_sample(df, sample, PSGs)
-        multi_index = multi_index + multiallelic_sample_index
-    df_bi = df.drop(index=multi_index)
-    return df_bi
 
+def psg_columns(samples, PSG_code, allele, field):
+    # Column names of one allele ("_R_" or "_A_") and one field (".AD" or ".GT") of a pseudogenome for all the samples
+    return [Count_tensor.column(sample, allele, field, PSG_code) for sample in samples]
 
-def evaluation(df, sample, PSGs):
-    # Evaluation of genotype and average. This is an iterator
-    r = "_R_"
-    a = "_A_"
-    gt = ".GT"
-    ad = ".AD"
+
+def genotype_block(df, samples, PSGs):
+    # Collect the allele codes of the samples as four arrays of shape SNPs x samples, in the order rPSG1, aPSG1, rPSG2,
+    # aPSG2
     PSG1_code: str = PSGs[0]
     PSG2_code: str = PSGs[1]
-    rPSG1_GT = int(df.columns.get_loc(str(sample + r + PSG1_code + gt)))
-    aPSG1_GT = int(df.columns.get_loc(str(sample + a + PSG1_code + gt)))
-    rPSG2_GT = int(df.columns.get_loc(str(sample + r + PSG2_code + gt)))
-    aPSG2_GT = int(df.columns.get_loc(str(sample + a + PSG2_code + gt)))
-    rPSG1_AD = int(df.columns.get_loc(str(sample + r + PSG1_code + ad)))
-    aPSG1_AD = int(df.columns.get_loc(str(sample + a + PSG1_code + ad)))
-    rPSG2_AD = int(df.columns.get_loc(str(sample + r + PSG2_code + ad)))
-    aPSG2_AD = int(df.columns.get_loc(str(sample + a + PSG2_code + ad)))
-
-    # Create the empty lists to collect the average variables and genotypes
-    r_AD = []
-    a_AD = []
-    r_GT = []
-    a_GT = []
-
-    print("Evaluation loop in sample: ", sample)
-
-    # Start iterator
-    for i in range(len(df)):
-        # Case homozygots for the two pseudogenoes
-        if (df.iloc[i, rPSG1_GT] == df.iloc[i, aPSG1_GT]) and (df.iloc[i, rPSG2_GT] == df.iloc[i, aPSG2_GT]) and (
-                df.iloc[i, rPSG1_GT] == df.iloc[i, rPSG2_GT]) and (df.iloc[i, aPSG1_GT] == df.iloc[i, aPSG2_GT]):
-            r_GT.append(df.iloc[i, rPSG1_GT])
-            x = ((df.iloc[i, rPSG1_AD] + df.iloc[i, rPSG2_AD] + df.iloc[i, aPSG1_AD] + df.iloc[i, aPSG2_AD]) / 2)
-            r_AD.append(x)
-            a_GT.append(df.iloc[i, rPSG2_GT])
-            y = 0
-            a_AD.append(y)
-
-        # Case 2 Same situation Ref and Alt in both for df
-        elif (df.iloc[i, rPSG1_GT] == df.iloc[i, rPSG2_GT]) and (df.iloc[i, aPSG1_GT] == df.iloc[i, aPSG2_GT]):
-            r_GT.append(df.iloc[i, rPSG1_GT])
-            x = (df.iloc[i, rPSG1_AD] + df.iloc[i, rPSG2_AD]) / 2
-            r_AD.append(x)
-            a_GT.append(df.iloc[i, aPSG1_GT])
-            y = (df.iloc[i, aPSG1_AD] + df.iloc[i, aPSG2_AD]) / 2
-            a_AD.append(y)
-        # Case 3 Inverse situation Ref and Alt in both for df
-        elif (df.iloc[i, rPSG1_GT] == df.iloc[i, aPSG2_GT]) and (df.iloc[i, aPSG1_GT] == df.iloc[i, rPSG2_GT]):
-            r_GT.append(df.iloc[i, rPSG1_GT])
-            x = (df.iloc[i, rPSG1_AD] + df.iloc[i, aPSG2_AD]) / 2  # averaged by 2 (for each mapping method)
-            r_AD.append(x)
-            a_GT.append(df.iloc[i, aPSG1_GT])
-            y = (df.iloc[i, aPSG1_AD] + df.iloc[i, rPSG2_AD]) / 2  # averaged by 2 (for each mapping method)
-            a_AD.append(y)
-
-        # Case 4 First homozygot, second with alternative allele in second position (as alternative)
-        elif (df.iloc[i, rPSG1_GT] == df.iloc[i, aPSG1_GT]) and (df.iloc[i, rPSG2_GT] != df.iloc[i, aPSG2_GT]) and (
-                df.iloc[i, rPSG1_GT] == df.iloc[i, rPSG2_GT]):
-            r_GT.append(df.iloc[i, rPSG1_GT])
-            x = (df.iloc[i, rPSG1_AD] + df.iloc[i, aPSG1_AD] + df.iloc[
-                i, rPSG2_AD]) / 2  # counts from 3 cells from which one is 0, from 2 mapping methods (averaged by 2)
-            r_AD.append(x)
-            a_GT.append(df.iloc[i, aPSG2_GT])
-            y = df.iloc[i, aPSG2_AD]
-            a_AD.append(y)
-
-        # Case 5 First homozygot, second with alternative allele in first position  (as reference)
-        elif ((df.iloc[i, rPSG1_GT] == df.iloc[i, aPSG1_GT]) and (df.iloc[i, rPSG2_GT] != df.iloc[i, aPSG2_GT]) and (
-                df.iloc[i, rPSG1_GT] == df.iloc[i, aPSG2_GT])):
-            r_GT.append(df.iloc[i, rPSG1_GT])
-            x = (df.iloc[i, rPSG1_AD] + df.iloc[i, aPSG1_AD] + df.iloc[
-                i, aPSG2_AD]) / 2  # counts from 3 cells from which one is 0, from 2 mapping methods (averaged by 2)
-            r_AD.append(x)
-            a_GT.append(df.iloc[i, rPSG2_GT])
-            y = df.iloc[i, rPSG2_AD]
-            a_AD.append(y)
-
-        # Case 6 Second homozygot, first heterozygot with alternative allele in second position (as alternative)
-        elif (df.iloc[i, rPSG1_GT] != df.iloc[i, aPSG1_GT]) and (df.iloc[i, rPSG2_GT] == df.iloc[i, aPSG2_GT]) and (
-                df.iloc[i, rPSG1_GT] == df.iloc[i, rPSG2_GT]):
-            r_GT.append(df.iloc[i, rPSG1_GT])
-            x = (df.iloc[i, rPSG1_AD] + df.iloc[i, rPSG2_AD] + df.iloc[
-                i, aPSG2_AD]) / 2  # counts from 3 cells from which one is 0, from 2 mapping methods (averaged by 2)
-            r_AD.append(x)
-            a_GT.append(df.iloc[i, aPSG1_GT])
-            y = df.iloc[i, aPSG1_AD]
-            a_AD.append(y)
-
-        # Case 7 Second homozygot, first heterozygot with alternative allele in first position (as reference)
-        elif (df.iloc[i, rPSG1_GT] != df.iloc[i, aPSG1_GT]) and (df.iloc[i, rPSG2_GT] == df.iloc[i, aPSG2_GT]) and (
-                df.iloc[i, aPSG1_GT] == df.iloc[i, aPSG2_GT]):
-            r_GT.append(df.iloc[i, rPSG1_GT])
-            x = df.iloc[i, rPSG1_AD]
-            r_AD.append(x)
-            a_GT.append(df.iloc[i, rPSG2_GT])
-            y = (df.iloc[i, aPSG1_AD] + df.iloc[i, rPSG2_AD] + df.iloc[
-                i, aPSG2_AD]) / 2  # counts from 3 cells from which one is 0, from 2 mapping methods (averaged by 2)
-            a_AD.append(y)
-
-        # Case 8 Both homozygot, first for the reference allele and second for the alternative allele
-        elif (df.iloc[i, rPSG1_GT] == df.iloc[i, aPSG1_GT]) and (df.iloc[i, rPSG2_GT] == df.iloc[i, aPSG2_GT]) and (
-                df.iloc[i, aPSG1_GT] != df.iloc[i, aPSG2_GT]):
-            r_GT.append(df.iloc[i, rPSG1_GT])
-            x = df.iloc[i, rPSG1_AD] + df.iloc[i, aPSG1_AD]  # one of these counts will be 0 so no need to average
-            r_AD.append(x)
-            a_GT.append(df.iloc[i, rPSG2_GT])
-            y = df.iloc[i, rPSG2_AD] + df.iloc[i, aPSG2_AD]  # one of these counts will be 0 so no need to average
-            a_AD.append(y)
+    rPSG1_GT = allele_codes(df, psg_columns(samples, PSG1_code, "_R_", ".GT"))
+    aPSG1_GT = allele_codes(df, psg_columns(samples, PSG1_code, "_A_", ".GT"))
+    rPSG2_GT = allele_codes(df, psg_columns(samples, PSG2_code, "_R_", ".GT"))
+    aPSG2_GT = allele_codes(df, psg_columns(samples, PSG2_code, "_A_", ".GT"))
+    return rPSG1_GT, aPSG1_GT, rPSG2_GT, aPSG2_GT
 
-        else:
-            print("Error in the SNP in the coordinates ", df.iloc[i, "CHROM"], ", ", df.iloc[i, "POS"], ", sample num ",
-                  sample)
 
-    return (r_GT, r_AD, a_GT, a_AD)
+def multiallelic_mask(rPSG1_GT, aPSG1_GT, rPSG2_GT, aPSG2_GT):
+    # A site is multiallelic in a sample when the reference allele of PSG1 is different from both alleles of PSG2 or the
+    # alternative allele of PSG1 is different from both alleles of PSG2. The arrays can be one sample or the whole block.
+    return (~same(rPSG1_GT, rPSG2_GT) & ~same(rPSG1_GT, aPSG2_GT)) | (
+            ~same(aPSG1_GT, rPSG2_GT) & ~same(aPSG1_GT, aPSG2_GT))
 
 
-def sample_average(df, samples, PSGs):
-    cols = []  # Index of columns to be drop in the end
-    # Create 4 columns for each averaged sample:
+# Collect the multiallelic sites of one sample:
+def multiallelic_sample(df, sample, PSGs):
+    # Returns the positions of the rows that are multiallelic in the sample
+    print("Multiallelic sites in sample: ", sample)
+    mask = multiallelic_mask(*genotype_block(df, [sample], PSGs))
+    return list(np.flatnonzero(mask[:, 0]))
+
+
+def multiallelic_task(arrays, j):
+    # Multiallelic sites of sample j, run in the pool of processes
+    gt = arrays["gt"]
+    arrays["multiallelic"][:, j] = multiallelic_mask(gt[:, j, 0], gt[:, j, 1], gt[:, j, 2], gt[:, j, 3])
+
+
+def multiallelic(df, samples, PSGs, multi_index, workers=1, counters=None):
+    # Evaluate the SNP x sample genotype block at once and drop the rows that are multiallelic in at least one sample.
+    # multi_index can carry extra positions to drop. With more than one worker the samples are evaluated in a pool of
+    # processes.
+    Stage_counters.log(counters, 1, "Multiallelic sites in samples: ", ", ".join(samples))
+    if workers > 1:
+        gt = np.stack(genotype_block(df, samples, PSGs), axis=2)
+        outputs = {"multiallelic": (gt.shape[:2], bool)}
+        sample_mask = Sample_pool.run(multiallelic_task, {"gt": gt}, outputs, len(samples), workers)["multiallelic"]
+    else:
+        sample_mask = multiallelic_mask(*genotype_block(df, samples, PSGs))
+    mask = sample_mask.any(axis=1)
+    if len(multi_index) > 0:
+        mask[np.asarray(multi_index, dtype=int)] = True
+    for j, sample in enumerate(samples):
+        Stage_counters.count(counters, "Biallelic", "samples", sample, "multiallelic", sample_mask[:, j].sum())
+        Stage_counters.log(counters, 2, "Multiallelic sites in sample ", sample, ": ", int(sample_mask[:, j].sum()))
+    Stage_counters.count(counters, "Biallelic", "dropped", "multiallelic", mask.sum())
+    Stage_counters.log(counters, 1, "Number of multiallelic rows to drop ", int(mask.sum()))
+    df_bi = df[~mask]
+    return df_bi
+
+
+def count_block(df, samples, PSGs):
+    # Collect the allele depths of the samples as four arrays of shape SNPs x samples, in the order rPSG1, aPSG1, rPSG2,
+    # aPSG2
+    PSG1_code: str = PSGs[0]
+    PSG2_code: str = PSGs[1]
+    rPSG1_AD = df[psg_columns(samples, PSG1_code, "_R_", ".AD")].to_numpy()
+    aPSG1_AD = df[psg_columns(samples, PSG1_code, "_A_", ".AD")].to_numpy()
+    rPSG2_AD = df[psg_columns(samples, PSG2_code, "_R_", ".AD")].to_numpy()
+    aPSG2_AD = df[psg_columns(samples, PSG2_code, "_A_", ".AD")].to_numpy()
+    return rPSG1_AD, aPSG1_AD, rPSG2_AD, aPSG2_AD
+
+
+def classify_cases(rPSG1_GT, aPSG1_GT, rPSG2_GT, aPSG2_GT):
+    # Decision table for the eight genotype cases described in main. The conditions are evaluated in the order of the
+    # cases, so the first case that matches is the one assigned. The arrays can be one sample or the whole block.
+    # Returns the case code (1 to 8) of each SNP and sample, and a mask with the SNPs that matched no case (code 0).
+    hom1 = same(rPSG1_GT, aPSG1_GT)
+    hom2 = same(rPSG2_GT, aPSG2_GT)
+    conditions = [
+        hom1 & hom2 & same(rPSG1_GT, rPSG2_GT) & same(aPSG1_GT, aPSG2_GT),  # 1 Homozygots for the two pseudogenomes
+        same(rPSG1_GT, rPSG2_GT) & same(aPSG1_GT, aPSG2_GT),  # 2 Same Ref and Alt in both
+        same(rPSG1_GT, aPSG2_GT) & same(aPSG1_GT, rPSG2_GT),  # 3 Inverse Ref and Alt in both
+        hom1 & ~hom2 & same(rPSG1_GT, rPSG2_GT),  # 4 First homozygot, second with alternative allele as alternative
+        hom1 & ~hom2 & same(rPSG1_GT, aPSG2_GT),  # 5 First homozygot, second with alternative allele as reference
+        ~hom1 & hom2 & same(rPSG1_GT, rPSG2_GT),  # 6 Second homozygot, first with alternative allele as alternative
+        ~hom1 & hom2 & same(aPSG1_GT, aPSG2_GT),  # 7 Second homozygot, first with alternative allele as reference
+        hom1 & hom2 & ~same(aPSG1_GT, aPSG2_GT),  # 8 Both homozygots for different alleles
+    ]
+    cases = np.select(conditions, [1, 2, 3, 4, 5, 6, 7, 8], 0).astype(np.int8)
+    return cases, cases == 0
+
+
+def average_counts(cases, genotypes, counts):
+    # Vectorized count arithmetic of the eight cases. genotypes and counts are the (rPSG1, aPSG1, rPSG2, aPSG2) arrays
+    # and cases the codes returned by classify_cases. The SNPs that matched no case get "." genotypes and NaN counts.
+    # The genotypes are allele codes.
+    rPSG1_GT, aPSG1_GT, rPSG2_GT, aPSG2_GT = genotypes
+    rPSG1_AD, aPSG1_AD, rPSG2_AD, aPSG2_AD = counts
+    in_case = [cases == case for case in range(1, 9)]
+
+    r_GT = np.where(cases == 0, DOT, rPSG1_GT)
+    a_GT = np.select(in_case, [rPSG2_GT, aPSG1_GT, aPSG1_GT, aPSG2_GT, rPSG2_GT, aPSG1_GT, rPSG2_GT, rPSG2_GT], DOT)
+
+    # Counts from 3 cells from which one is 0 come from 2 mapping methods and are averaged by 2
+    r_AD = np.select(in_case, [
+        (rPSG1_AD + rPSG2_AD + aPSG1_AD + aPSG2_AD) / 2,
+        (rPSG1_AD + rPSG2_AD) / 2,
+        (rPSG1_AD + aPSG2_AD) / 2,
+        (rPSG1_AD + aPSG1_AD + rPSG2_AD) / 2,
+        (rPSG1_AD + aPSG1_AD + aPSG2_AD) / 2,
+        (rPSG1_AD + rPSG2_AD + aPSG2_AD) / 2,
+        rPSG1_AD,
+        rPSG1_AD + aPSG1_AD,  # one of these counts will be 0 so no need to average
+    ], np.nan)
+    a_AD = np.select(in_case, [
+        np.zeros(cases.shape),
+        (aPSG1_AD + aPSG2_AD) / 2,
+        (aPSG1_AD + rPSG2_AD) / 2,
+        aPSG2_AD,
+        rPSG2_AD,
+        aPSG1_AD,
+        (aPSG1_AD + rPSG2_AD + aPSG2_AD) / 2,
+        rPSG2_AD + aPSG2_AD,  # one of these counts will be 0 so no need to average
+    ], np.nan)
+    return r_GT, r_AD, a_GT, a_AD
+
+
+def evaluation_task(arrays, j):
+    # Evaluation of genotype and average of sample j, run in the pool of processes
+    gt = arrays["gt"]
+    ad = arrays["ad"]
+    genotypes = (gt[:, j, 0], gt[:, j, 1], gt[:, j, 2], gt[:, j, 3])
+    counts = (ad[:, j, 0], ad[:, j, 1], ad[:, j, 2], ad[:, j, 3])
+    cases, unclassified = classify_cases(*genotypes)
+    (r_GT, r_AD, a_GT, a_AD) = average_counts(cases, genotypes, counts)
+    arrays["cases"][:, j] = cases
+    arrays["r_GT"][:, j] = r_GT
+    arrays["r_AD"][:, j] = r_AD
+    arrays["a_GT"][:, j] = a_GT
+    arrays["a_AD"][:, j] = a_AD
+
+
+def evaluation(df, sample, PSGs, workers=1, counters=None):
+    # Evaluation of genotype and average for one sample (a sample name) or for several samples at once (a list of
+    # names). Returns the arrays with the new genotypes and counts and the mask of the SNPs that matched no case. With
+    # more than one worker the samples are evaluated in a pool of processes. The hits of each case and the SNPs that
+    # matched no case are added to the counters of the stage "Average".
+    samples = [sample] if isinstance(sample, str) else list(sample)
+    Stage_counters.log(counters, 1, "Evaluation of genotypes in samples: ", ", ".join(samples))
+
+    df = encode_genotypes(df)
+    gt_dtype = df[str(samples[0] + "_R_" + PSGs[0] + ".GT")].dtype
+    genotypes = genotype_block(df, samples, PSGs)
+    counts = count_block(df, samples, PSGs)
+    if workers > 1 and len(samples) > 1:
+        gt = np.stack(genotypes, axis=2)
+        shape = gt.shape[:2]
+        outputs = {"cases": (shape, np.int8), "r_GT": (shape, gt.dtype), "a_GT": (shape, gt.dtype),
+                   "r_AD": (shape, np.float64), "a_AD": (shape, np.float64)}
+        results = Sample_pool.run(evaluation_task, {"gt": gt, "ad": np.stack(counts, axis=2).astype(np.float64)},
+                                  outputs, len(samples), workers)
+        cases = results["cases"]
+        unclassified = cases == 0
+        (r_GT, r_AD, a_GT, a_AD) = (results["r_GT"], results["r_AD"], results["a_GT"], results["a_AD"])
+    else:
+        cases, unclassified = classify_cases(*genotypes)
+        (r_GT, r_AD, a_GT, a_AD) = average_counts(cases, genotypes, counts)
+    Stage_counters.count_cases(counters, "Average", cases, samples)
+    Stage_counters.record_unclassified(counters, "Average", df, unclassified, samples)
+
+    # The averaged allele depths are float32 in every chunk and shard, the type Table_format.column_dtype reads them with
+    r_AD = list(r_AD.T.astype(np.float32))
+    a_AD = list(a_AD.T.astype(np.float32))
+    r_GT = [decode(r_GT[:, j], gt_dtype) for j in range(len(samples))]
+    a_GT = [decode(a_GT[:, j], gt_dtype) for j in range(len(samples))]
+
+    if isinstance(sample, str):
+        return r_GT[0], r_AD[0], a_GT[0], a_AD[0], unclassified[:, 0]
+    return r_GT, r_AD, a_GT, a_AD, unclassified
+
+
+def sample_average(df, samples, PSGs, workers=1, counters=None):
+    # Average the counts of all the samples in one pass and create 4 columns for each averaged sample. Returns the new
+    # dataframe, the positions of the columns to be dropped in the end and the mask of the rows that matched no case in
+    # at least one sample.
+    (r_GT, r_AD, a_GT, a_AD, unclassified) = evaluation(df, list(samples), PSGs, workers, counters)
+
+    # Add the new columns
+    new_cols = {}
+    for j, sample in enumerate(samples):
+        new_cols[str(sample + "_R_.GT")] = r_GT[j]
+        new_cols[str(sample + "_A_.GT")] = a_GT[j]
+        new_cols[str(sample + "_R_.AD")] = r_AD[j]
+        new_cols[str(sample + "_A_.AD")] = a_AD[j]
+
+    # Collect the columns that won't be used
+    cols = []
     for sample in samples:
-        print("Sample average in sample ", sample, "\n")
-        # Average each sample according to genotype:
-        (r_GT, r_AD, a_GT, a_AD) = evaluation(df, sample, PSGs)
-
-        # Add the new columns
-        sample_r_GT = str(sample + "_R_.GT")
-        sample_a_GT = str(sample + "_A_.GT")
-        sample_r_AD = str(sample + "_R_.AD")
-        sample_a_AD = str(sample + "_A_.AD")
-        df[sample_r_GT] = r_GT
-        df[sample_a_GT] = a_GT
-        df[sample_r_AD] = r_AD
-        df[sample_a_AD] = a_AD
-
-        # Drop the columns that won't be used
-        r = "_R_"
-        a = "_A_"
-        gt = ".GT"
-        ad = ".AD"
-        PSG1_code: str = PSGs[0]
-        PSG2_code: str = PSGs[1]
-        rPSG1_GT = int(df.columns.get_loc(str(sample + r + PSG1_code + gt)))
-        aPSG1_GT = int(df.columns.get_loc(str(sample + a + PSG1_code + gt)))
-        rPSG2_GT = int(df.columns.get_loc(str(sample + r + PSG2_code + gt)))
-        aPSG2_GT = int(df.columns.get_loc(str(sample + a + PSG2_code + gt)))
-        rPSG1_AD = int(df.columns.get_loc(str(sample + r + PSG1_code + ad)))
-        aPSG1_AD = int(df.columns.get_loc(str(sample + a + PSG1_code + ad)))
-        rPSG2_AD = int(df.columns.get_loc(str(sample + r + PSG2_code + ad)))
-        aPSG2_AD = int(df.columns.get_loc(str(sample + a + PSG2_code + ad)))
-
-        cols.append(rPSG1_GT)
-        cols.append(aPSG1_GT)
-        cols.append(rPSG2_GT)
-        cols.append(aPSG2_GT)
-        cols.append(rPSG1_AD)
-        cols.append(aPSG1_AD)
-        cols.append(rPSG2_AD)
-        cols.append(aPSG2_AD)
-
-    return df, cols
-
-
-def AD10(df, samples):
-    # The iterator collects the index were AD from both alleles is below 10
-    # Keep all this analysis for the same individual including two tissues at a time
-    i = 0
-    indexes_ad10 = 0
-    x = str(path.exists("Samples_MAE.csv"))
-    if (x == True):
+        for PSG_code in PSGs[:2]:
+            for allele in ("_R_", "_A_"):
+                for field in (".GT", ".AD"):
+                    cols.append(int(df.columns.get_loc(str(sample + allele + PSG_code + field))))
+    cols.sort()
+
+    df = pd.concat([df, pd.DataFrame(new_cols, index=df.index)], axis=1)
+    unclassified = unclassified.any(axis=1)
+    Stage_counters.count(counters, "Average", "dropped", "unclassified", unclassified.sum())
+    if unclassified.any():
+        Stage_counters.log(counters, 1, "Number of SNPs that matched no genotype case ", int(unclassified.sum()))
+
+    return df, cols, unclassified
+
+
+def tissue_pairs(samples):
+    # Pairs of samples of the same individual that the depth and MAE filters keep together, from "Samples_MAE.csv". The
+    # samples that are not in a pair, or all of them when there is only one tissue, make a pair with themselves.
+    samples = [str(sample) for sample in samples]
+    pairs = []
+    if path.exists("Samples_MAE.csv"):
         # Verification that there are two tissues
         tissues = pd.read_csv("Samples_MAE.csv")
-        tissues = pd.DataFrame(tissues)
-        first_samples = tissues.iloc[:, 0]
-        second_samples = tissues.iloc[:, 1]
-
-        for first_sample in first_samples:
-            print("AD10 filter in sample ", first_sample, " and sample ", second_samples[i])
-            sample1_r_ad = str(first_sample + "_R_.AD")
-            sample1_a_ad = str(first_sample + "_A_.AD")
-            sample2_r_ad = str(second_samples[i] + "_R_.AD")
-            sample2_a_ad = str(second_samples[i] + "_A_.AD")
-            index_sample = df[
-                (((df[sample1_a_ad] + df[sample1_r_ad]) < 10) | ((df[sample2_a_ad] + df[sample2_r_ad]) < 10))].index
-            if i == 0:
-                indexes_ad10 = np.array(index_sample)
-                print("Number of rows to drop for sample ", first_sample, " ", len(indexes_ad10))
-                i = i + 1
-            elif i != 0:
-                index_sample = np.array(index_sample)
-                indexes_ad10 = np.intersect1d(indexes_ad10, index_sample)
-                print("Number accumulated of rows to drop for sample ", first_sample, " ", len(indexes_ad10))
-                i = i + 1
+        for first, second in zip(tissues.iloc[:, 0].astype(str), tissues.iloc[:, 1].astype(str)):
+            if first in samples and second in samples:
+                pairs.append((first, second))
+            else:
+                print("WARNING: The pair ", first, " and ", second, " of Samples_MAE.csv is not in the samples")
+    paired = set(sample for pair in pairs for sample in pair)
+    return pairs + [(sample, sample) for sample in samples if sample not in paired]
+
+
+def pair_positions(samples, pairs):
+    # Positions of the samples of each pair in the list of samples, as an array of shape pairs x 2
+    position = {sample: k for k, sample in enumerate(samples)}
+    return np.array([[position[first], position[second]] for first, second in pairs], dtype=int).reshape(-1, 2)
+
+
+def allele_frequencies(r_ad, a_ad):
+    # Frequencies of the reference allele. The SNPs without counts have frequency 0.
+    r_ad = np.asarray(r_ad, dtype=np.float64)
+    a_ad = np.asarray(a_ad, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        af = r_ad / (r_ad + a_ad)
+    return np.where(np.isnan(af), 0, af)
+
+
+def depth_mask(depth, positions, min_depth):
+    # Rows with less than min_depth reads in one of the samples of each pair, shape SNPs x pairs
+    return (depth[:, positions[:, 0]] < min_depth) | (depth[:, positions[:, 1]] < min_depth)
+
+
+def mae_mask(af, positions):
+    # Rows whose allele frequencies are 0 in both samples of each pair, or 1 in both, shape SNPs x pairs
+    first = af[:, positions[:, 0]]
+    second = af[:, positions[:, 1]]
+    return ((first == 0) & (second == 0)) | ((first == 1) & (second == 1))
+
+
+def filter_task(arrays, p):
+    # Depth and MAE conditions of pair p, run in the pool of processes
+    positions = arrays["pairs"][p:p + 1]
+    if "depth" in arrays:
+        arrays["low"][:, p] = depth_mask(arrays["depth"], positions, arrays["min_depth"][0])[:, 0]
+    if "af" in arrays:
+        arrays["mae"][:, p] = mae_mask(arrays["af"], positions)[:, 0]
+
+
+def filter_rows(df, samples, min_depth=None, mae=False, workers=1):
+    """
+    Filter engine of the depth and MAE conditions. The conditions of all the samples, or pairs of samples from
+    "Samples_MAE.csv", are evaluated on arrays of SNPs x pairs and the rejected rows are dropped once.
+
+    :param df: dataframe with the allele depths of the samples
+    :param samples: list of strings including the sample names
+    :param min_depth: a row is rejected when it has less than min_depth reads in one of the samples of every pair.
+        None for no depth filter.
+    :param mae: reject the rows whose allele frequencies are 0 or 1 in both samples of a pair, and add the allele
+        frequency columns "AF_" + sample
+    :param workers: number of processes for the pairs
+    :return: filtered dataframe and a dictionary with the rejected rows by condition for each pair and each sample
+    """
+    samples = [str(sample) for sample in samples]
+    pairs = tissue_pairs(samples)
+    pair_samples = list(dict.fromkeys(sample for pair in pairs for sample in pair))
+    positions = pair_positions(pair_samples, pairs)
+    r_ad = df[[str(sample + "_R_.AD") for sample in samples]].to_numpy()
+    a_ad = df[[str(sample + "_A_.AD") for sample in samples]].to_numpy()
+    columns = [samples.index(sample) for sample in pair_samples]
+
+    inputs = {"pairs": positions}
+    outputs = {}
+    if min_depth is not None:
+        depth = (r_ad + a_ad)[:, columns]
+        inputs["depth"] = depth
+        inputs["min_depth"] = np.array([min_depth])
+        outputs["low"] = ((len(df), len(pairs)), bool)
+    if mae:
+        af_all = allele_frequencies(r_ad, a_ad)
+        af = af_all[:, columns]
+        inputs["af"] = af
+        outputs["mae"] = ((len(df), len(pairs)), bool)
+
+    if workers > 1 and len(pairs) > 1:
+        masks = Sample_pool.run(filter_task, inputs, outputs, len(pairs), workers)
     else:
-        # There is only one tissue
-        for sample in samples:
-            print("AD10 filter in sample ", sample)
-            sample_r_ad = str(sample + "_R_.AD")
-            sample_a_ad = str(sample + "_A_.AD")
-
-            index_sample = df[(df[sample_a_ad] + df[sample_r_ad]) < 10].index
-            if i == 0:
-                indexes_ad10 = np.array(index_sample)
-                print("Number of rows to drop", len(indexes_ad10))
-                i = i + 1
-            elif i != 0:
-                index_sample = np.array(index_sample)
-                indexes_ad10 = np.intersect1d(indexes_ad10, index_sample)
-                print("Number of rows to drop", len(indexes_ad10))
-                i = i + 1
-
-    df.drop(index=indexes_ad10, inplace=True)
+        masks = {}
+        if min_depth is not None:
+            masks["low"] = depth_mask(depth, positions, min_depth)
+        if mae:
+            masks["mae"] = mae_mask(af, positions)
+
+    # A row is rejected by the depth when it is low in all the pairs, and by the MAE when it is MAE in one pair
+    reject = np.zeros(len(df), dtype=bool)
+    report = {"pairs": {}, "samples": {}}
+    for p, (first_sample, second_sample) in enumerate(pairs):
+        report["pairs"][first_sample + "-" + second_sample] = {name: int(mask[:, p].sum())
+                                                              for name, mask in masks.items()}
+    if min_depth is not None:
+        if len(pairs) > 0:
+            reject = reject | masks["low"].all(axis=1)
+        for k, sample in enumerate(pair_samples):
+            report["samples"].setdefault(sample, {})["low"] = int((depth[:, k] < min_depth).sum())
+    if mae:
+        reject = reject | masks["mae"].any(axis=1)
+        for k, sample in enumerate(pair_samples):
+            report["samples"].setdefault(sample, {})["mae"] = int(((af[:, k] == 0) | (af[:, k] == 1)).sum())
+    report["rejected"] = int(reject.sum())
+
+    keep = ~reject
+    df = df[keep]
+    if mae:
+        df = df.assign(**{str("AF_" + sample): af_all[keep, j] for j, sample in enumerate(samples)})
+        # To fill cases where there are no counts. Genotypes and annotations are categories and their empty cells stay
+        # empty.
+        numeric = [col for col in df.columns if not isinstance(df[col].dtype, pd.CategoricalDtype)]
+        if df[numeric].isna().any().any():
+            df = df.fillna({col: 0 for col in numeric})
+    return df, report
+
+
+def AD10(df, samples, workers=1, min_depth=10, counters=None):
+    # Drop the rows where the AD of both alleles is below min_depth in at least one sample of each pair of samples. Keep
+    # all this analysis for the same individual including two tissues at a time.
+    df, report = filter_rows(df, samples, min_depth=min_depth, workers=workers)
+    for pair, rejected in report["pairs"].items():
+        Stage_counters.count(counters, "AD10", "pairs", pair, "low_depth", rejected["low"])
+        Stage_counters.log(counters, 2, "AD10 filter in pair ", pair, ": ", rejected["low"], " rows below ", min_depth,
+                           " reads")
+    for sample, rejected in report["samples"].items():
+        Stage_counters.count(counters, "AD10", "samples", sample, "low_depth", rejected["low"])
+        Stage_counters.log(counters, 2, "AD10 filter in sample ", sample, ": ", rejected["low"], " rows below ",
+                           min_depth, " reads")
+    Stage_counters.count(counters, "AD10", "dropped", "low_depth", report["rejected"])
+    Stage_counters.log(counters, 1, "Number of rows to drop", report["rejected"])
     return df
 
 
-def compare(df, sample, R_models, A_models):
-    # This iterator will construct the new columns for the samples according to the reference and alternative alleles
-    # assigned in sample1
-
-    # Position of the sample columns
-    sample_r_gt = int(df.columns.get_loc(str(sample + "_R_.GT")))
-    sample_a_gt = int(df.columns.get_loc(str(sample + "_A_.GT")))
-    sample_r_ad = int(df.columns.get_loc(str(sample + "_R_.AD")))
-    sample_a_ad = int(df.columns.get_loc(str(sample + "_A_.AD")))
-
-    # Create the empty lists to collect the average variables and genotypes
-    r_AD = []
-    a_AD = []
-    r_GT = []
-    a_GT = []
-
-    print("Compare genotypes loop in sample: ", sample)
-
-    # Start iterator for model genotypes
-    for i in range(len(df)):
-        if R_models[i] == A_models[i] and R_models[i] == ".":
-            # print("Previous: ", R_models[i], A_models[i], ", new: ", df.iloc[i, sample_r_gt], df.iloc[i, sample_a_gt])
-            R_models[i] = df.iloc[i, sample_r_gt]
-            A_models[i] = df.iloc[i, sample_a_gt]
-
-    # Start iterator for comaprison
-    for i in range(len(df)):
-        if R_models[i] == df.iloc[i, sample_r_gt] and A_models[i] == df.iloc[i, sample_a_gt]:
-            # 1 Reference and alternative are set in the same position for sample and sample1 (reference)
-            # It applies to both samples heterozygots or both homozygots with same genotype
-            r_AD.append(df.iloc[i, sample_r_ad])
-            a_AD.append(df.iloc[i, sample_a_ad])
-            r_GT.append(df.iloc[i, sample_r_gt])
-            a_GT.append(df.iloc[i, sample_a_gt])
-        elif A_models[i] == df.iloc[i, sample_r_gt] and R_models[i] == df.iloc[i, sample_a_gt]:
-            # 2 Reference and alternative are set in the inverse position for sample and sample1 (reference)
-            # It applies to both samples heterozygots or both homozygots with same genotype
-            r_AD.append(df.iloc[i, sample_a_ad])
-            a_AD.append(df.iloc[i, sample_r_ad])
-            r_GT.append(df.iloc[i, sample_a_gt])
-            a_GT.append(df.iloc[i, sample_r_gt])
-        elif R_models[i] == df.iloc[i, sample_r_gt] and A_models[i] == df.iloc[i, sample_r_gt] and A_models[i] != \
-                df.iloc[i, sample_a_gt]:
-            # 3 It applies to first sample homozygot and second sample heterozygot with the alternative allele in second
-            r_AD.append(df.iloc[i, sample_r_ad])
-            a_AD.append(df.iloc[i, sample_a_ad])
-            r_GT.append(df.iloc[i, sample_r_gt])
-            a_GT.append(df.iloc[i, sample_a_gt])
-        elif R_models[i] != df.iloc[i, sample_r_gt] and A_models[i] != df.iloc[i, sample_r_gt] and A_models[i] == \
-                df.iloc[
-                    i, sample_a_gt]:
-            # 4 It applies to first sample homozygot and second sample heterozygot with the alternative allele in first
-            r_AD.append(df.iloc[i, sample_a_ad])
-            a_AD.append(df.iloc[i, sample_r_ad])
-            r_GT.append(df.iloc[i, sample_a_gt])
-            a_GT.append(df.iloc[i, sample_r_gt])
-        elif R_models[i] == A_models[i] and R_models[i] != df.iloc[i, sample_r_gt] and df.iloc[i, sample_r_gt] == \
-                df.iloc[i, sample_a_gt]:
-            # 5 It applies to first sample homozygot for the reference allele and second sample homozygot for the
-            # alternative allele
-            a_AD.append(df.iloc[i, sample_r_ad] + df.iloc[i, sample_a_ad])  # One of them will be 0
-            r_GT.append(df.iloc[i, sample_a_gt])
-            a_GT.append(df.iloc[i, sample_a_gt])
-            r_AD.append(0)
-        elif R_models[i] != A_models[i] and R_models[i] == df.iloc[i, sample_r_gt] and df.iloc[i, sample_r_gt] == \
-                df.iloc[i, sample_a_gt]:
-            # 6 It applies to first sample heterozygot and second sample homozygot for the reference allele
-            r_GT.append(df.iloc[i, sample_r_gt])
-            a_GT.append(df.iloc[i, sample_r_gt])
-            r_AD.append(df.iloc[i, sample_r_ad] + df.iloc[i, sample_r_ad])  # One of them will be 0
-            a_AD.append(0)
-        elif R_models[i] != A_models[i] and A_models[i] == df.iloc[i, sample_a_gt] and df.iloc[i, sample_r_gt] == \
-                df.iloc[i, sample_a_gt]:
-            # 7 It applies to first sample heterozygot and second sample homozygot for the alternative allele
-            a_AD.append(df.iloc[i, sample_r_ad] + df.iloc[i, sample_a_ad])  # One of them will be 0
-            r_GT.append(df.iloc[i, sample_a_gt])
-            a_GT.append(df.iloc[i, sample_a_gt])
-            r_AD.append(0)
-        elif R_models[i] == df.iloc[i, sample_r_gt] and A_models[i] == df.iloc[i, sample_r_gt] and df.iloc[
-            i, sample_r_gt] == df.iloc[i, sample_a_gt]:
-            # 8 It applies to first sample homozygot for the reference allele and second sample homozygot for the
-            # reference allele too
-            r_AD.append(df.iloc[i, sample_r_ad] + df.iloc[i, sample_a_ad])  # One of them will be 0
-            r_GT.append(df.iloc[i, sample_r_gt])
-            a_GT.append(df.iloc[i, sample_r_gt])
-            a_AD.append(0)
-        elif R_models[i] == A_models[i] and R_models[i] == ".":
-            # 9 SNP not expressed in the sample1 as reference gentoype
-            r_AD.append(df.iloc[i, sample_r_ad])
-            a_AD.append(df.iloc[i, sample_a_ad])
-            r_GT.append(df.iloc[i, sample_r_gt])
-            a_GT.append(df.iloc[i, sample_a_gt])
-            print(i)
-            """
-            genotype_models = pd.DataFrame(data=[R_models, A_models]).T
-            genotype_models.to_csv("Genotype_models.csv")
-            """
-        elif df.iloc[i, sample_r_gt] == df.iloc[i, sample_a_gt] and df.iloc[i, sample_r_gt] == ".":
-            # 10 SNP not expressed in the sample to evaluate
-            r_AD.append(0)
-            a_AD.append(0)
-            r_GT.append(".")
-            a_GT.append(".")
-        else:
-            print("ERROR: Comparison of genotypes of sample ",
-                  sample, " provided an error for the SNP in the row ", i, " with genotypes ",
-                  df.iloc[i, sample_a_gt], ", ",
-                  df.iloc[i, sample_r_gt], ". You must check if the evaluation of this case is correct")
+def genotype_models(R_GT, A_GT, consensus="first"):
+    # Build the reference and alternative allele model of each SNP from the SNP x sample arrays of averaged allele
+    # codes.
+    # With "first" the model is taken from the first sample where the SNP is expressed, which is the model that the
+    # sample-by-sample comparison used to build. With "majority" the model is the orientation shared by most of the
+    # heterozygot samples (ties go to the first of them), falling back to the first expressed sample for the SNPs
+    # without heterozygots.
+    expressed = ~(same(R_GT, A_GT) & (R_GT == DOT))
+    model_sample = expressed.argmax(axis=1)  # Sample 1 when the SNP is not expressed in any sample
+    if consensus == "majority":
+        heterozygot = expressed & ~same(R_GT, A_GT)
+        votes = np.zeros(R_GT.shape, dtype=int)
+        for j in range(R_GT.shape[1]):
+            agree = heterozygot & same(R_GT, R_GT[:, [j]]) & same(A_GT, A_GT[:, [j]])
+            votes[:, j] = np.where(heterozygot[:, j], agree.sum(axis=1), 0)
+        model_sample = np.where(heterozygot.any(axis=1), votes.argmax(axis=1), model_sample)
+    elif consensus != "first":
+        raise ValueError("Unknown consensus for the genotype models: " + str(consensus))
+    rows = np.arange(len(R_GT))
+    return R_GT[rows, model_sample], A_GT[rows, model_sample]
+
+
+def compare_cases(R_models, A_models, r_gt, a_gt):
+    # Decision table for the comparison of the genotypes of the samples with the model. R_models and A_models have one
+    # value per SNP and r_gt, a_gt are SNP x sample arrays. Returns the case code (1 to 10) of each SNP and sample, and
+    # 0 for the SNPs whose comparison matched no case.
+    R = R_models[:, np.newaxis]
+    A = A_models[:, np.newaxis]
+    # The samples before the first sample where the SNP is expressed, not expressed either, were compared with the
+    # model "." of the sample-by-sample comparison, and matched the case 1
+    unexpressed = same(r_gt, a_gt) & (r_gt == DOT)
+    before_model = ~np.logical_or.accumulate(~unexpressed, axis=1)
+    conditions = [
+        # 1 Same position, both heterozygots or both homozygots with same genotype, or before the model
+        same(R, r_gt) & same(A, a_gt) | before_model,
+        same(A, r_gt) & same(R, a_gt),  # 2 Inverse position, both heterozygots or both homozygots with same genotype
+        same(R, r_gt) & same(A, r_gt) & ~same(A, a_gt),  # 3 Model homozygot, sample heterozygot, alternative second
+        ~same(R, r_gt) & ~same(A, r_gt) & same(A, a_gt),  # 4 Model homozygot, sample heterozygot, alternative first
+        same(R, A) & ~same(R, r_gt) & same(r_gt, a_gt),  # 5 Model homozygot for reference, sample for alternative
+        ~same(R, A) & same(R, r_gt) & same(r_gt, a_gt),  # 6 Model heterozygot, sample homozygot for the reference
+        ~same(R, A) & same(A, a_gt) & same(r_gt, a_gt),  # 7 Model heterozygot, sample homozygot for the alternative
+        same(R, r_gt) & same(A, r_gt) & same(r_gt, a_gt),  # 8 Model and sample homozygots for the reference
+        same(R, A) & (R == DOT),  # 9 SNP not expressed in any sample of the model
+        same(r_gt, a_gt) & (r_gt == DOT),  # 10 SNP not expressed in the sample to evaluate
+    ]
+    return np.select(conditions, list(range(1, 11)), 0).astype(np.int8)
+
+
+def compare(df, samples, R_models, A_models, counters=None):
+    # Align the reference and alternative alleles of all the samples with the model in one pass. The swap masks of each
+    # case are applied to the AD/GT arrays as a whole. Returns the new SNP x sample arrays and the case codes. The hits
+    # of each case and the SNPs that matched no case are added to the counters of the stage "Uniform".
+    r_gt = allele_codes(df, [str(sample + "_R_.GT") for sample in samples])
+    a_gt = allele_codes(df, [str(sample + "_A_.GT") for sample in samples])
+    r_ad = df[[str(sample + "_R_.AD") for sample in samples]].to_numpy()
+    a_ad = df[[str(sample + "_A_.AD") for sample in samples]].to_numpy()
+
+    Stage_counters.log(counters, 1, "Compare genotypes in samples: ", ", ".join(samples))
+    cases = compare_cases(R_models, A_models, r_gt, a_gt)
+    Stage_counters.count_cases(counters, "Uniform", cases, samples)
+    keep = np.isin(cases, [1, 3, 9])
+    swap = np.isin(cases, [2, 4])
+    to_alternative = np.isin(cases, [5, 7])  # Counts go to the alternative allele, one of them will be 0
+    to_reference = np.isin(cases, [6, 8])  # Counts go to the reference allele, one of them will be 0
+    empty = cases == 10
+    masks = [keep, swap, to_alternative, to_reference, empty]
+
+    # The SNPs that matched no case keep their own assignation
+    r_AD = np.select(masks, [r_ad, a_ad, 0, r_ad + a_ad, 0], r_ad)
+    a_AD = np.select(masks, [a_ad, r_ad, r_ad + a_ad, 0, 0], a_ad)
+    r_GT = np.select(masks, [r_gt, a_gt, a_gt, r_gt, DOT], r_gt)
+    a_GT = np.select(masks, [a_gt, r_gt, a_gt, r_gt, DOT], a_gt)
+
+    unclassified = cases == 0
+    Stage_counters.count(counters, "Uniform", "unclassified", unclassified.any(axis=1).sum())
+    Stage_counters.record_unclassified(counters, "Uniform", df, unclassified, samples)
+
+    return r_AD, a_AD, r_GT, a_GT, cases
+
+
+def harmonize(df, samples, consensus="first", counters=None):
+    # Determines the genotype models from the samples and aligns all of them with the models. Returns the dataframe and
+    # a dataframe with the model genotypes.
+    samples = list(samples)
+    df = encode_genotypes(df)
+    R_GT = allele_codes(df, [str(sample + "_R_.GT") for sample in samples])
+    A_GT = allele_codes(df, [str(sample + "_A_.GT") for sample in samples])
+    gt_dtype = df[str(samples[0] + "_R_.GT")].dtype
+    R_models, A_models = genotype_models(R_GT, A_GT, consensus)
+
+    (r_ad, a_ad, r_gt, a_gt, cases) = compare(df, samples, R_models, A_models, counters)
+
+    # Assign the arrays to the column names
+    new_cols = {}
+    for j, sample in enumerate(samples):
+        new_cols[str(sample + "_R_.GT")] = decode(r_gt[:, j], gt_dtype)
+        new_cols[str(sample + "_A_.GT")] = decode(a_gt[:, j], gt_dtype)
+        new_cols[str(sample + "_R_.AD")] = r_ad[:, j]
+        new_cols[str(sample + "_A_.AD")] = a_ad[:, j]
+    df = df.assign(**new_cols)
 
     # Make a dataframe with the model genotypes
-    genotype_models = pd.DataFrame(data=[R_models, A_models]).T
-    genotype_models.to_csv("Genotype_models.csv")
+    genotype_models_df = pd.DataFrame({0: decode(R_models, gt_dtype), 1: decode(A_models, gt_dtype)})
 
-    return r_AD, a_AD, r_GT, a_GT, R_models, A_models
+    return df, genotype_models_df
 
 
-def genotype(df, samples):
-    # Determines the genotypes for sample1 and calls the function to compare genotypes
-    i = 0
-    for sample in samples:
-        i = i + 1
-        if i == 1:  # If we are in the first sample we set the reference
-            R_models = df[str(sample + "_R_.GT")].to_numpy()
-            A_models = df[str(sample + "_A_.GT")].to_numpy()
-
-        elif i != 1:  # If we already passed the first sample
-            (r_ad, a_ad, r_gt, a_gt, R_models, A_models) = compare(df, sample, R_models, A_models)
-
-            # Collection the name of the samples
-            sample_r_gt = str(sample + "_R_.GT")
-            sample_a_gt = str(sample + "_A_.GT")
-            sample_r_ad = str(sample + "_R_.AD")
-            sample_a_ad = str(sample + "_A_.AD")
-
-            # Assign the list to the column name
-            df[sample_r_gt] = r_gt
-            df[sample_a_gt] = a_gt
-            df[sample_r_ad] = r_ad
-            df[sample_a_ad] = a_ad
-
+def genotype(df, samples, consensus="first"):
+    # Aligns all the samples with the genotype models and writes the models in "Genotype_models.csv"
+    df, genotype_models_df = harmonize(df, samples, consensus)
+    genotype_models_df.to_csv("Genotype_models.csv")
     return df
 
 
@@ -420,101 +590,97 @@ def frequencies(df, samples):
         sample_a_ad = str(sample + "_A_.AD")
         af_sample = str("AF_" + sample)
         df[af_sample] = df[sample_r_ad] / (df[sample_r_ad] + df[sample_a_ad])
-    df = df.fillna(0)  # To fill cases where there are no counts and therefore AF is divided by 0
+    # To fill cases where there are no counts and therefore AF is divided by 0. Genotypes and annotations are categories
+    # and their empty cells stay empty.
+    df = df.fillna({col: 0 for col in df.columns if not isinstance(df[col].dtype, pd.CategoricalDtype)})
     print("Allele frequencies by sample calculated")
 
     return df
 
 
-def MAE(df, samples):
-    # Collect the indexes whose allele frequencies are 0 or 1 in both tissues of the same individual. These indexes
-    # correspond to the SNPs that are MAE for at least one sample
-    x = str(path.exists("Samples_MAE.csv"))
-    if (x == True):
-        # Case where there are two tissues compared
-        tissues = pd.read_csv("Samples_MAE.csv")
-        tissues = pd.DataFrame(tissues)
-        first_samples = tissues.iloc[:, 0]
-        second_samples = tissues.iloc[:, 1]
-        i = 0
-        for first_sample in first_samples:
-            print("MAE loop in sample ", first_sample, " and sample ", second_samples[i])
-            af1 = str("AF_" + first_sample)
-            af2 = str("AF_" + second_samples[i])
-            index_af = df[((df[af1] == 0) & (df[af2] == 0)) | (df[af1] == 1) & (df[af2] == 1)].index
-            df.drop(index=index_af, inplace=True)
-            i = i + 1
-    else:
-        # Case where there is only one tissue
-        for sample in samples:
-            af = str("AF_" + sample)
-            index_af = df[(df[af] == 0) | (df[af] == 1)].index
-            df.drop(index=index_af, inplace=True)
-
+def MAE(df, samples, workers=1, counters=None):
+    # Add the allele frequencies of the samples and drop at once the rows whose allele frequencies are 0 or 1 in both
+    # tissues of the same individual. These rows correspond to the SNPs that are MAE for at least one sample.
+    df, report = filter_rows(df, samples, mae=True, workers=workers)
+    Stage_counters.log(counters, 1, "Allele frequencies by sample calculated")
+    for pair, rejected in report["pairs"].items():
+        Stage_counters.count(counters, "SNPs_ready", "pairs", pair, "mae", rejected["mae"])
+        Stage_counters.log(counters, 2, "MAE in pair ", pair, ": ", rejected["mae"], " rows")
+    for sample, rejected in report["samples"].items():
+        Stage_counters.count(counters, "SNPs_ready", "samples", sample, "mae", rejected["mae"])
+        Stage_counters.log(counters, 2, "MAE in sample ", sample, ": ", rejected["mae"],
+                           " rows with allele frequency 0 or 1")
+    Stage_counters.count(counters, "SNPs_ready", "dropped", "mae", report["rejected"])
+    Stage_counters.log(counters, 1, "Number of rows to drop", report["rejected"])
     return df
 
 
-def main():
-    """
-    Input the files and convert them into data frames
-    """
+def save(df, name, fmt="csv", append=False):
+    # Write a table in the format of the intermediate tables, or append it to the table written for the previous chunks
+    with Run_report.stage("Write", len(df)):
+        Table_format.write_table(df, name, fmt, append)
 
-    # Read the dataframe and convert it into pandas dataframe. PSG stands for pseudogenome:
 
-    PATH = os.getcwd()
+# The genotype models are a report and are always written as csv
+MODELS = "Genotype_models"
+MODELS_FILE = MODELS + ".csv"
 
-    """
-    PSG1_name: str = input("Please enter the file name of the SNPs_for_wrangling for the first pseudogenome:\n")
-    PSG2_name: str = input("Please enter the file name of the SNPs_for_wrangling for the second pseudogenome:\n")
+# Stages of the wrangling and the tables they write, relative to the output folder and without extension. The last
+# table of a stage is the input of the next stage.
+WRANGLING_STAGES = [("Biallelic", [path.join("temp", "Biallelic_SNPs")]),
+                    ("Average", [path.join("temp", "Unclassified_SNPs"), path.join("temp", "Average_SNPs")]),
+                    ("AD10", [path.join("temp", "AD10_SNPs")]),
+                    ("Uniform", [MODELS, path.join("temp", "Uniform_SNPs")]),
+                    ("SNPs_ready", ["SNPs_ready"])]
 
-    PSG1 = pd.read_csv(PSG1_name, low_memory=False)
-    PSG2 = pd.read_csv(PSG2_name, low_memory=False)
+# Folder with the arrays of allele depths and genotypes of SNPs_ready
+TENSOR_FOLDER = "SNPs_ready_counts"
 
-    """
-    PSG1 = pd.read_csv("SNPs_for_wrangling_Weismann_GF3.csv", low_memory=False)
-    PSG2 = pd.read_csv("SNPs_for_wrangling_Weismann_KF6.csv", low_memory=False)
+# JSON summary of the counters of the stages and side table with the coordinates of the SNPs that matched no genotype
+# case
+SUMMARY_FILE = "Wrangling_summary.json"
 
-    PSG1 = pd.DataFrame(PSG1)
-    PSG2 = pd.DataFrame(PSG2)
+# Report with the time and the memory used by each stage
+REPORT_FILE = "Wrangling_report.json"
+UNCLASSIFIED_FILE = path.join("temp", "Unclassified_coordinates.csv")
 
-    # Read the sample names and the codes for each pseudogenome:
-    """
-    sample_names = pd.read_csv(input("Please enter the file name that has the sample names:\n"))
-    PSG_codes = pd.read_csv(input("Please enter the file name that has the pseudogenomes codes:\n"))"
-    """
+# Tables of SNPs written by the wrangling stages
+WRANGLING_TABLES = [name for stage, tables in WRANGLING_STAGES for name in tables if name != MODELS]
 
-    sample_names = pd.read_csv("Sample_names_Weismann.csv")
-    PSG_codes = pd.read_csv("Pseudogenome_codes.csv")
 
-    # Create arrays of the sample names and the pseudogenome codes
-    samples = sample_names['Sample_name'].values
-    PSGs = PSG_codes['PSGs'].values
+def stage_files(stage, fmt="csv"):
+    # Files written by a stage of the wrangling
+    tables = dict(WRANGLING_STAGES)[stage]
+    return [MODELS_FILE if name == MODELS else Table_format.table_file(name, fmt) for name in tables]
 
-    """
-     MERGE THE DATAFRAMES 
-    -----------------------
-    
-    The format of the table is the same for both dataframes. Columns from 1 to 6 are:
-        CHROM: Chromosome,
-        POS: position,
-        Gene.refGene: Gene_ID
-        Func.refGene: Annotation of the function for this SNP
-        ExonicFunc.refGene: Annotation of the function if this SNP is exonic
-        AF: Allele frequency estimated for all the samples
-    
-    From column 7th till the end there will be 4 columns for each sample. The structure of the column name is
-    as follows:
-        NAME (determined by the sample name)
-        _R or _A (reference or alternative allele)
-        _??? (The pseudogenome code)
-        .AD (allele depth)
-        .GT (Genotype)
-    
-    The next step is to merge the two dataframes on the common chromosome and position:
-    """
 
-    df = pd.merge(PSG1, PSG2, on=('CHROM', 'POS'))
-    print('Files merged')
+def checkpoint(cache, stage, fmt="csv"):
+    # Copy the outputs of a completed stage to the stage cache, if there is one. cache is (folder, keys, maximum size).
+    if cache is not None:
+        cache_dir, keys, max_size = cache
+        Stage_cache.store(cache_dir, keys[stage], stage, stage_files(stage, fmt), max_size)
+
+
+def load(name, fmt="csv"):
+    # Read back a table of SNPs written by a stage, with the genotypes encoded
+    if fmt == "csv":
+        df = read_snps(Table_format.table_file(name, fmt), index_col=0)
+    else:
+        df = Table_format.read_table(name, fmt)
+    return encode_genotypes(df)
+
+
+def wrangle(df, samples, PSGs, consensus="first", append=False, models_start=0, workers=1, out_dir=".", fmt="csv",
+            start=0, cache=None, min_depth=10, counters=None):
+    # Run all the wrangling stages on a table of merged SNPs. The temporary tables are written in the folder "temp" and
+    # the result in "SNPs_ready", inside out_dir and in the format fmt. With append, the outputs are appended to the
+    # tables of the previous chunks and the genotype models are numbered from models_start. The per-sample work runs in
+    # a pool of processes with more than one worker. With start, the run resumes at that stage of WRANGLING_STAGES and
+    # df is the main table of the stage before. Each completed stage is copied to the stage cache when it is given. The
+    # SNPs with less than min_depth reads are dropped by the AD10 stage. The rows in and out, the dropped rows and the
+    # genotype cases of each stage are added to the counters.
+    # Returns the number of genotype models written.
+    models = 0
 
     """
      DELETE MULTIALLELIC SITES 
@@ -531,17 +697,16 @@ def main():
     Collect the indexes where the reference allele in PSG1 is different from both alleles in the other mappings or the alternative allele in PSG1 is different from both alleles in the PSG2 mapping.
     """
 
-    # Call the function to clean the multiallelic sites and drop the dfs with this condition:
-    multi_index = []
-    df_bi = multiallelic(df, samples, PSGs, multi_index)
-
-    # Make a temporary folder where you can copy temporary files for backups
-    # os.mkdir("temp")
-    os.chdir("temp")
-    df_bi.to_csv('Biallelic_SNPs.csv')
-    os.chdir(PATH)
+    if start < 1:
+        # Call the function to clean the multiallelic sites and drop the dfs with this condition:
+        rows = len(df)
+        with Run_report.stage("Multiallelic", rows):
+            df = multiallelic(df, samples, PSGs, [], workers, counters)
+        Stage_counters.count_rows(counters, "Biallelic", rows, len(df))
 
-    # From now on we work with df_bi standing for "dataframe_biallelic_SNPs"
+        # Make a temporary folder where you can copy temporary files for backups
+        save(df, path.join(out_dir, "temp", "Biallelic_SNPs"), fmt, append)
+        checkpoint(cache, "Biallelic", fmt)
 
     """
     COMPARE GENOTYPES AND MAKE THE AVERAGE OF COUNTS
@@ -596,59 +761,511 @@ def main():
     the workflow.
     """
 
-    df_average, cols = sample_average(df_bi, samples, PSGs)
+    if start < 2:
+        rows = len(df)
+        with Run_report.stage("Average", rows):
+            df, cols, unclassified = sample_average(df, samples, PSGs, workers, counters)
 
-    # Drop the columns that are not needed
-    df_average.drop(df_average.columns[cols], axis=1, inplace=True)
+            # Drop the columns that are not needed
+            df = df.drop(columns=df.columns[cols])
 
-    os.chdir("temp")
-    df_average.to_csv("Average_SNPs.csv")
-    os.chdir(PATH)
+        # The SNPs that matched none of the eight cases in some sample are kept apart for checking
+        save(df[unclassified], path.join(out_dir, "temp", "Unclassified_SNPs"), fmt, append)
+        df = df[~unclassified]
+        Stage_counters.count_rows(counters, "Average", rows, len(df))
+        save(df, path.join(out_dir, "temp", "Average_SNPs"), fmt, append)
+        checkpoint(cache, "Average", fmt)
 
     """
     DELETE SNPs WITH AD<10
     ----------------------
-    This new function cleans the SNPs that do not have enough counts and are considered possible poor quality reads
+    This new function cleans the SNPs that do not have enough counts and are considered possible poor quality reads. The
+    minimum number of reads is 10 and can be changed with "--min-depth". The depths of all the samples or pairs of 
+    samples are evaluated at once and the rows are dropped once.
     """
 
-    df_AD10 = AD10(df_average, samples)
+    if start < 3:
+        rows = len(df)
+        with Run_report.stage("AD10", rows):
+            df = AD10(df, samples, workers, min_depth, counters)
+        Stage_counters.count_rows(counters, "AD10", rows, len(df))
 
-    # Write the temporary file
-    os.chdir("temp")
-    df_AD10.to_csv("AD10_SNPs.csv")
-    os.chdir(PATH)
+        # Write the temporary file
+        save(df, path.join(out_dir, "temp", "AD10_SNPs"), fmt, append)
+        checkpoint(cache, "AD10", fmt)
 
     """
         ASSIGN REFERENCE AND ALTERNATIVE ALLELES UNIFORMLY IN ALL SAMPLES
         -----------------------------------------------------------------
         Reference and alternative alleles have been assigned by sample. This function will correct it and will assign the
-        reference and alternative alleles according to the pattern established in sample 1.
+        reference and alternative alleles according to the pattern established in the first sample where the SNP is
+        expressed, or by the majority of the heterozygot samples with "--consensus majority". All the samples are
+        aligned with the models in one pass.
+
+        The model of a SNP only depends on the genotypes of that SNP, so the models built chunk by chunk are the same as
+        the ones built for the whole table.
         """
 
-    df_uni = genotype(df_AD10, samples)
+    if start < 4:
+        with Run_report.stage("Genotype", len(df)):
+            df, genotype_models_df = harmonize(df, samples, consensus, counters)
+        Stage_counters.count_rows(counters, "Uniform", len(df), len(df))
+        genotype_models_df.index = genotype_models_df.index + models_start
+        save(genotype_models_df, path.join(out_dir, MODELS), "csv", append)
+        models = len(genotype_models_df)
 
-    # Write the temporary file
-    os.chdir("temp")
-    df_uni.to_csv("Uniform_SNPs.csv")
-    os.chdir(PATH)
+        # Write the temporary file
+        save(df, path.join(out_dir, "temp", "Uniform_SNPs"), fmt, append)
+        checkpoint(cache, "Uniform", fmt)
 
     """ 
     ELIMINATE MONOALLELIC EXPRESSION
     --------------------------------
     The monoallelic expression (MAE) can result from homozygots as well as imprinted genes. In order to distinguish each
     case, we need to know the genotype. However, that's not possible for the amount of SNPs that we are working with.
-    Therefore we drop all the SNPs whose allele frequency is 0 or 1.
+    Therefore we drop all the SNPs whose allele frequency is 0 or 1. The allele frequencies of all the samples are
+    computed and evaluated at once and the rows are dropped once.
 
     If the samples are taken from two different organs from the same individual, the system needs a file called 
     "Samples_MAE.csv" where the sample name from an individual are in the same line and there are two columns, 
-    one for each tissue/organ we need to compare. The name of the columns must be in plural for further iterations.
+    one for each tissue/organ we need to compare. The name of the columns must be in plural for further iterations. The 
+    samples that are not in the file are evaluated alone.
     """
 
-    df_af = frequencies(df_uni, samples)
+    if start < 5:
+        rows = len(df)
+        with Run_report.stage("MAE", rows):
+            df = MAE(df, samples, workers, counters)
+        Stage_counters.count_rows(counters, "SNPs_ready", rows, len(df))
+
+        save(df, path.join(out_dir, "SNPs_ready"), fmt, append)
+        checkpoint(cache, "SNPs_ready", fmt)
+
+    return models
+
+
+def drop_duplicate_keys(df, table, duplicates=None):
+    # Keep the first row of the coordinates that are repeated in a table. The repeated coordinates are added to the
+    # list duplicates when it is given.
+    repeated = df.duplicated(subset=["CHROM", "POS"]).to_numpy()
+    if repeated.any():
+        print("WARNING: ", int(repeated.sum()), " repeated coordinates in ", table, " will be dropped")
+        if duplicates is not None:
+            duplicates.append(df.loc[repeated, ["CHROM", "POS"]].assign(Table=table))
+        df = df[~repeated]
+    return df
 
-    df_mae = MAE(df_af, samples)
 
-    df_mae.to_csv("SNPs_ready.csv")
+def merge_tables(PSG1, PSG2, duplicates=None, counters=None):
+    # Merge the tables of the two pseudogenomes on the common chromosome and position. Repeated coordinates are dropped
+    # so each SNP gives one row, and the annotation columns are kept once, from PSG1.
+    rows = [len(PSG1), len(PSG2)]
+    with Run_report.stage("Merge", sum(rows)):
+        PSG1 = drop_duplicate_keys(PSG1, "PSG1", duplicates)
+        PSG2 = drop_duplicate_keys(PSG2, "PSG2", duplicates)
+        shared = [col for col in ANNOTATION_COLUMNS if col in PSG1.columns and col in PSG2.columns]
+        df = pd.merge(PSG1, PSG2.drop(columns=shared), on=('CHROM', 'POS'))
+    Stage_counters.count_rows(counters, "Merge", sum(rows), len(df))
+    Stage_counters.count(counters, "Merge", "tables", "PSG1", rows[0])
+    Stage_counters.count(counters, "Merge", "tables", "PSG2", rows[1])
+    Stage_counters.count(counters, "Merge", "dropped", "repeated_PSG1", rows[0] - len(PSG1))
+    Stage_counters.count(counters, "Merge", "dropped", "repeated_PSG2", rows[1] - len(PSG2))
+    Stage_counters.count(counters, "Merge", "dropped", "not_in_PSG2", len(PSG1) - len(df))
+    Stage_counters.count(counters, "Merge", "dropped", "not_in_PSG1", len(PSG2) - len(df))
+    return df
+
+
+def contig_order(file_names, chunksize):
+    # Order of the chromosomes in coordinate-sorted tables. Only the CHROM column is read. The tables can miss some
+    # chromosomes, but the ones they share must come in the same order.
+    orders = []
+    for file_name in file_names:
+        order = []
+        for chunk in read_chromosomes(file_name, chunksize):
+            chrom = chunk.astype(str).to_numpy()
+            starts = np.concatenate([[0], np.flatnonzero(chrom[1:] != chrom[:-1]) + 1])
+            for contig in chrom[starts]:
+                if order and order[-1] == contig:
+                    continue
+                if contig in order:
+                    raise ValueError("The table " + file_name + " is not sorted by coordinates: the chromosome " +
+                                     contig + " is not in one block")
+                order.append(contig)
+        orders.append(order)
+
+    # Join the two orders keeping the position of the chromosomes that are only in one table
+    order1, order2 = orders
+    in1 = set(order1)
+    in2 = set(order2)
+    contigs = []
+    i = 0
+    j = 0
+    while i < len(order1) or j < len(order2):
+        if j < len(order2) and order2[j] not in in1:
+            contigs.append(order2[j])
+            j = j + 1
+        elif i < len(order1) and order1[i] not in in2:
+            contigs.append(order1[i])
+            i = i + 1
+        elif i < len(order1) and j < len(order2) and order1[i] == order2[j]:
+            contigs.append(order1[i])
+            i = i + 1
+            j = j + 1
+        else:
+            raise ValueError("The chromosomes of " + file_names[0] + " and " + file_names[1] +
+                             " are not in the same order")
+    return contigs
+
+
+def sort_merge(PSG1_name, PSG2_name, chunksize, duplicates=None, samples=None, PSGs=(None, None), counters=None):
+    # Streaming sort-merge join of two coordinate-sorted tables. Both tables are read in chunks in lockstep and the rows
+    # whose coordinates are complete in both buffers are merged and returned, in chunks of at most chunksize rows with
+    # the index numbered along the whole table. The memory depends on the chunk size and not on the table size.
+    ranks = {contig: rank for rank, contig in enumerate(contig_order([PSG1_name, PSG2_name], chunksize))}
+    names = [PSG1_name, PSG2_name]
+    readers = [read_snps(PSG1_name, samples, PSGs[0], chunksize=chunksize),
+               read_snps(PSG2_name, samples, PSGs[1], chunksize=chunksize)]
+    buffers = [None, None]
+    keys = [np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)]
+    last_keys = [-1, -1]
+    finished = [False, False]
+    end_key = np.iinfo(np.int64).max
+    start = 0
+
+    def read(k):
+        # Add the next chunk of table k to its buffer
+        with Run_report.stage("Read") as record:
+            chunk = next(readers[k], None)
+            record["rows"] = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            finished[k] = True
+            return
+        # Coordinates as one sortable key: rank of the chromosome and position
+        chunk_keys = (chunk["CHROM"].astype(str).map(ranks).to_numpy(dtype=np.int64) << 32) + chunk["POS"].to_numpy(
+            dtype=np.int64)
+        if (len(chunk_keys) > 0 and chunk_keys[0] < last_keys[k]) or (np.diff(chunk_keys) < 0).any():
+            raise ValueError("The table " + names[k] + " is not sorted by coordinates")
+        if len(chunk_keys) > 0:
+            last_keys[k] = chunk_keys[-1]
+        buffers[k] = chunk if buffers[k] is None else Table_format.concatenate([buffers[k], chunk])
+        keys[k] = np.concatenate([keys[k], chunk_keys])
+
+    while True:
+        for k in (0, 1):
+            while not finished[k] and len(keys[k]) == 0:
+                read(k)
+
+        # The rows before the last coordinate of an unfinished buffer are complete, as the next chunks come after it
+        limits = [end_key if finished[k] else keys[k][-1] for k in (0, 1)]
+        boundary = min(limits)
+        if boundary == end_key:
+            ready = [len(keys[0]), len(keys[1])]
+        else:
+            ready = [int(np.searchsorted(keys[k], boundary, side="left")) for k in (0, 1)]
+        if ready[0] == 0 and ready[1] == 0:
+            if boundary == end_key:
+                break
+            # Only rows with the boundary coordinate are left, read further in the tables that end there
+            for k in (0, 1):
+                if not finished[k] and limits[k] == boundary:
+                    read(k)
+            continue
+
+        parts = []
+        for k in (0, 1):
+            parts.append(buffers[k].iloc[:ready[k]])
+            buffers[k] = buffers[k].iloc[ready[k]:]
+            keys[k] = keys[k][ready[k]:]
+        df = merge_tables(parts[0], parts[1], duplicates, counters)
+        for chunk_start in range(0, len(df), chunksize):
+            chunk = df.iloc[chunk_start:chunk_start + chunksize]
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start = start + len(chunk)
+            # The categories of the chunk come from its own rows and not from the rows left in the buffers
+            yield encode_genotypes(Table_format.categorize(chunk))
+
+
+def stream(PSG1_name, PSG2_name, samples, PSGs, consensus, chunksize, duplicates=None, workers=1, fmt="csv",
+           min_depth=10, counters=None):
+    # Run the wrangling in chunks of merged SNPs, so the memory depends on the chunk size and not on the genome size.
+    # All the outputs are appended chunk by chunk and the counters of the chunks are added.
+    models_start = 0
+    for i, chunk in enumerate(sort_merge(PSG1_name, PSG2_name, chunksize, duplicates, samples, PSGs, counters)):
+        Stage_counters.log(counters, 1, "Wrangling chunk ", i + 1, " with ", len(chunk), " SNPs")
+        models_start = models_start + wrangle(chunk, samples, PSGs, consensus, append=i > 0,
+                                              models_start=models_start, workers=workers, fmt=fmt,
+                                              min_depth=min_depth, counters=counters)
+
+
+def shard_ranges(chrom, shards):
+    # Split the rows into at most the given number of shards. The shards are made of consecutive chromosomes, or groups
+    # of contigs in fragmented assemblies, with similar numbers of rows. Returns the (start, end) rows of each shard.
+    chrom = np.asarray(chrom)
+    boundaries = np.concatenate([[0], np.flatnonzero(chrom[1:] != chrom[:-1]) + 1, [len(chrom)]])
+    cuts = []
+    for target in len(chrom) * np.arange(1, shards) / shards:
+        k = min(int(np.searchsorted(boundaries, target)), len(boundaries) - 1)
+        cut = boundaries[k] if target - boundaries[k - 1] > boundaries[k] - target else boundaries[k - 1]
+        if 0 < cut < len(chrom) and cut not in cuts:
+            cuts.append(int(cut))
+    cuts = [0] + sorted(cuts) + [len(chrom)]
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def wrangle_shard(shard):
+    # Run the whole wrangling on one shard in its own folder. This is the task of the processes of the sharded run.
+    # Returns the number of genotype models, the counters and the run report of the shard. The profiles of the stages of
+    # the shard are written with the name of the shard.
+    df, samples, PSGs, consensus, out_dir, fmt, min_depth, verbosity, report_settings = shard
+    os.makedirs(path.join(out_dir, "temp"), exist_ok=True)
+    counters = Stage_counters.new_counters(verbosity)
+    Run_report.start(*report_settings)
+    models = wrangle(df, samples, PSGs, consensus, out_dir=out_dir, fmt=fmt, min_depth=min_depth, counters=counters)
+    Run_report.dump_profiles("_" + path.basename(out_dir))
+    return models, counters, Run_report.report["stages"]
+
+
+def concatenate_shards(shard_dirs, models, fmt="csv"):
+    # Join the outputs of the shards in the order of the shards, which is the coordinate order. The genotype models are
+    # numbered along the whole table. The binary tables of the shards become the chunks of the joined tables.
+    with open(MODELS_FILE, "w") as output:
+        models_start = 0
+        for k, shard_dir in enumerate(shard_dirs):
+            models_df = pd.read_csv(path.join(shard_dir, MODELS_FILE), index_col=0)
+            models_df.index = models_df.index + models_start
+            models_df.to_csv(output, header=k == 0)
+            models_start = models_start + models[k]
+
+    for name in WRANGLING_TABLES:
+        shard_files = [Table_format.table_file(path.join(shard_dir, name), fmt) for shard_dir in shard_dirs]
+        if fmt != "csv":
+            Table_format.join_tables(shard_files, name, fmt)
+            continue
+        with open(Table_format.table_file(name, fmt), "w") as output:
+            for k, shard_file_name in enumerate(shard_files):
+                with open(shard_file_name) as shard_file:
+                    header = shard_file.readline()
+                    if k == 0:
+                        output.write(header)
+                    shutil.copyfileobj(shard_file, output)
+
+
+def shard(df, samples, PSGs, consensus, shards, fmt="csv", min_depth=10, counters=None):
+    # Run the wrangling of the shards of the table in parallel processes and join their outputs and their counters
+    ranges = shard_ranges(df["CHROM"].to_numpy(), shards)
+    shard_dirs = [path.join("temp", "shard_" + str(k + 1)) for k in range(len(ranges))]
+    verbosity = Stage_counters.DEFAULT_VERBOSITY if counters is None else counters["verbosity"]
+    tasks = [(df.iloc[start:end], samples, PSGs, consensus, shard_dir, fmt, min_depth, verbosity, Run_report.settings())
+             for (start, end), shard_dir in zip(ranges, shard_dirs)]
+    Stage_counters.log(counters, 1, "Wrangling ", len(tasks), " shards in parallel")
+    with Pool(len(tasks)) as pool:
+        results = pool.map(wrangle_shard, tasks)
+    models = [shard_models for shard_models, shard_counters, shard_stages in results]
+    for shard_models, shard_counters, shard_stages in results:
+        if counters is not None:
+            Stage_counters.merge(counters, shard_counters)
+        Run_report.merge(shard_stages)
+    concatenate_shards(shard_dirs, models, fmt)
+    for shard_dir in shard_dirs:
+        shutil.rmtree(shard_dir)
+
+
+def parse_arguments():
+    # Options of the workflow
+    parser = argparse.ArgumentParser(description="Wrangling of the SNPs called against two pseudogenomes")
+    parser.add_argument("--psg1", default="SNPs_for_wrangling_Weismann_GF3.csv",
+                        help="SNPs_for_wrangling file of the first pseudogenome, or its VariantsToTable output or vcf, "
+                             "also gzipped")
+    parser.add_argument("--psg2", default="SNPs_for_wrangling_Weismann_KF6.csv",
+                        help="SNPs_for_wrangling file of the second pseudogenome, or its VariantsToTable output or "
+                             "vcf, also gzipped")
+    parser.add_argument("--consensus", choices=["first", "majority"], default="first",
+                        help="How the reference and alternative allele models are built: from the first sample where "
+                             "the SNP is expressed or by majority vote of the heterozygot samples")
+    parser.add_argument("--min-depth", type=int, default=10,
+                        help="Minimum number of reads of a SNP in a sample for the AD10 filter")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="Process the merged SNPs in chunks of this number of rows with bounded memory")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes for the per-sample work of the wrangling stages")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Split the merged SNPs by chromosome in this number of shards and run the whole wrangling "
+                             "of each shard in a parallel process")
+    parser.add_argument("--format", choices=list(Table_format.FORMATS), default=Table_format.DEFAULT_FORMAT,
+                        help="Format of the intermediate tables, from temp/Biallelic_SNPs to SNPs_ready. The binary "
+                             "formats keep the column types and need pyarrow")
+    parser.add_argument("--cache", default=None,
+                        help="Folder of the stage cache. The outputs of each stage are reused while the input files and "
+                             "the parameters do not change, and an interrupted run resumes after the last completed "
+                             "stage")
+    parser.add_argument("--cache-size", type=int, default=Stage_cache.DEFAULT_SIZE,
+                        help="Maximum size of the stage cache in megabytes. The entries used least recently are deleted "
+                             "first")
+    parser.add_argument("--tensor", action="store_true",
+                        help="Also write the allele depths and genotypes of SNPs_ready as arrays in the folder "
+                             "SNPs_ready_counts, which QC.py and Stats.py open memory-mapped")
+    parser.add_argument("--verbosity", type=int, choices=[0, 1, 2], default=Stage_counters.DEFAULT_VERBOSITY,
+                        help="Lines printed while the stages run: 0 only the warnings, 1 one line for each stage, 2 also "
+                             "the lines for each sample and pair of samples. The counters of all the stages are "
+                             "written in " + SUMMARY_FILE + " in any case")
+    parser.add_argument("--profile", default=None,
+                        help="Folder where the cProfile statistics of each stage are written, as stage + '.prof'")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Measure the peak memory allocated by Python in each stage with tracemalloc, which slows "
+                             "the run down")
+    args = parser.parse_args()
+    if args.shards > 1 and (args.chunksize or args.workers > 1):
+        parser.error("--shards cannot be combined with --chunksize or --workers")
+    return args
+
+
+def main():
+    """
+    Input the files and convert them into data frames
+    """
+
+    args = parse_arguments()
+    Run_report.start(args.profile, args.trace_memory)
+
+    # Read the sample names and the codes for each pseudogenome:
+    """
+    sample_names = pd.read_csv(input("Please enter the file name that has the sample names:\n"))
+    PSG_codes = pd.read_csv(input("Please enter the file name that has the pseudogenomes codes:\n"))"
+    """
+
+    sample_names = pd.read_csv("Sample_names_Weismann.csv")
+    PSG_codes = pd.read_csv("Pseudogenome_codes.csv")
+
+    # Create arrays of the sample names and the pseudogenome codes
+    samples = sample_names['Sample_name'].values
+    PSGs = PSG_codes['PSGs'].values
+
+    """
+     MERGE THE DATAFRAMES 
+    -----------------------
+    
+    The format of the table is the same for both dataframes. Columns from 1 to 6 are:
+        CHROM: Chromosome,
+        POS: position,
+        Gene.refGene: Gene_ID
+        Func.refGene: Annotation of the function for this SNP
+        ExonicFunc.refGene: Annotation of the function if this SNP is exonic
+        AF: Allele frequency estimated for all the samples
+    
+    From column 7th till the end there will be 4 columns for each sample. The structure of the column name is
+    as follows:
+        NAME (determined by the sample name)
+        _R or _A (reference or alternative allele)
+        _??? (The pseudogenome code)
+        .AD (allele depth)
+        .GT (Genotype)
+    
+    Instead of the csv tables, "--psg1" and "--psg2" can be the outputs of VariantsToTable (".table", ".tsv" or ".txt")
+    or the vcf files annotated by annovar (".vcf"), also compressed with gzip. Their AD and GT fields are split into the
+    four columns of each sample while they are read, with the pseudogenome codes of "Pseudogenome_codes.csv" in the
+    order of the two files.
+    
+    The next step is to merge the two dataframes on the common chromosome and position. The annotation columns are the
+    same in both tables and are kept once. If a chromosome and position is repeated in a table only its first row is 
+    merged, and the repeated coordinates are reported in the file "temp/Duplicate_SNPs.csv". The genotypes of both 
+    pseudogenomes are then encoded with the same integer allele codes, and all the comparisons of genotypes in the next
+    steps are done on these codes.
+
+    With "--chunksize" the two tables are joined by a streaming sort-merge: they are read in chunks in lockstep and 
+    every chunk of merged SNPs goes through all the steps before the next one is read. The tables must be sorted by 
+    coordinates as in the output of GATK VariantsToTable.
+
+    With "--shards" the merged table is split in groups of consecutive chromosomes and all the steps run for each group
+    in a parallel process. All the steps work SNP by SNP, so the outputs of the shards joined in order are the same as
+    the outputs of the whole table.
+
+    The intermediate tables, from "temp/Biallelic_SNPs" to "SNPs_ready", are written in the format chosen with 
+    "--format": parquet (the default when pyarrow is installed), feather or csv. The binary formats keep the types of the
+    columns and are read by QC.py without parsing text.
+
+    With "--cache" the outputs of each stage are kept in a cache with a key made from the content of the input files and
+    the parameters. The stages already in the cache are copied back instead of computed, and the run goes on from the
+    last of them. With "--chunksize" or "--shards" the outputs are cached at the end of the run and only a complete run
+    is reused.
+
+    The rows in and out of each stage, the rows dropped for each reason and the hits of each genotype case, in total
+    and by sample, are written at the end in "Wrangling_summary.json", and the coordinates of the SNPs that matched no
+    case in "temp/Unclassified_coordinates.csv". "--verbosity" sets how many lines are printed while the stages run.
+
+    The wall time, CPU time, peak memory and rows per second of each stage are written in "Wrangling_report.json".
+    "--profile" also writes the cProfile statistics of each stage in a folder, and "--trace-memory" measures the peak
+    memory allocated by Python in each stage.
+
+    With "--tensor" the allele depths and the genotypes of "SNPs_ready" are also written as arrays of SNPs x samples x 
+    alleles in the folder "SNPs_ready_counts", with the layout of the samples and the experimental groups.
+    """
+
+    stages = [stage for stage, tables in WRANGLING_STAGES]
+    counters = Stage_counters.new_counters(args.verbosity)
+    cache = None
+    start = 0
+    if args.cache:
+        inputs = [args.psg1, args.psg2, "Sample_names_Weismann.csv", "Pseudogenome_codes.csv", "Samples_MAE.csv"]
+        parameters = {"consensus": args.consensus, "format": args.format, "min_depth": args.min_depth}
+        keys = Stage_cache.stage_keys(stages, inputs, parameters)
+        cache = (args.cache, keys, args.cache_size)
+        done = Stage_cache.last_completed(args.cache, stages, keys)
+        if done == len(stages) - 1 or not (args.chunksize or args.shards > 1):
+            for stage in stages[:done + 1]:
+                if Stage_cache.completed(args.cache, keys[stage]):
+                    Stage_cache.restore(args.cache, keys[stage])
+                    Stage_counters.count(counters, stage, "restored", 1)
+            start = done + 1
+
+    duplicates = []
+    if start == len(stages):
+        Stage_counters.log(counters, 1, "All the stages restored from the cache")
+    elif start > 0:
+        # Resume after the last stage in the cache
+        df = load(WRANGLING_STAGES[start - 1][1][-1], args.format)
+        wrangle(df, samples, PSGs, args.consensus, workers=args.workers, fmt=args.format, start=start, cache=cache,
+                min_depth=args.min_depth, counters=counters)
+    elif args.chunksize:
+        stream(args.psg1, args.psg2, samples, PSGs, args.consensus, args.chunksize, duplicates, args.workers,
+               args.format, args.min_depth, counters)
+    else:
+        # Read the dataframe and convert it into pandas dataframe. PSG stands for pseudogenome:
+        with Run_report.stage("Read") as record:
+            PSG1 = read_snps(args.psg1, samples, PSGs[0])
+            PSG2 = read_snps(args.psg2, samples, PSGs[1])
+            record["rows"] = len(PSG1) + len(PSG2)
+
+        df = merge_tables(PSG1, PSG2, duplicates, counters)
+        df = encode_genotypes(df)
+        del PSG1, PSG2
+        Stage_counters.log(counters, 1, 'Files merged')
+
+        if args.shards > 1:
+            with Run_report.stage("Shards", len(df)):
+                shard(df, samples, PSGs, args.consensus, args.shards, args.format, args.min_depth, counters)
+        else:
+            wrangle(df, samples, PSGs, args.consensus, workers=args.workers, fmt=args.format, cache=cache,
+                    min_depth=args.min_depth, counters=counters)
+
+    if cache is not None and start == 0 and (args.chunksize or args.shards > 1):
+        for stage in stages:
+            checkpoint(cache, stage, args.format)
+
+    if args.tensor:
+        # Arrays of SNPs x samples x alleles with the layout of the samples and the experimental groups
+        layout = Count_tensor.read_layout("Sample_names_Weismann.csv", "Experimental_groups.csv")
+        with Run_report.stage("Tensor") as record:
+            record["rows"] = len(Count_tensor.from_table(load("SNPs_ready", args.format), layout,
+                                                         folder=TENSOR_FOLDER).ad)
+        Stage_counters.log(counters, 1, "Allele depths and genotypes of SNPs_ready written in ", TENSOR_FOLDER)
+
+    if duplicates:
+        pd.concat(duplicates).to_csv(path.join("temp", "Duplicate_SNPs.csv"), index=False)
+
+    Stage_counters.report_errors(counters, UNCLASSIFIED_FILE)
+    Stage_counters.write_summary(counters, SUMMARY_FILE, UNCLASSIFIED_FILE)
+    Stage_counters.log(counters, 1, "Counters of the stages written in ", SUMMARY_FILE)
+    Run_report.write(REPORT_FILE)
 
 
 if __name__ == '__main__':
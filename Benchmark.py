@@ -0,0 +1,369 @@
+# Python 3.7
+# Benchmark.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+Benchmark of the stages of the workflow on synthetic data. For each number of SNPs, the tables and the design files are
+written by Synthetic_data in a folder of the work directory, and each stage is timed on the output of the stage before:
+    multiallelic, sample_average, AD10, genotype and MAE from ASE_data_wrangling
+    allele_freqs from QC
+    chi_square, Fisher, binomial and correction from Stats
+The stages run in a separate process for each implementation, so the peak memory of a run is not raised by the
+previous ones. A stage that fails is recorded with its error and the next stages run on its input.
+
+The outputs of the stages are compared with the outputs of a frozen reference implementation: a copy of the modules of
+the workflow made with "--freeze" in the reference folder, for example before an optimization, or with
+"--freeze-commit" from a commit such as the baseline. The reference runs on the same data and the comparison records
+whether each output is the same, with a relative tolerance for the floats.
+
+How the input is read and how each stage is called is in Benchmark_stages.py, which is frozen with the modules, so each
+implementation runs its stages with its own signatures. The modules frozen from a commit without Benchmark_stages.py get
+the one of an adapter of "--adapter", such as Benchmark_baseline.py for the original signatures of the baseline.
+
+Each run adds a line for each size and stage to the history file, with the commit, the times, the rows per second, the
+time of the reference and whether the outputs match, so the times can be followed across the commits.
+
+Sizes can be written as 10k, 100k, 1M or 10M. The sizes above a few millions of SNPs need a lot of memory with many
+samples, choose the number of samples of each group with "--samples".
+"""
+
+import argparse
+import contextlib
+import csv
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+from os import path
+
+import pandas as pd
+
+import Synthetic_data
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Folder of this script, with the modules of the current implementation
+SCRIPT_DIR = path.dirname(path.abspath(__file__))
+
+# Stages in the order they run
+STAGES = ["multiallelic", "sample_average", "AD10", "genotype", "MAE", "allele_freqs", "chi_square", "Fisher",
+          "binomial", "correction"]
+
+BENCHMARK_DIR = "benchmarks"
+REFERENCE_DIR = path.join(BENCHMARK_DIR, "reference")
+WORK_DIR = path.join(BENCHMARK_DIR, "work")
+HISTORY_FILE = path.join(BENCHMARK_DIR, "history.csv")
+FROZEN_FILE = "FROZEN.json"
+TIMES_FILE = "times.json"
+
+HISTORY_COLUMNS = ["date", "commit", "snps", "samples", "stage", "wall_s", "cpu_s", "rows_in", "rows_out",
+                   "rows_per_s", "peak_rss_mb", "reference_commit", "reference_wall_s", "speedup", "match", "error"]
+
+# Module with the stages of an implementation, frozen with it
+STAGES_MODULE = "Benchmark_stages"
+
+# Stages of the implementations frozen from a commit without STAGES_MODULE, by version
+ADAPTERS = {"baseline": "Benchmark_baseline.py"}
+DEFAULT_ADAPTER = "baseline"
+
+# Modules that are not copied in the frozen reference
+TOOLS = ["Benchmark.py", "Synthetic_data.py"] + list(ADAPTERS.values())
+
+# Relative tolerance of the floats when the outputs are compared
+RTOL = 1e-9
+
+SUFFIXES = {"k": 1000, "M": 1000000}
+
+
+def parse_size(size):
+    # Number of SNPs from "10000", "10k" or "1M"
+    if size[-1] in SUFFIXES:
+        return int(float(size[:-1]) * SUFFIXES[size[-1]])
+    return int(size)
+
+
+def git_commit(folder=SCRIPT_DIR):
+    # Commit of the modules, with "+" when they have changes that are not committed, None out of a repository
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=folder, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+        changed = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=folder,
+                                 stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + "+" if changed else commit
+
+
+def git_output(*command):
+    # Output of a git command in the folder of this script
+    return subprocess.run(["git"] + list(command), cwd=SCRIPT_DIR, stdout=subprocess.PIPE, check=True).stdout
+
+
+def freeze(folder, commit=None, adapter=DEFAULT_ADAPTER):
+    """
+    Copy the modules of the workflow in a folder, as the reference implementation of the next benchmarks.
+
+    :param folder: reference folder, replaced if it exists
+    :param commit: commit whose modules are copied, the current modules if it is not given
+    :param adapter: version of the stages in ADAPTERS used when the modules have no STAGES_MODULE
+    """
+    if path.exists(folder):
+        shutil.rmtree(folder)
+    os.makedirs(folder)
+    if commit is None:
+        names = sorted(os.listdir(SCRIPT_DIR))
+    else:
+        names = sorted(git_output("ls-tree", "--name-only", commit).decode().split())
+    for name in names:
+        if name.endswith(".py") and name not in TOOLS:
+            if commit is None:
+                shutil.copy2(path.join(SCRIPT_DIR, name), folder)
+            else:
+                with open(path.join(folder, name), "wb") as file:
+                    file.write(git_output("show", commit + ":" + name))
+    stages = "own"
+    if not path.exists(path.join(folder, STAGES_MODULE + ".py")):
+        shutil.copy2(path.join(SCRIPT_DIR, ADAPTERS[adapter]), path.join(folder, STAGES_MODULE + ".py"))
+        stages = adapter
+    frozen = git_commit() if commit is None else git_output("rev-parse", "--short", commit).decode().strip()
+    with open(path.join(folder, FROZEN_FILE), "w") as file:
+        json.dump({"commit": frozen, "stages": stages, "date": datetime.now().isoformat(timespec="seconds")}, file,
+                  indent=2)
+    print("Reference implementation frozen in ", folder, " from ", frozen, " with the stages ", stages)
+
+
+def frozen_commit(folder):
+    with open(path.join(folder, FROZEN_FILE)) as file:
+        return json.load(file)["commit"]
+
+
+def peak_rss():
+    # Peak resident memory of the process in megabytes, ru_maxrss is in kilobytes and in bytes on macOS
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def run_stages(folder, implementation, outputs, name, repeat=1, check=True):
+    """
+    Time the stages of an implementation on the data of a folder. It runs in its own process, started by benchmark.
+
+    :param folder: folder with the tables and the design files written by Synthetic_data
+    :param implementation: folder with the modules of the workflow
+    :param outputs: folder for the times and the output table of each stage
+    :param name: name of the experiment in the file names
+    :param repeat: runs of each stage, the shortest is kept
+    :param check: write the output of each stage to compare it
+    """
+    # The modules of the implementation, with its stages, are imported before the ones of the folder of this script
+    if not path.exists(path.join(implementation, STAGES_MODULE + ".py")):
+        raise FileNotFoundError("No " + STAGES_MODULE + ".py in " + implementation + ", freeze the reference again")
+    sys.path.insert(0, path.abspath(implementation))
+    Stages = importlib.import_module(STAGES_MODULE)
+    outputs = path.abspath(outputs)
+    os.makedirs(outputs, exist_ok=True)
+
+    # The stages read "Samples_MAE.csv" from the working directory
+    os.chdir(folder)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        df, design = Stages.read_input(name)
+
+    functions = Stages.stage_functions(design)
+    times = {}
+    for stage in STAGES:
+        record = {"rows_in": len(df)}
+        if stage not in functions:
+            # The stages that are not in an implementation are skipped, the next ones run on their input
+            record["error"] = "Stage not in this implementation"
+            record["peak_rss_mb"] = peak_rss()
+            times[stage] = record
+            continue
+        try:
+            for k in range(repeat):
+                data = df.copy() if k < repeat - 1 else df
+                wall = time.perf_counter()
+                cpu = time.process_time()
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    output = functions[stage](data)
+                wall = time.perf_counter() - wall
+                cpu = time.process_time() - cpu
+                if "wall_s" not in record or wall < record["wall_s"]:
+                    record["wall_s"], record["cpu_s"] = wall, cpu
+            record["rows_out"] = len(output)
+            df = output
+            if check:
+                df.to_pickle(path.join(outputs, stage + ".pkl"))
+        except Exception as error:
+            # The next stages run on the input of the stage that failed
+            record["error"] = type(error).__name__ + ": " + str(error).splitlines()[0] if str(error) else \
+                type(error).__name__
+        record["peak_rss_mb"] = peak_rss()
+        times[stage] = record
+
+    with open(path.join(outputs, TIMES_FILE), "w") as file:
+        json.dump(times, file, indent=2)
+
+
+def start_run(folder, implementation, outputs, args):
+    # Run the stages of an implementation in a new process and read its times
+    command = [sys.executable, path.abspath(__file__), "--run", folder, "--implementation", implementation,
+               "--outputs", outputs, "--name", args.name, "--repeat", str(args.repeat)]
+    if args.no_check:
+        command.append("--no-check")
+    subprocess.run(command, check=True)
+    with open(path.join(outputs, TIMES_FILE)) as file:
+        return json.load(file)
+
+
+def comparable(df):
+    # Categories are compared as their values, as an implementation can keep the genotypes as strings
+    columns = {col: df[col].astype(object) for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)}
+    return df.assign(**columns) if columns else df
+
+
+def same_output(file_name, reference_file):
+    # True when the outputs of a stage match, with the floats compared with the relative tolerance RTOL
+    if not path.exists(file_name) or not path.exists(reference_file):
+        return None
+    try:
+        pd.testing.assert_frame_equal(comparable(pd.read_pickle(file_name)), comparable(pd.read_pickle(reference_file)),
+                                      check_dtype=False, check_index_type=False, check_column_type=False,
+                                      check_like=True, check_exact=False, rtol=RTOL)
+    except AssertionError as difference:
+        print("WARNING: ", path.basename(file_name), " differs from the reference: ", str(difference).splitlines()[0])
+        return False
+    return True
+
+
+def write_history(rows, file_name):
+    # Add the lines of the run to the history file
+    if path.dirname(file_name):
+        os.makedirs(path.dirname(file_name), exist_ok=True)
+    new = not path.exists(file_name)
+    with open(file_name, "a", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=HISTORY_COLUMNS)
+        if new:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
+def previous_times(file_name, snps, samples):
+    # Wall time of each stage in the last run of the history with the same size
+    if not path.exists(file_name):
+        return {}
+    history = pd.read_csv(file_name)
+    history = history[(history["snps"] == snps) & (history["samples"] == samples)]
+    return dict(zip(history["stage"], history["wall_s"]))
+
+
+def benchmark(sizes, args):
+    """
+    Benchmark the stages for each size and add the results to the history.
+
+    :param sizes: numbers of SNPs
+    :param args: options of the command line
+    """
+    reference = args.reference if path.exists(path.join(args.reference, FROZEN_FILE)) else None
+    if reference is None:
+        print("WARNING: No reference implementation in ", args.reference, ", freeze one with --freeze")
+    commit = git_commit()
+    reference_commit = frozen_commit(reference) if reference is not None else None
+    date = datetime.now().isoformat(timespec="seconds")
+
+    for snps in sizes:
+        config = Synthetic_data.Config(snps=snps, samples=args.samples, seed=args.seed, name=args.name)
+        folder = path.abspath(path.join(args.work, str(snps)))
+        print("Synthetic data with ", snps, " SNPs in ", folder)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            Synthetic_data.write(config, folder)
+
+        current_dir = path.join(folder, "current")
+        times = start_run(folder, SCRIPT_DIR, current_dir, args)
+        reference_times = {}
+        if reference is not None:
+            reference_dir = path.join(folder, "reference")
+            reference_times = start_run(folder, path.abspath(reference), reference_dir, args)
+
+        previous = previous_times(args.history, snps, args.samples)
+        rows = []
+        print("{:<16}{:>12}{:>14}{:>12}{:>12}{:>10}".format("Stage", "Wall (s)", "Rows/s", "Previous", "Reference",
+                                                            "Match"))
+        for stage in STAGES:
+            record = times[stage]
+            wall = record.get("wall_s")
+            reference_wall = reference_times.get(stage, {}).get("wall_s")
+            match = None
+            if reference is not None and not args.no_check:
+                match = same_output(path.join(current_dir, stage + ".pkl"), path.join(reference_dir, stage + ".pkl"))
+            rows.append({"date": date, "commit": commit, "snps": snps, "samples": args.samples, "stage": stage,
+                         "wall_s": wall, "cpu_s": record.get("cpu_s"), "rows_in": record["rows_in"],
+                         "rows_out": record.get("rows_out"),
+                         "rows_per_s": record["rows_in"] / wall if wall else None,
+                         "peak_rss_mb": record["peak_rss_mb"], "reference_commit": reference_commit,
+                         "reference_wall_s": reference_wall,
+                         "speedup": reference_wall / wall if wall and reference_wall else None,
+                         "match": match, "error": record.get("error")})
+            print("{:<16}{:>12}{:>14}{:>12}{:>12}{:>10}".format(
+                stage, "-" if wall is None else "{:.3f}".format(wall),
+                "-" if not wall else "{:.0f}".format(record["rows_in"] / wall),
+                "-" if pd.isna(previous.get(stage, None)) else "{:.3f}".format(previous[stage]),
+                "-" if reference_wall is None else "{:.3f}".format(reference_wall), str(match)))
+            if "error" in record:
+                print("    ERROR: ", record["error"])
+        write_history(rows, args.history)
+        if not args.keep:
+            shutil.rmtree(folder)
+    print("Benchmark history written in ", args.history)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark of the stages of the workflow on synthetic data")
+    parser.add_argument("--sizes", nargs="+", default=["10k", "100k"],
+                        help="Numbers of SNPs, as 10k, 100k, 1M or 10M")
+    parser.add_argument("--samples", type=int, default=Synthetic_data.Config().samples,
+                        help="Number of samples of each group of the synthetic data")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument("--name", default=Synthetic_data.Config().name, help="Name of the experiment in the file names")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs of each stage, the shortest is kept")
+    parser.add_argument("--reference", default=REFERENCE_DIR, help="Folder of the frozen reference implementation")
+    parser.add_argument("--freeze", action="store_true",
+                        help="Copy the current modules in the reference folder before the benchmark")
+    parser.add_argument("--freeze-commit",
+                        help="Copy the modules of this commit in the reference folder before the benchmark, for "
+                             "example the baseline")
+    parser.add_argument("--adapter", choices=list(ADAPTERS), default=DEFAULT_ADAPTER,
+                        help="Stages of the modules frozen from a commit without " + STAGES_MODULE + ".py")
+    parser.add_argument("--no-check", action="store_true", help="Do not compare the outputs with the reference")
+    parser.add_argument("--history", default=HISTORY_FILE, help="csv file with the results of the runs")
+    parser.add_argument("--work", default=WORK_DIR, help="Folder for the synthetic data and the outputs")
+    parser.add_argument("--keep", action="store_true", help="Keep the synthetic data and the outputs")
+    # Options of the process that runs the stages of an implementation
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    parser.add_argument("--implementation", help=argparse.SUPPRESS)
+    parser.add_argument("--outputs", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.run is not None:
+        run_stages(args.run, args.implementation, args.outputs, args.name, args.repeat, not args.no_check)
+        return
+    if args.freeze or args.freeze_commit:
+        freeze(args.reference, args.freeze_commit, args.adapter)
+    benchmark([parse_size(size) for size in args.sizes], args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# Python 3.7
+# Benchmark_baseline.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+Stages of the benchmark for the versions of the workflow frozen from a commit without Benchmark_stages.py, as the
+baseline sample-by-sample workflow. The stages are called with their original signatures, as the main functions of
+these versions call them: the tables are read with pandas.read_csv and merged with pandas.merge, the allele frequencies
+of the samples are added before MAE and there is no stage of correction of the p-values.
+
+Benchmark.py copies this module as the Benchmark_stages.py of such a reference, so it has the same functions.
+"""
+
+import pandas as pd
+
+import ASE_data_wrangling as ASE
+import QC
+import Stats
+
+
+def read_input(name):
+    # Design of the experiment and merged table of SNPs written by Synthetic_data in the working directory
+    design = {"samples": pd.read_csv("Sample_names_" + name + ".csv")["Sample_name"].values,
+              "PSGs": pd.read_csv("Pseudogenome_codes.csv")["PSGs"].values,
+              "groups_df": pd.read_csv("Experimental_groups.csv"),
+              "exp": pd.read_csv("Experimental_design_" + name + ".csv")}
+    design["experiments"] = list(design["exp"]["Test_ID"])
+    PSGs = design["PSGs"]
+    PSG1 = pd.read_csv("SNPs_for_wrangling_" + name + "_" + PSGs[0] + ".csv", low_memory=False)
+    PSG2 = pd.read_csv("SNPs_for_wrangling_" + name + "_" + PSGs[1] + ".csv", low_memory=False)
+    return pd.merge(PSG1, PSG2, on=('CHROM', 'POS')), design
+
+
+def stage_functions(design):
+    # Function of each stage, from the table of the stage before to its output table
+    samples, PSGs, exp, experiments = design["samples"], design["PSGs"], design["exp"], design["experiments"]
+    group_names = list(design["groups_df"]["Group"])
+
+    def sample_average(df):
+        # The versions that drop the SNPs that matched no case return their mask after the columns
+        average = ASE.sample_average(df, samples, PSGs)
+        df = average[0].drop(columns=average[0].columns[average[1]])
+        return df[~average[2]] if len(average) > 2 else df
+
+    return {"multiallelic": lambda df: ASE.multiallelic(df, samples, PSGs, []),
+            "sample_average": sample_average,
+            "AD10": lambda df: ASE.AD10(df, samples),
+            "genotype": lambda df: ASE.genotype(df, samples),
+            "MAE": lambda df: ASE.MAE(ASE.frequencies(df, samples), samples),
+            "allele_freqs": lambda df: QC.allele_freqs(group_names, df),
+            "chi_square": lambda df: Stats.chi_square(df, samples, exp, experiments),
+            "Fisher": lambda df: Stats.Fisher(df, samples, exp, experiments),
+            "binomial": lambda df: Stats.binomial(df, samples)}
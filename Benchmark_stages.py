@@ -0,0 +1,63 @@
+# Python 3.7
+# Benchmark_stages.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+Stages of the benchmark for this version of the workflow: how the input of the first stage is read from the synthetic
+data and how each stage is called, from the table of the stage before to its output table.
+
+The module is frozen with the other modules of the workflow in the reference folder of the benchmark, so a reference
+keeps the calls of its own version. When the signature of a stage changes, its call changes here and Benchmark.py
+does not. A stage that is not in the functions of a version is recorded as missing in its run.
+"""
+
+import pandas as pd
+
+import ASE_data_wrangling as ASE
+import Count_tensor
+import QC
+import Stats
+
+
+def read_input(name):
+    """
+    Read the design of the experiment and the merged table of SNPs written by Synthetic_data in the working directory.
+
+    :param name: name of the experiment in the file names
+    :return: merged table of SNPs and a dictionary with the design: samples, PSGs, groups_df, exp and experiments
+    """
+    design = {"samples": pd.read_csv("Sample_names_" + name + ".csv")["Sample_name"].values,
+              "PSGs": pd.read_csv("Pseudogenome_codes.csv")["PSGs"].values,
+              "groups_df": pd.read_csv("Experimental_groups.csv"),
+              "exp": pd.read_csv("Experimental_design_" + name + ".csv")}
+    design["experiments"] = list(design["exp"]["Test_ID"])
+    samples, PSGs = design["samples"], design["PSGs"]
+    PSG1 = ASE.read_snps("SNPs_for_wrangling_" + name + "_" + PSGs[0] + ".csv", samples, PSGs[0])
+    PSG2 = ASE.read_snps("SNPs_for_wrangling_" + name + "_" + PSGs[1] + ".csv", samples, PSGs[1])
+    return ASE.encode_genotypes(ASE.merge_tables(PSG1, PSG2)), design
+
+
+def stage_functions(design):
+    # Function of each stage, from the table of the stage before to its output table
+    samples, PSGs, exp, experiments = design["samples"], design["PSGs"], design["exp"], design["experiments"]
+    group_names = list(design["groups_df"]["Group"])
+    layout = Count_tensor.make_layout(samples, design["groups_df"])
+
+    def sample_average(df):
+        df, cols, unclassified = ASE.sample_average(df, samples, PSGs)
+        df = df.drop(columns=df.columns[cols])
+        return df[~unclassified]
+
+    return {"multiallelic": lambda df: ASE.multiallelic(df, samples, PSGs, []),
+            "sample_average": sample_average,
+            "AD10": lambda df: ASE.AD10(df, samples),
+            "genotype": lambda df: ASE.harmonize(df, samples)[0],
+            "MAE": lambda df: ASE.MAE(df, samples),
+            "allele_freqs": lambda df: QC.allele_freqs(group_names, df, None, layout),
+            "chi_square": lambda df: Stats.chi_square(df, samples, exp, experiments, None, layout),
+            "Fisher": lambda df: Stats.Fisher(df, samples, exp, experiments),
+            "binomial": lambda df: Stats.binomial(df, samples),
+            "correction": lambda df: Stats.correct_pvalues(df, samples, experiments)}
@@ -0,0 +1,247 @@
+# Python 3.7
+# Count_tensor.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+Allele depths and genotypes of all the samples as dense arrays, instead of four columns of the table for each sample.
+
+The allele depths are an array of shape (SNPs, samples, alleles) and the genotypes an array of integer allele codes of
+the same shape. The allele axis has the reference ("_R_") and the alternative ("_A_") allele. The tables before the
+average of the pseudogenomes have a fourth axis with the pseudogenome. The position of a sample and the samples of each
+experimental group come from the layout, built once from the files with the sample names and the experimental groups,
+so the counts of a sample or a group are a slice of the array instead of a search of column names. The groups are also
+a sparse membership matrix of samples x groups, and the depths of SNPs x samples multiplied by the matrix are the depths
+summed over each group, for all the groups at once.
+
+The arrays can be saved in a folder as .npy files and opened memory-mapped, so QC.py and Stats.py read only the counts
+they use.
+"""
+
+import json
+import os
+from collections import namedtuple
+from os import path
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Alleles of the allele axis, as in the column names
+ALLELES = ["_R_", "_A_"]
+
+# Sample names with their position in the arrays and the positions of the samples of each experimental group
+Layout = namedtuple("Layout", ["samples", "positions", "groups", "members"])
+
+# Allele depths and genotype codes, with the categories of the codes, the layout, the chromosome and position of the
+# SNPs and the pseudogenome codes of the fourth axis (None for the tables after the average)
+Counts = namedtuple("Counts", ["ad", "gt", "alleles", "layout", "snps", "PSGs"])
+
+
+def make_layout(samples, groups_df=None):
+    """
+    Layout of the samples and the experimental groups.
+
+    :param samples: sample names in the order of the arrays
+    :param groups_df: dataframe with the group names in the first column and the samples of each group in the next
+        columns, as in "Experimental_groups.csv". Empty cells and samples that are not in samples are left out.
+    :return: Layout
+    """
+    samples = [str(sample) for sample in samples]
+    positions = {sample: k for k, sample in enumerate(samples)}
+    groups = []
+    members = {}
+    if groups_df is not None:
+        for row in groups_df.itertuples(index=False):
+            group = str(row[0])
+            ids = [str(sample) for sample in row[1:] if not pd.isna(sample)]
+            groups.append(group)
+            members[group] = np.array([positions[sample] for sample in ids if sample in positions], dtype=np.intp)
+    return Layout(samples, positions, groups, members)
+
+
+def table_samples(columns):
+    # Samples of a table after the average of the pseudogenomes, in the order of their reference allele depth columns
+    suffix = column("", ALLELES[0], ".AD")
+    return [str(col)[:-len(suffix)] for col in columns if str(col).endswith(suffix) and len(str(col)) > len(suffix)]
+
+
+def read_layout(sample_names="Sample_names.csv", experimental_groups="Experimental_groups.csv"):
+    # Layout from the file with the sample names and, if it exists, the file with the experimental groups
+    samples = pd.read_csv(sample_names)["Sample_name"].values
+    groups_df = pd.read_csv(experimental_groups) if experimental_groups and path.exists(experimental_groups) else None
+    return make_layout(samples, groups_df)
+
+
+def column(sample, allele, field, PSG=""):
+    # Column name of a sample in the table, for example "1GF_R_.AD" or "1GF_R_GF3.AD"
+    return str(sample) + allele + str(PSG) + field
+
+
+def allocate(folder, name, shape, dtype):
+    # Array in memory, or memory-mapped .npy file in folder
+    if folder is None:
+        return np.zeros(shape, dtype=dtype)
+    return np.lib.format.open_memmap(path.join(folder, name + ".npy"), mode="w+", dtype=dtype, shape=shape)
+
+
+def genotype_dtype(df, columns):
+    # Categories shared by all the genotype columns
+    dtypes = set(df[col].dtype for col in columns)
+    if len(dtypes) == 1 and isinstance(next(iter(dtypes)), pd.CategoricalDtype):
+        return next(iter(dtypes))
+    alleles = set()
+    for col in columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            alleles.update(df[col].cat.categories)
+        else:
+            alleles.update(df[col].dropna().unique())
+    return pd.CategoricalDtype(sorted(str(allele) for allele in alleles))
+
+
+def from_table(df, layout, PSGs=None, folder=None):
+    """
+    Arrays with the allele depths and the genotypes of a table of SNPs.
+
+    :param df: table with the columns sample + "_R_" + PSG + ".AD", ".GT" and the same for "_A_"
+    :param layout: Layout with the samples of the table
+    :param PSGs: pseudogenome codes of the columns, for the tables before the average. None for the columns without
+        pseudogenome code.
+    :param folder: write the arrays as memory-mapped .npy files in this folder instead of keeping them in memory
+    :return: Counts. The genotypes are None if the table has no genotype columns.
+    """
+    PSG_axis = [""] if PSGs is None else [str(PSG) for PSG in PSGs]
+    n = len(df)
+    shape = (n, len(layout.samples), len(ALLELES)) + (() if PSGs is None else (len(PSG_axis),))
+    if folder is not None:
+        os.makedirs(folder, exist_ok=True)
+
+    ad = allocate(folder, "ad", shape, np.float64)
+    ad_view = ad.reshape(n, len(layout.samples), len(ALLELES), len(PSG_axis))
+    for a, allele in enumerate(ALLELES):
+        for p, PSG in enumerate(PSG_axis):
+            columns = [column(sample, allele, ".AD", PSG) for sample in layout.samples]
+            ad_view[:, :, a, p] = df[columns].to_numpy(dtype=np.float64)
+
+    gt_columns = [column(sample, allele, ".GT", PSG) for allele in ALLELES for PSG in PSG_axis
+                  for sample in layout.samples]
+    gt = None
+    alleles = []
+    if all(col in df.columns for col in gt_columns):
+        dtype = genotype_dtype(df, gt_columns)
+        alleles = [str(allele) for allele in dtype.categories]
+        gt = allocate(folder, "gt", shape, np.int8 if len(alleles) < 128 else np.int16)
+        gt_view = gt.reshape(ad_view.shape)
+        for a, allele in enumerate(ALLELES):
+            for p, PSG in enumerate(PSG_axis):
+                for k, sample in enumerate(layout.samples):
+                    gt_view[:, k, a, p] = df[column(sample, allele, ".GT", PSG)].astype(dtype).cat.codes.to_numpy()
+
+    snps = df[[col for col in ["CHROM", "POS"] if col in df.columns]]
+    counts = Counts(ad, gt, alleles, layout, snps, None if PSGs is None else PSG_axis)
+    if folder is not None:
+        save(counts, folder)
+    return counts
+
+
+def save(counts, folder):
+    # Write the arrays and the description of the layout in a folder. The arrays allocated in the folder are only
+    # flushed.
+    os.makedirs(folder, exist_ok=True)
+    arrays = {"ad": counts.ad, "gt": counts.gt, "index": counts.snps.index.to_numpy(dtype=np.int64)}
+    chrom = None
+    if "CHROM" in counts.snps.columns:
+        chrom = pd.Categorical(counts.snps["CHROM"].astype(str))
+        arrays["chrom"] = chrom.codes.astype(np.int32)
+    if "POS" in counts.snps.columns:
+        arrays["pos"] = counts.snps["POS"].to_numpy(dtype=np.int64)
+    for name, array in arrays.items():
+        file_name = path.join(folder, name + ".npy")
+        if array is None:
+            if path.exists(file_name):
+                os.remove(file_name)
+            continue
+        if isinstance(array, np.memmap) and path.abspath(array.filename) == path.abspath(file_name):
+            array.flush()
+        else:
+            np.save(file_name, array)
+
+    description = {"samples": counts.layout.samples, "groups": counts.layout.groups,
+                   "members": {group: [int(k) for k in members] for group, members in counts.layout.members.items()},
+                   "alleles": counts.alleles, "PSGs": counts.PSGs,
+                   "chromosomes": None if chrom is None else [str(name) for name in chrom.categories]}
+    with open(path.join(folder, "layout.json"), "w") as file:
+        json.dump(description, file)
+
+
+def open_counts(folder, mmap=True):
+    """
+    Open the arrays saved in a folder.
+
+    :param folder: folder written by save or by from_table
+    :param mmap: map the arrays from the disk instead of reading them in memory
+    :return: Counts
+    """
+    with open(path.join(folder, "layout.json")) as file:
+        description = json.load(file)
+    mode = "r" if mmap else None
+
+    def load(name):
+        file_name = path.join(folder, name + ".npy")
+        return np.load(file_name, mmap_mode=mode) if path.exists(file_name) else None
+
+    layout = Layout(description["samples"], {sample: k for k, sample in enumerate(description["samples"])},
+                    description["groups"],
+                    {group: np.array(members, dtype=np.intp) for group, members in description["members"].items()})
+    snps = pd.DataFrame(index=pd.Index(load("index")))
+    if description["chromosomes"] is not None:
+        snps["CHROM"] = pd.Categorical.from_codes(load("chrom"), categories=description["chromosomes"])
+    pos = load("pos")
+    if pos is not None:
+        snps["POS"] = pos
+    return Counts(load("ad"), load("gt"), description["alleles"], layout, snps, description["PSGs"])
+
+
+def sample_counts(counts, sample):
+    # Allele depths of one sample, shape (SNPs, alleles[, pseudogenomes])
+    return counts.ad[:, counts.layout.positions[str(sample)]]
+
+
+def group_counts(counts, group, layout=None):
+    # Allele depths summed over the samples of an experimental group, shape (SNPs, alleles[, pseudogenomes]). The groups
+    # of another layout with the same samples can be given.
+    layout = counts.layout if layout is None else layout
+    return counts.ad[:, layout.members[group]].sum(axis=1)
+
+
+def membership(layout, groups=None):
+    """
+    Sparse matrix of the samples of the experimental groups.
+
+    :param layout: Layout with the samples and the groups
+    :param groups: groups of the columns of the matrix, all the groups of the layout by default
+    :return: matrix of shape (samples, groups) with 1 where the sample is a member of the group
+    """
+    groups = layout.groups if groups is None else [str(group) for group in groups]
+    members = [layout.members[group] for group in groups]
+    rows = np.concatenate(members) if members else np.zeros(0, dtype=np.intp)
+    cols = np.repeat(np.arange(len(groups)), [len(samples) for samples in members])
+    return sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(layout.samples), len(groups)))
+
+
+def group_sums(depth, matrix):
+    # Depths of shape (SNPs, samples) summed over the groups of a membership matrix, shape (SNPs, groups)
+    return np.asarray(matrix.T.dot(np.asarray(depth, dtype=np.float64).T)).T
+
+
+def group_depths(counts, layout=None, groups=None):
+    # Allele depths summed over the samples of each experimental group, shape (SNPs, groups, alleles[, pseudogenomes]).
+    # The groups of another layout with the same samples can be given.
+    layout = counts.layout if layout is None else layout
+    matrix = membership(layout, groups)
+    sums = np.zeros((len(counts.ad), matrix.shape[1]) + counts.ad.shape[2:])
+    for index in np.ndindex(*counts.ad.shape[2:]):
+        sums[(slice(None), slice(None)) + index] = group_sums(counts.ad[(slice(None), slice(None)) + index], matrix)
+    return sums
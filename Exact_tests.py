@@ -0,0 +1,202 @@
+# Python 3.7
+# Exact_tests.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+Exact tests computed for whole arrays of read counts at once, instead of one call of scipy for each SNP.
+
+The Fisher exact test of the 2x2 tables [[a, b], [c, d]] sums the probabilities of the hypergeometric distribution of
+the tables with the same margins. The logarithms of the factorials are computed once in a table sized to the largest
+total of the tables, and the probabilities of all the tables of a block are computed together: the tables are sorted by
+the number of tables with their margins and processed in blocks of tables with a similar number, so the arrays are not
+sized to the deepest SNP. The two-sided p-value is the one of scipy.stats.fisher_exact: the sum of the probabilities of
+the tables that are not more probable than the table observed, and 1 when the observed table is the most probable. The
+probabilities are compared with a relative tolerance of 1e-7, as R does, instead of the 1e-14 of scipy, because the
+probabilities from the sums of log-factorials are less precise than 1e-14 and the tables with the same probability, as
+the symmetric ones, must be counted. The p-value is normalized by the sum of the probabilities of all the tables, so it
+matches scipy to about 1e-12 and the p-values below 1e-300 can be 0.
+
+Rounding of the counts
+----------------------
+The exact tests need whole numbers of reads, but the evaluation of the genotypes averages the reads of the two
+pseudogenomes, which gives counts as 7.5. The counts are made whole with the rounding policy:
+    floor: the fractional part is dropped (7.5 -> 7), as scipy does when it converts the table to integers, so the
+        p-values are the same as the ones of scipy on the averaged counts. It is the default.
+    rint: the counts are rounded to the nearest whole number, the halves to the even number (7.5 -> 8, 6.5 -> 6), so
+        the averaged counts are not all rounded down.
+The empty counts are 0 reads.
+
+The binomial test of k reads of the reference allele in n reads, with the null proportion p of the reference allele, is
+the one of scipy.stats.binomtest: the sum of the probabilities of the counts that are not more probable than k, with a
+relative tolerance of 1e-7. The count on the other side of the mode where the tail starts is found with a binary search
+over all the SNPs at once, so the p-values are the ones of scipy for each SNP. The null proportion can be lower than 0.5
+to correct the bias of the mapping to the reference allele. The counts of each allele are made whole before n is summed,
+and a SNP without reads has p-value 1.
+"""
+
+import numpy as np
+from scipy.special import gammaln
+from scipy.stats import binom
+
+# Rounding policies of the fractional counts
+ROUNDING = ["floor", "rint"]
+DEFAULT_ROUNDING = "floor"
+
+# Relative tolerance of the probabilities that are compared
+EPSILON = 1e-7
+
+# Null proportion of the reference allele of the binomial test
+DEFAULT_PROPORTION = 0.5
+
+# Number of probabilities computed at once in a block of tables
+BLOCK_CELLS = 1 << 22
+
+
+def whole_counts(counts, rounding=DEFAULT_ROUNDING):
+    # Counts as whole numbers with the rounding policy
+    counts = np.nan_to_num(np.asarray(counts, dtype=np.float64))
+    if (counts < 0).any():
+        raise ValueError("The counts of the exact tests must be nonnegative")
+    if rounding == "floor":
+        return np.floor(counts).astype(np.int64)
+    if rounding == "rint":
+        return np.rint(counts).astype(np.int64)
+    raise ValueError("Unknown rounding policy " + str(rounding) + ", use one of " + ", ".join(ROUNDING))
+
+
+def log_factorials(n):
+    # Logarithms of the factorials from 0 to n
+    return gammaln(np.arange(n + 1, dtype=np.float64) + 1)
+
+
+def blocks(sizes):
+    # Blocks of positions of the tables with a similar number of terms, at most about BLOCK_CELLS terms in each block.
+    # The tables are grouped by the power of 2 of their number of terms.
+    order = np.argsort(sizes, kind="stable")
+    powers = np.ceil(np.log2(np.maximum(sizes[order], 1))).astype(np.intp)
+    bounds = np.flatnonzero(np.diff(powers)) + 1
+    for group in np.split(order, bounds):
+        if len(group) == 0:
+            continue
+        rows = max(1, BLOCK_CELLS // int(sizes[group].max()))
+        for start in range(0, len(group), rows):
+            yield group[start:start + rows]
+
+
+def fisher_exact(a, b, c, d, rounding=DEFAULT_ROUNDING):
+    """
+    Two-sided Fisher exact test of the tables [[a, b], [c, d]], for arrays of counts of the same shape.
+
+    :param a: counts of the first row and first column
+    :param b: counts of the first row and second column
+    :param c: counts of the second row and first column
+    :param d: counts of the second row and second column
+    :param rounding: rounding policy of the fractional counts, "floor" or "rint"
+    :return: odds ratios a * d / (b * c) and p-values, arrays of the shape of the counts. As scipy, the odds ratio is
+        inf when b or c is 0, and a table with an empty row or column has odds ratio NaN and p-value 1.
+    """
+    a, b, c, d = np.broadcast_arrays(*(whole_counts(x, rounding) for x in (a, b, c, d)))
+    shape = a.shape
+    a, b, c, d = (x.ravel() for x in (a, b, c, d))
+    row1 = a + b
+    row2 = c + d
+    col1 = a + c
+    total = row1 + row2
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        oddsratio = np.where((b > 0) & (c > 0), a.astype(np.float64) * d / (b.astype(np.float64) * c), np.inf)
+    empty = (row1 == 0) | (row2 == 0) | (col1 == 0) | (col1 == total)
+    oddsratio[empty] = np.nan
+    pvalue = np.ones(len(a))
+
+    # Tables with the same margins: the first cell goes from low to high
+    low = np.maximum(0, col1 - row2)
+    sizes = np.minimum(col1, row1) - low + 1
+    tested = np.flatnonzero(~empty & (sizes > 1))
+    if len(tested) == 0:
+        return oddsratio.reshape(shape), pvalue.reshape(shape)
+    lf = log_factorials(int(total[tested].max()))
+    log_gamma = np.log1p(EPSILON)
+
+    for block in blocks(sizes[tested]):
+        k = tested[block]
+        terms = np.arange(int(sizes[k].max()))
+        valid = terms < sizes[k, np.newaxis]
+        x = low[k, np.newaxis] + np.where(valid, terms, 0)
+        # Logarithm of the probabilities without the term of the margins, which is the same for all the tables
+        log_p = -(lf[x] + lf[row1[k, np.newaxis] - x] + lf[col1[k, np.newaxis] - x] +
+                  lf[row2[k, np.newaxis] - col1[k, np.newaxis] + x])
+        log_p = np.where(valid, log_p, -np.inf)
+        log_exact = -(lf[a[k]] + lf[b[k]] + lf[c[k]] + lf[d[k]])
+        log_mode = log_p.max(axis=1)
+        weights = np.exp(log_p - log_mode[:, np.newaxis])
+        tail = np.where(log_p <= (log_exact + log_gamma)[:, np.newaxis], weights, 0).sum(axis=1)
+        p = np.minimum(tail / weights.sum(axis=1), 1)
+        # The observed table is the most probable
+        pvalue[k] = np.where(log_exact >= log_mode + np.log1p(-EPSILON), 1, p)
+
+    return oddsratio.reshape(shape), pvalue.reshape(shape)
+
+
+def binary_search(values, d, lo, hi):
+    # For each test, the position i between lo and hi with values(i) <= d < values(i + 1), for values in ascending order
+    # between lo and hi. The search of scipy for the tail of the two-sided binomial test, for all the tests at once.
+    lo = lo.copy()
+    hi = hi.copy()
+    result = np.zeros(len(lo), dtype=np.int64)
+    done = np.zeros(len(lo), dtype=bool)
+    active = lo < hi
+    while active.any():
+        mid = lo + (hi - lo) // 2
+        value = values(mid)
+        below = active & (value < d)
+        above = active & (value > d)
+        equal = active & ~below & ~above
+        lo = np.where(below, mid + 1, lo)
+        hi = np.where(above, mid - 1, hi)
+        result[equal] = mid[equal]
+        done = done | equal
+        active = ~done & (lo < hi)
+    return np.where(done, result, np.where(values(lo) <= d, lo, lo - 1))
+
+
+def binomial_test(k, n, p=DEFAULT_PROPORTION, rounding=DEFAULT_ROUNDING):
+    """
+    Two-sided exact binomial test of k successes in n trials with the probability of success p, for arrays of counts.
+
+    :param k: counts of the successes, the reads of the reference allele
+    :param n: counts of the trials, the total reads, not lower than k
+    :param p: probability of success of the null hypothesis, a number or an array of the shape of the counts
+    :param rounding: rounding policy of the fractional counts, "floor" or "rint"
+    :return: p-values, an array of the shape of the counts. The tests without trials have p-value 1.
+    """
+    k, n, p = np.broadcast_arrays(whole_counts(k, rounding), whole_counts(n, rounding), np.asarray(p, dtype=np.float64))
+    shape = k.shape
+    k, n, p = (x.ravel() for x in (k, n, p))
+    if (k > n).any():
+        raise ValueError("The counts of the successes of the binomial test must not be greater than the trials")
+    if ((p < 0) | (p > 1)).any():
+        raise ValueError("The probability of success of the binomial test must be between 0 and 1")
+    pvalue = np.ones(len(k))
+    rerr = 1 + EPSILON
+    d = binom.pmf(k, n, p)
+    expected = p * n
+
+    # k below the mode: the other tail starts on the first count above the mode not more probable than k
+    low = np.flatnonzero((n > 0) & (k < expected))
+    nl, pl = n[low], p[low]
+    ix = binary_search(lambda x: -binom.pmf(x, nl, pl), -d[low] * rerr, np.ceil(expected[low]).astype(np.int64), nl)
+    y = nl - ix + (d[low] * rerr == binom.pmf(ix, nl, pl))
+    pvalue[low] = binom.cdf(k[low], nl, pl) + binom.sf(nl - y, nl, pl)
+
+    # k above the mode: the other tail ends on the last count below the mode not more probable than k
+    high = np.flatnonzero((n > 0) & (k > expected))
+    nh, ph = n[high], p[high]
+    ix = binary_search(lambda x: binom.pmf(x, nh, ph), d[high] * rerr, np.zeros(len(high), dtype=np.int64),
+                       np.floor(expected[high]).astype(np.int64))
+    pvalue[high] = binom.cdf(ix, nh, ph) + binom.sf(k[high] - 1, nh, ph)
+
+    return np.minimum(pvalue, 1).reshape(shape)
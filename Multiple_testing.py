@@ -0,0 +1,170 @@
+# Python 3.7
+# Multiple_testing.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+Correction of the p-values of the statistical tests for the multiple testing. The p-values are corrected after all the
+tests, in families of p-values corrected together: each test (one column of p-values, as a test of chi-square, a pair of
+samples of a Fisher test or a sample of the binomial test), each experiment (all the columns of the tests of an
+experiment) or all the p-values of the run, for a genome-wide correction across all the experiments. The methods are:
+    bonferroni: the p-values multiplied by the number of p-values
+    holm: the step-down method of Holm
+    bh: the false discovery rate of Benjamini-Hochberg
+    by: the false discovery rate of Benjamini-Yekutieli, for dependent tests
+    storey: the q-values of Storey, the false discovery rate of Benjamini-Hochberg multiplied by the proportion of true
+        null hypotheses estimated from the p-values not below 0.5
+The corrected p-values are the ones of statsmodels.stats.multitest.multipletests, and the q-values of Storey are the ones
+of the qvalue package with a fixed lambda. The p-values that are not defined (NaN) are not counted and stay NaN.
+
+The p-values of a family do not have to fit in memory. They are read in blocks, each block is sorted and, when there is
+more than one, written to a temporary file, as the runs of an external sort. The rank of each p-value is counted in all
+the runs with a binary search on the files mapped in memory, and the running minimum (or maximum for Holm) of the
+corrected p-values is taken over the runs the same way, so the result is the one of a sort of all the p-values.
+"""
+
+import tempfile
+from itertools import chain
+from os import path
+
+import numpy as np
+
+# Methods of correction and families of p-values corrected together
+METHODS = ["bonferroni", "holm", "bh", "by", "storey"]
+FAMILIES = ["test", "experiment", "global"]
+DEFAULT_METHOD = "bh"
+
+# P-values not below lambda estimate the proportion of true null hypotheses of the q-values of Storey
+STOREY_LAMBDA = 0.5
+
+# Number of p-values of each block, the runs of the external sort
+BLOCK = 1 << 24
+
+
+def sorted_runs(columns, block=BLOCK):
+    # Runs of about block finite p-values of the columns, sorted, with their position in the family
+    values = []
+    positions = []
+    size = 0
+    offset = 0
+    for column in columns:
+        for start in range(0, len(column), block):
+            part = np.asarray(column[start:start + block], dtype=np.float64)
+            finite = np.flatnonzero(np.isfinite(part))
+            values.append(part[finite])
+            positions.append(offset + start + finite)
+            size = size + len(finite)
+            if size >= block:
+                yield sort_run(values, positions)
+                values, positions, size = [], [], 0
+        offset = offset + len(column)
+    if size > 0:
+        yield sort_run(values, positions)
+
+
+def sort_run(values, positions):
+    values = np.concatenate(values)
+    order = np.argsort(values, kind="stable")
+    return values[order], np.concatenate(positions)[order]
+
+
+def mapped(array, folder, name):
+    # Write an array to a file of the folder and map it in memory
+    file_name = path.join(folder, name + ".npy")
+    np.save(file_name, array)
+    return np.load(file_name, mmap_mode="r")
+
+
+def spill(runs, folder):
+    # Runs written to files of the folder and mapped in memory, when there is more than one
+    runs = iter(runs)
+    first = next(runs, None)
+    second = next(runs, None)
+    if second is None:
+        return [] if first is None else [first]
+    spilled = []
+    for k, (values, positions) in enumerate(chain([first, second], runs)):
+        spilled.append((mapped(values, folder, "values_" + str(k)), mapped(positions, folder, "positions_" + str(k))))
+        del values, positions
+    return spilled
+
+
+def counts(runs, values, side):
+    # Number of p-values of all the runs below (side "left") or not above (side "right") each value
+    return sum(np.searchsorted(run_values, values, side=side) for run_values, positions in runs)
+
+
+def correct(columns, method="bh", block=BLOCK, folder=None, out=None):
+    """
+    Corrected p-values of a family of p-values.
+
+    :param columns: arrays of p-values of the family, in memory or mapped in memory
+    :param method: "bonferroni", "holm", "bh", "by" or "storey"
+    :param block: number of p-values of each run of the external sort
+    :param folder: folder of the temporary files of the runs, the temporary folder of the system if it is not given
+    :param out: arrays for the corrected p-values of each column, new arrays if they are not given
+    :return: arrays of the corrected p-values of each column, NaN where the p-value is NaN
+    """
+    if method not in METHODS:
+        raise ValueError("Unknown correction " + str(method) + ", use one of " + ", ".join(METHODS))
+    if out is None:
+        out = [np.full(len(column), np.nan) for column in columns]
+    else:
+        for corrected in out:
+            corrected[:] = np.nan
+    offsets = np.cumsum([0] + [len(column) for column in columns])
+
+    with tempfile.TemporaryDirectory(dir=folder) as temp:
+        runs = spill(sorted_runs(columns, block), temp)
+        m = sum(len(run_values) for run_values, positions in runs)
+        if m == 0:
+            return out
+
+        # Corrected p-value of each sorted p-value, and its running minimum from the end of each run (running maximum
+        # from the start for Holm)
+        factor = np.sum(1.0 / np.arange(1, m + 1)) if method == "by" else 1.0
+        # Proportion of true null hypotheses of the q-values of Storey
+        pi0 = min(1.0, (m - counts(runs, STOREY_LAMBDA, "left")) / (m * (1 - STOREY_LAMBDA)))
+        steps = []
+        for k, (run_values, positions) in enumerate(runs if method != "bonferroni" else []):
+            run_values = np.asarray(run_values)
+            if method == "holm":
+                step = np.maximum.accumulate(run_values * (m - counts(runs, run_values, "left")))
+            else:
+                ranks = counts(runs, run_values, "right")
+                step = np.minimum.accumulate((run_values / (ranks / m / factor))[::-1])[::-1]
+            if len(runs) > 1:
+                step = mapped(step, temp, "steps_" + str(k))
+            steps.append(step)
+
+        for run_values, positions in runs:
+            run_values = np.asarray(run_values)
+            if method == "bonferroni":
+                corrected = run_values * m
+            elif method == "holm":
+                # Maximum over the p-values not above each p-value
+                corrected = np.zeros(len(run_values))
+                for (other, other_positions), step in zip(runs, steps):
+                    last = np.searchsorted(other, run_values, side="right") - 1
+                    corrected = np.maximum(corrected, np.where(last >= 0, step[np.maximum(last, 0)], 0))
+            else:
+                # Minimum over the p-values not below each p-value
+                corrected = np.full(len(run_values), np.inf)
+                for (other, other_positions), step in zip(runs, steps):
+                    first = np.searchsorted(other, run_values, side="left")
+                    corrected = np.minimum(corrected, np.where(first < len(other),
+                                                               step[np.minimum(first, len(other) - 1)], np.inf))
+            corrected = np.minimum(corrected, 1)
+            if method == "storey":
+                corrected = corrected * pi0
+
+            # Scatter the corrected p-values to their columns
+            positions = np.asarray(positions)
+            column_of = np.searchsorted(offsets, positions, side="right") - 1
+            for c in np.unique(column_of):
+                rows = column_of == c
+                out[c][positions[rows] - offsets[c]] = corrected[rows]
+        del runs, steps
+    return out
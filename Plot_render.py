@@ -0,0 +1,228 @@
+# Python 3.7
+# Plot_render.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+Rendering of the figures of the quality control and the statistics. The figures are shown on the screen, or written as
+PNG or SVG files in a folder in the headless mode, for the batch jobs on nodes without a display.
+
+The histograms of the allele frequencies are drawn from the counts of each bin instead of the frequency of every SNP.
+The counts of all the groups are computed together with the allele frequencies, so drawing a histogram does not depend
+on the number of SNPs. The bins cover the allele frequencies from 0 to 1 and the frequencies that are not defined
+(groups without reads) are counted as 0, as they are written in the QC table. The histograms of the groups are drawn
+in a pool of processes, one figure in each task.
+
+The heatmap of millions of SNPs is drawn from the mean allele frequencies of bins of SNPs: genomic windows, genes or
+clusters of the allele frequency profiles of the groups found with a mini-batch k-means. The number of rows is bounded,
+so the time and the memory of the drawing do not depend on the number of SNPs.
+"""
+
+from multiprocessing import Pool
+from os import path
+
+import matplotlib
+import numpy as np
+import pandas as pd
+
+# Number of bins of the histograms of the allele frequencies
+BINS = 100
+
+# Formats of the files of the headless mode
+PLOT_FORMATS = ["png", "svg"]
+
+# Color of the histograms
+COLOR = '#86bf91'
+
+# Rows of the heatmap: one for each SNP, or the mean of the SNPs of each genomic window, gene or cluster of allele
+# frequency profiles
+HEATMAP_BINS = ["snps", "window", "gene", "cluster"]
+
+# Size of the genomic windows in bases, number of clusters and maximum number of rows of the binned heatmaps
+WINDOW = 1000000
+CLUSTERS = 100
+MAX_ROWS = 1000
+
+# SNPs of each step of the mini-batch k-means, steps, and SNPs of each block when all the SNPs are assigned
+BATCH = 2048
+STEPS = 100
+BLOCK = 65536
+
+
+def headless():
+    # Draw the figures without display, before any figure is made
+    matplotlib.use("Agg")
+
+
+def histograms(af, group_names, bins=BINS):
+    """
+    Counts of the allele frequencies of each group in bins from 0 to 1, in one pass over all the groups.
+
+    :param af: allele frequencies of shape (SNPs, groups), NaN for the groups without reads
+    :param group_names: group of each column
+    :param bins: number of bins
+    :return: dictionary with the counts of each group
+    """
+    af = np.nan_to_num(np.asarray(af, dtype=np.float64).reshape(len(af), len(group_names)))
+    # The bin of a frequency is found on the edges, as numpy.histogram, the last bin includes 1
+    edges = np.linspace(0, 1, bins + 1)
+    codes = np.clip(np.searchsorted(edges, af, side="right") - 1, 0, bins - 1) + np.arange(len(group_names)) * bins
+    counts = np.bincount(codes.ravel(), minlength=len(group_names) * bins).reshape(len(group_names), bins)
+    return {str(group_name): counts[k] for k, group_name in enumerate(group_names)}
+
+
+def window_bins(df, window=WINDOW):
+    # Bin of each SNP by chromosome and window of positions, in the order of the table
+    chrom_codes, chroms = pd.factorize(df["CHROM"].astype(str))
+    starts = df["POS"].to_numpy(dtype=np.int64) // window
+    windows = int(starts.max(initial=0)) + 1
+    codes, keys = pd.factorize(chrom_codes * windows + starts)
+    labels = [chroms[key // windows] + ":" + str(key % windows * window + 1) + "-" + str((key % windows + 1) * window)
+              for key in keys]
+    return codes, labels
+
+
+def gene_bins(df):
+    # Bin of each SNP by gene, in the order of the table
+    codes, genes = pd.factorize(df["Gene.refGene"].astype(str))
+    return codes, list(genes)
+
+
+def nearest(x, centers):
+    # Nearest center of each row of x, with the distances computed by blocks of rows
+    codes = np.empty(len(x), dtype=np.intp)
+    squares = (centers ** 2).sum(axis=1)
+    for start in range(0, len(x), BLOCK):
+        block = x[start:start + BLOCK]
+        codes[start:start + BLOCK] = np.argmin(squares - 2 * block.dot(centers.T), axis=1)
+    return codes
+
+
+def mini_batch_kmeans(x, clusters=CLUSTERS, seed=0, batch=BATCH, steps=STEPS):
+    """
+    Clusters of the rows of x with the mini-batch k-means: at each step the centers move to the mean of the rows of a
+    random batch assigned to them, weighted by the rows they were given before, so the time does not depend on the
+    number of rows.
+
+    :param x: array of shape (rows, features)
+    :param clusters: number of clusters, at most the number of rows
+    :param seed: seed of the random generator
+    :param batch: rows of each step
+    :param steps: number of steps
+    :return: centers of shape (clusters, features)
+    """
+    rng = np.random.default_rng(seed)
+    centers = x[rng.choice(len(x), min(clusters, len(x)), replace=False)].astype(np.float64)
+    seen = np.zeros(len(centers))
+    for step in range(steps):
+        sample = x[rng.integers(0, len(x), min(batch, len(x)))]
+        codes = nearest(sample, centers)
+        hits = np.bincount(codes, minlength=len(centers))
+        sums = np.stack([np.bincount(codes, weights=sample[:, j], minlength=len(centers))
+                         for j in range(x.shape[1])], axis=1)
+        seen = seen + hits
+        moved = hits > 0
+        centers[moved] = centers[moved] + (sums[moved] - hits[moved, np.newaxis] * centers[moved]) / \
+            seen[moved, np.newaxis]
+    return centers
+
+
+def cluster_bins(af, clusters=CLUSTERS, seed=0):
+    # Bin of each SNP by cluster of its allele frequencies in the groups, with the clusters ordered by their mean
+    # allele frequency
+    centers = mini_batch_kmeans(af, clusters, seed)
+    order = np.argsort(centers.mean(axis=1), kind="stable")
+    rank = np.empty(len(order), dtype=np.intp)
+    rank[order] = np.arange(len(order))
+    codes = rank[nearest(af, centers)]
+    return codes, ["Cluster " + str(k + 1) for k in range(len(order))]
+
+
+def bounded(codes, labels, max_rows=MAX_ROWS):
+    # Join neighbour bins so there are at most max_rows, each joined bin is labelled by its first and last bins
+    if len(labels) <= max_rows:
+        return codes, labels
+    joined = np.arange(len(labels)) * max_rows // len(labels)
+    first = np.unique(joined, return_index=True)[1]
+    last = np.append(first[1:], len(labels)) - 1
+    return joined[codes], [labels[i] if i == j else labels[i] + " to " + labels[j] for i, j in zip(first, last)]
+
+
+def binned_frequencies(df, af_columns, bins, window=WINDOW, clusters=CLUSTERS, max_rows=MAX_ROWS):
+    """
+    Mean allele frequencies of the SNPs of each bin, as rows of the heatmap. The rows are bounded by max_rows whatever
+    the number of SNPs.
+
+    :param df: table with the allele frequencies, the coordinates and the genes of the SNPs
+    :param af_columns: columns of the allele frequencies of the groups
+    :param bins: "window", "gene" or "cluster"
+    :param window: size of the genomic windows in bases
+    :param clusters: number of clusters of the allele frequency profiles
+    :param max_rows: maximum number of rows
+    :return: dataframe with a row for each bin, labelled with its number of SNPs, and a column for each group
+    """
+    af = np.nan_to_num(df[af_columns].to_numpy(dtype=np.float64))
+    if bins == "window":
+        codes, labels = window_bins(df, window)
+    elif bins == "gene":
+        codes, labels = gene_bins(df)
+    else:
+        codes, labels = cluster_bins(af, clusters)
+    codes, labels = bounded(codes, labels, max_rows)
+    snps = np.bincount(codes, minlength=len(labels))
+    means = np.stack([np.bincount(codes, weights=af[:, j], minlength=len(labels)) for j in range(len(af_columns))],
+                     axis=1)
+    kept = snps > 0
+    index = [label + " (" + str(n) + ")" for label, n, keep in zip(labels, snps, kept) if keep]
+    return pd.DataFrame(means[kept] / snps[kept, np.newaxis], index=index, columns=af_columns)
+
+
+def plot_file(folder, name, fmt):
+    return path.join(folder, name + "." + fmt)
+
+
+def draw_histogram(axes, title, counts):
+    # Histogram from the counts of its bins
+    edges = np.linspace(0, 1, len(counts) + 1)
+    axes.hist(edges[:-1], bins=edges, weights=counts, density=False, facecolor=COLOR)
+    axes.set_xlabel('Allele frequency')
+    axes.set_ylabel('Frequency')
+    axes.set_title(title)
+    axes.grid(True)
+
+
+def finish(figure, file_name=None):
+    # Show the figure, or write it in the file in the headless mode
+    import matplotlib.pyplot as plt
+    if file_name is None:
+        plt.show()
+    else:
+        figure.savefig(file_name)
+    plt.close(figure)
+
+
+def histogram_task(task):
+    # Draw the histogram of one group, run in the pool of processes
+    import matplotlib.pyplot as plt
+    title, counts, file_name = task
+    figure, axes = plt.subplots()
+    draw_histogram(axes, title, counts)
+    finish(figure, file_name)
+    return file_name
+
+
+def render(task, tasks, workers=1):
+    """
+    Draw figures in a pool of processes.
+
+    :param task: function that draws one figure, defined at the module level
+    :param tasks: arguments of each figure
+    :param workers: number of processes, the figures are drawn here with 1
+    :return: the results of the tasks
+    """
+    if workers > 1 and len(tasks) > 1:
+        with Pool(min(workers, len(tasks))) as pool:
+            return pool.map(task, tasks)
+    return [task(arguments) for arguments in tasks]
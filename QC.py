@@ -20,80 +20,161 @@ sample names of each sample in a group
 """
 
 import pandas as pd
+import argparse
 import os
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.ticker import StrMethodFormatter
 
-
-def allele_freqs(group_names, df):
-    # Calculate the allele frequency for each experimental group in order to make a plot of each group:
-    for group_name in group_names:
-        af_group = "AF_" + group_name
-        x_name = af_group + "_x"
-        y_name = af_group + "_y"
-        x = df.loc[:, df.columns.str.contains(group_name + "_R_.AD")]
-        y = df.loc[:, df.columns.str.contains(group_name + "_A_.AD")]
-        df[x_name] = x.sum(axis=1)
-        df[y_name] = y.sum(axis=1)
-        df[af_group] = df[x_name]/(df[x_name] + df[y_name])
-        df.drop(columns=x_name, inplace=True)
-        df.drop(columns=y_name, inplace=True)
+import Count_tensor
+import Plot_render
+import Run_report
+import Stage_cache
+import Table_format
+
+
+def allele_freqs(group_names, df, counts=None, layout=None, histograms=None):
+    # Calculate the allele frequency for each experimental group in order to make a plot of each group. The members of
+    # each group are taken from the layout (Experimental_groups.csv) as a sparse matrix of samples x groups, and the
+    # allele depths of all the samples multiplied by the matrix give the depths of all the groups at once. The depths are
+    # read from the arrays of the table when they are given, or from the columns of the samples of the layout. The total
+    # depth of each group is written as "DP_" + group, to weight the groups. The counts of the histograms of the groups
+    # are added to the dictionary histograms when it is given.
+    if layout is None and counts is not None:
+        layout = counts.layout
+    if layout is None:
+        raise ValueError("The allele frequencies of the groups need the layout of the experimental groups")
+    if counts is not None:
+        depths = Count_tensor.group_depths(counts, layout, group_names)
+        r_depth, a_depth = depths[:, :, 0], depths[:, :, 1]
+    else:
+        matrix = Count_tensor.membership(layout, group_names)
+        r_depth = Count_tensor.group_sums(df[[Count_tensor.column(sample, "_R_", ".AD") for sample in layout.samples]],
+                                          matrix)
+        a_depth = Count_tensor.group_sums(df[[Count_tensor.column(sample, "_A_", ".AD") for sample in layout.samples]],
+                                          matrix)
+    total = r_depth + a_depth
+    with np.errstate(divide="ignore", invalid="ignore"):
+        af = r_depth / total
+    new_cols = {"AF_" + str(group_name): af[:, k] for k, group_name in enumerate(group_names)}
+    new_cols.update({"DP_" + str(group_name): total[:, k] for k, group_name in enumerate(group_names)})
+    df = df.assign(**new_cols)
+    if histograms is not None:
+        histograms.update(Plot_render.histograms(af, group_names))
 
     df = df.fillna(0)
     print("Allele frequencies by experimental group calculated")
     return df
 
 
+# Report with the time and the memory used by each stage
+REPORT_FILE = "QC_report.json"
 
 
-def plot(df, group_names):
-    # Plot all the histograms with the allele frequencies
-
+def plot(df, group_names, histograms=None, folder=None, fmt="png", workers=1):
+    # Plot all the histograms with the allele frequencies, from the counts of their bins. The counts are computed from
+    # the table when they were not computed with the allele frequencies. The figures are shown, or written in the
+    # folder as "AF_" + group + "." + fmt and drawn in a pool of processes.
+    if histograms is None:
+        histograms = Plot_render.histograms(df[["AF_" + str(group_name) for group_name in group_names]].to_numpy(),
+                                            group_names)
+    tasks = []
     for group_name in group_names:
-        af_group = "AF_" + group_name
-
-        # Possibility 1
-        # df.hist(column=af_group, bins=100, grid=False, figsize=(8,10), layout=(1,1), sharex=True, color='#86bf91', zorder=2, rwidth=0.9)
-
-       # Possibility 3 previous in the script
-        hist_data = df[af_group].values
-        plt.hist(hist_data, 100, density=False, facecolor='#86bf91')
-        plt.xlabel('Allele frequency')
-        plt.ylabel('Frequency')
-        plt.title(af_group)
-        plt.grid(True)
-        axes = plt.gca()
-        axes.set_ylim([0, 35])
-        plt.show()
+        af_group = "AF_" + str(group_name)
+        file_name = None if folder is None else Plot_render.plot_file(folder, af_group, fmt)
+        tasks.append((af_group, histograms[str(group_name)], file_name))
+    if folder is None:
+        Plot_render.render(Plot_render.histogram_task, tasks)
+        return
+    os.makedirs(folder, exist_ok=True)
+    Plot_render.render(Plot_render.histogram_task, tasks, workers)
+    print("Histograms written in ", folder)
+
+
+def parse_arguments():
+    # Options of the quality control
+    parser = argparse.ArgumentParser(description="Quality control of the wrangled SNPs")
+    parser.add_argument("--format", choices=list(Table_format.FORMATS), default=Table_format.DEFAULT_FORMAT,
+                        help="Format of the intermediate tables SNPs_ready and QC. The binary formats keep the column "
+                             "types and need pyarrow")
+    parser.add_argument("--cache", default=None,
+                        help="Folder of the stage cache. The QC table is reused while SNPs_ready and the experimental "
+                             "groups do not change")
+    parser.add_argument("--cache-size", type=int, default=Stage_cache.DEFAULT_SIZE,
+                        help="Maximum size of the stage cache in megabytes")
+    parser.add_argument("--tensor", action="store_true",
+                        help="Read the allele depths from the arrays in the folder SNPs_ready_counts written by "
+                             "ASE_data_wrangling.py --tensor")
+    parser.add_argument("--plots", default=None,
+                        help="Folder where the histograms are written instead of shown, for the runs without display")
+    parser.add_argument("--plot-format", choices=Plot_render.PLOT_FORMATS, default="png",
+                        help="Format of the histograms written with --plots")
+    parser.add_argument("--plot-workers", type=int, default=1,
+                        help="Number of processes that draw the histograms written with --plots")
+    parser.add_argument("--profile", default=None,
+                        help="Folder where the cProfile statistics of each stage are written, as stage + '.prof'")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Measure the peak memory allocated by Python in each stage with tracemalloc, which slows "
+                             "the run down")
+    return parser.parse_args()
 
 
 def main():
-    # Read the working path
-    PATH = os.getcwd()
+    args = parse_arguments()
+    Run_report.start(args.profile, args.trace_memory)
+    if args.plots is not None:
+        Plot_render.headless()
 
     # Import the files
-    df = pd.read_csv("SNPs_ready.csv")
     groups_df = pd.read_csv("Experimental_groups.csv")
 
-    # Create a numpy array of arrays with the samples of each group and the total samples of the experiment
-    groups = groups_df.values
-
     # Create a numpy array with the name of each group
     group_names = list(groups_df["Group"])
 
     """ 
     ALLELE FREQUENCIES
     ------------------
-    Compute allele frequencies for each experimental group.
+    Compute allele frequencies for each experimental group. With "--cache" the QC table is copied from the stage cache
+    when it was computed before from the same SNPs_ready and experimental groups.
     """
-    df_qc = allele_freqs(group_names, df)
-
-    # Copy the quality control file for further calculation of the stats
-    df_qc.to_csv("QC.csv")
+    qc_file = Table_format.table_file("QC", args.format)
+    histograms = {}
+    key = None
+    if args.cache:
+        inputs = [Table_format.table_file("SNPs_ready", args.format), "Experimental_groups.csv"]
+        # The QC tables cached before the depths of the groups were written are not reused
+        key = Stage_cache.stage_keys(["QC"], inputs, {"format": args.format, "group_depths": True})["QC"]
+
+    if key is not None and Stage_cache.completed(args.cache, key):
+        Stage_cache.restore(args.cache, key)
+        with Run_report.stage("Read") as record:
+            df_qc = Table_format.read_table("QC", args.format)
+            record["rows"] = len(df_qc)
+    else:
+        with Run_report.stage("Read") as record:
+            df = Table_format.read_table("SNPs_ready", args.format)
+            record["rows"] = len(df)
+        counts = None
+        if args.tensor:
+            counts = Count_tensor.open_counts("SNPs_ready_counts")
+            if len(counts.ad) != len(df):
+                raise ValueError("The arrays in SNPs_ready_counts do not match the table SNPs_ready")
+            layout = Count_tensor.make_layout(counts.layout.samples, groups_df)
+        else:
+            layout = Count_tensor.make_layout(Count_tensor.table_samples(df.columns), groups_df)
+        with Run_report.stage("Allele_freqs", len(df)):
+            df_qc = allele_freqs(group_names, df, counts, layout, histograms)
+
+        # Copy the quality control file for further calculation of the stats
+        with Run_report.stage("Write", len(df_qc)):
+            Table_format.write_table(df_qc, "QC", args.format)
+        if key is not None:
+            Stage_cache.store(args.cache, key, "QC", [qc_file], args.cache_size)
 
     # Plot the histograms
-    plot(df_qc, group_names)
+    with Run_report.stage("Plot", len(df_qc)):
+        plot(df_qc, group_names, histograms or None, args.plots, args.plot_format, args.plot_workers)
+
+    # Time and memory of each stage
+    Run_report.write(REPORT_FILE)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
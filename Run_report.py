@@ -0,0 +1,190 @@
+# Python 3.7
+# Run_report.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+Report of the time and the memory used by each stage of a script: wall time, CPU time of the process and of the pools of
+processes it waited for, peak resident memory, peak memory allocated by Python (with tracemalloc, which slows the run
+down and is only used when asked) and rows processed per second. A stage that runs several times, once for each chunk,
+adds its times and rows and keeps the highest peaks. The peak resident memory is the highest of the process since it
+started, taken at the end of the stage, so the stage that raises it is the one that needed the memory.
+
+The report is written as JSON at the end of the run. With a profile folder, each stage is also profiled with cProfile and
+its statistics are written in the folder as stage + ".prof", to be read with pstats or snakeviz.
+
+The report belongs to the running process: the processes of the sharded run start their own report and return it to be
+added to the report of the run.
+"""
+
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from os import path
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Report of the running process
+report = {"stages": {}, "profile_dir": None, "trace_memory": False, "start": (0, 0)}
+
+# Profiles of the stages, added over the runs of each stage
+profiles = {}
+
+# Stages running now. Only the outermost one is profiled, as cProfile does not nest.
+active = []
+
+
+def start(profile_dir=None, trace_memory=False):
+    """
+    Start the report of the process.
+
+    :param profile_dir: folder for the cProfile statistics of each stage, None for no profiles
+    :param trace_memory: measure the peak memory allocated by Python in each stage with tracemalloc
+    """
+    report["stages"] = {}
+    report["profile_dir"] = profile_dir
+    report["trace_memory"] = trace_memory
+    report["start"] = (time.perf_counter(), time.process_time())
+    profiles.clear()
+    del active[:]
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def settings():
+    # Options of the report, to start the report of another process in the same way
+    return report["profile_dir"], report["trace_memory"]
+
+
+def megabytes(maxrss):
+    # ru_maxrss is in kilobytes, and in bytes on macOS
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def peak_rss(who="self"):
+    # Peak resident memory in megabytes of the process or of its finished child processes
+    if resource is None:
+        return None
+    return megabytes(resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def children_time():
+    # CPU time of the finished child processes, as the workers of the pools
+    if resource is None:
+        return 0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def reset_tracemalloc_peak():
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+    else:
+        # Python before 3.9 resets the peak with the traces
+        tracemalloc.clear_traces()
+
+
+@contextmanager
+def stage(name, rows=None):
+    """
+    Measure a stage. The rows can be given here or set in the record yielded, as record["rows"] = n.
+
+    :param name: name of the stage in the report
+    :param rows: number of rows processed by the stage
+    """
+    record = {"rows": rows}
+    profile = None
+    if report["profile_dir"] is not None and not active:
+        profile = profiles.setdefault(name, cProfile.Profile())
+    if report["trace_memory"] and tracemalloc.is_tracing():
+        reset_tracemalloc_peak()
+    active.append(name)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    children_cpu = children_time()
+    if profile is not None:
+        profile.enable()
+    try:
+        yield record
+    finally:
+        if profile is not None:
+            profile.disable()
+        active.pop()
+        measures = {"calls": 1, "wall_s": time.perf_counter() - wall, "cpu_s": time.process_time() - cpu,
+                    "children_cpu_s": children_time() - children_cpu, "peak_rss_mb": peak_rss(),
+                    "rows": int(record["rows"]) if record["rows"] is not None else None}
+        if report["trace_memory"] and tracemalloc.is_tracing():
+            measures["tracemalloc_peak_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        add(report["stages"], name, measures)
+
+
+def add(stages, name, measures):
+    # Add the measures of a run of a stage to the measures of its previous runs
+    if name not in stages:
+        stages[name] = dict(measures)
+        return
+    total = stages[name]
+    for key, value in measures.items():
+        if value is None:
+            continue
+        if total.get(key) is None:
+            total[key] = value
+        elif "peak" in key:
+            total[key] = max(total[key], value)
+        else:
+            total[key] = total[key] + value
+
+
+def merge(stages):
+    # Add the stages of another process, as a shard
+    for name, measures in stages.items():
+        add(report["stages"], name, measures)
+
+
+def profile_file(name, suffix=""):
+    return path.join(report["profile_dir"], "".join(c if c.isalnum() or c in "-_" else "_" for c in name) + suffix +
+                     ".prof")
+
+
+def dump_profiles(suffix=""):
+    # Write the statistics of the profiled stages in the profile folder
+    if report["profile_dir"] is None:
+        return
+    os.makedirs(report["profile_dir"], exist_ok=True)
+    for name, profile in profiles.items():
+        profile.dump_stats(profile_file(name, suffix))
+
+
+def summary():
+    # Stages with the rows per second, and the totals of the run
+    stages = {}
+    for name, measures in report["stages"].items():
+        measures = dict(measures)
+        if measures.get("rows") is not None and measures["wall_s"] > 0:
+            measures["rows_per_s"] = measures["rows"] / measures["wall_s"]
+        stages[name] = measures
+    wall, cpu = report["start"]
+    total = {"wall_s": time.perf_counter() - wall, "cpu_s": time.process_time() - cpu,
+             "children_cpu_s": children_time(), "peak_rss_mb": peak_rss(), "children_peak_rss_mb": peak_rss("children")}
+    return {"stages": stages, "total": total}
+
+
+def write(file_name):
+    """
+    Write the report of the run as JSON, and the profiles of the stages when they were asked.
+
+    :param file_name: JSON file
+    """
+    with open(file_name, "w") as file:
+        json.dump(summary(), file, indent=2)
+    dump_profiles()
+    print("Run report written in ", file_name)
@@ -0,0 +1,72 @@
+# Python 3.7
+# Sample_pool.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+Execution of the per-sample work of the wrangling stages in a pool of processes. The arrays with the counts and the
+genotypes of all the samples are copied once into shared memory, which the workers inherit when they start, so the data
+is not pickled for every task. Each task processes one column (a sample or a pair of samples) and writes its results in
+shared output arrays, so the results are already merged in the original sample order when the pool finishes.
+
+The task functions receive a dictionary with the input and output arrays and the column to process. They must be
+defined at the module level so they can be sent to the workers.
+"""
+
+import numpy as np
+from multiprocessing import Pool
+from multiprocessing.sharedctypes import RawArray
+
+# Arrays attached by a worker when it starts
+worker_arrays = {}
+
+
+def share(array):
+    # Copy an array into shared memory. Returns the description of the shared array that the workers attach.
+    array = np.ascontiguousarray(array)
+    buffer = RawArray("b", max(array.nbytes, 1))
+    attach((buffer, array.dtype.str, array.shape))[...] = array
+    return buffer, array.dtype.str, array.shape
+
+
+def attach(shared):
+    # Numpy view of a shared array
+    buffer, dtype, shape = shared
+    return np.frombuffer(buffer, dtype=np.dtype(dtype), count=int(np.prod(shape))).reshape(shape)
+
+
+def start_worker(shared_arrays):
+    # Initializer of the workers
+    worker_arrays.clear()
+    for name, shared in shared_arrays.items():
+        worker_arrays[name] = attach(shared)
+
+
+def run_task(task_column):
+    task, column = task_column
+    task(worker_arrays, column)
+
+
+def run(task, inputs, outputs, columns, workers):
+    """
+    Run a task for every column in a pool of processes.
+
+    :param task: function task(arrays, column) that reads the inputs and writes the outputs of one column
+    :param inputs: dictionary with the input arrays
+    :param outputs: dictionary with the (shape, dtype) of the output arrays
+    :param columns: number of columns (samples or pairs of samples) to process
+    :param workers: number of processes
+    :return: dictionary with the output arrays
+    """
+    shared_arrays = {}
+    for name, array in inputs.items():
+        shared_arrays[name] = share(array)
+    for name, (shape, dtype) in outputs.items():
+        shared_arrays[name] = share(np.zeros(shape, dtype=dtype))
+
+    with Pool(min(workers, columns), initializer=start_worker, initargs=(shared_arrays,)) as pool:
+        pool.map(run_task, [(task, column) for column in range(columns)])
+
+    return {name: attach(shared_arrays[name]) for name in outputs}
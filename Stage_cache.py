@@ -0,0 +1,163 @@
+# Python 3.7
+# Stage_cache.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+Cache of the outputs of the steps of the workflow. Each stage is identified by a key, the hash of the content of its
+input files (the tables of SNPs, the sample names, the pseudogenome codes, the experimental groups...), of its
+parameters and of the stages that come before it. When a stage is completed its output files are copied to a folder of
+the cache named by the key. A new run with the same inputs and parameters copies the outputs back instead of computing
+them, and a run that was interrupted starts again after the last stage it completed.
+
+The cache has a maximum size. When it is full the entries used least recently are deleted first.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from os import path
+
+# Maximum size of the cache in megabytes when it is not given
+DEFAULT_SIZE = 10240
+
+# File with the description of an entry. An entry without it is incomplete and is not used.
+MANIFEST = "manifest.json"
+
+BLOCK_SIZE = 1 << 20
+
+
+def file_hash(file_name):
+    # Hash of the content of a file, or of all the files of a folder in order of name. A missing file has its own hash,
+    # so creating it changes the keys.
+    digest = hashlib.sha256()
+    if path.isdir(file_name):
+        for name in sorted(os.listdir(file_name)):
+            digest.update(name.encode())
+            digest.update(file_hash(path.join(file_name, name)).encode())
+    elif path.exists(file_name):
+        with open(file_name, "rb") as file:
+            for block in iter(lambda: file.read(BLOCK_SIZE), b""):
+                digest.update(block)
+    else:
+        digest.update(b"missing")
+    return digest.hexdigest()
+
+
+def stage_keys(stages, inputs, parameters):
+    """
+    Keys of a chain of stages. The key of each stage depends on the keys of the stages before it.
+
+    :param stages: names of the stages in the order they run
+    :param inputs: files read by the first stage
+    :param parameters: dictionary with the parameters that change the outputs
+    :return: dictionary with the key of each stage
+    """
+    key = json.dumps({"inputs": {name: file_hash(name) for name in inputs}, "parameters": parameters},
+                     sort_keys=True, default=str)
+    keys = {}
+    for stage in stages:
+        key = hashlib.sha256((key + "/" + stage).encode()).hexdigest()
+        keys[stage] = key
+    return keys
+
+
+def entry(cache_dir, key):
+    return path.join(cache_dir, key)
+
+
+def completed(cache_dir, key):
+    return path.exists(path.join(entry(cache_dir, key), MANIFEST))
+
+
+def last_completed(cache_dir, stages, keys):
+    # Position of the last stage of the chain with its outputs in the cache, or -1 if there is none
+    for k in range(len(stages) - 1, -1, -1):
+        if completed(cache_dir, keys[stages[k]]):
+            return k
+    return -1
+
+
+def copy(source, destination):
+    if path.isdir(destination):
+        shutil.rmtree(destination)
+    elif path.exists(destination):
+        os.remove(destination)
+    if path.isdir(source):
+        shutil.copytree(source, destination)
+    else:
+        shutil.copyfile(source, destination)
+
+
+def size(folder):
+    total = 0
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            total = total + path.getsize(path.join(root, name))
+    return total
+
+
+def evict(cache_dir, max_size, keep=None):
+    # Delete the entries used least recently until the cache fits in max_size megabytes. The entry keep is not deleted.
+    entries = []
+    for key in os.listdir(cache_dir):
+        folder = entry(cache_dir, key)
+        if not path.isdir(folder):
+            continue
+        manifest = path.join(folder, MANIFEST)
+        used = path.getmtime(manifest) if path.exists(manifest) else 0
+        entries.append((used, key, size(folder)))
+    entries.sort()
+    total = sum(entry_size for used, key, entry_size in entries)
+    for used, key, entry_size in entries:
+        if total <= max_size * 1024 * 1024:
+            break
+        if key == keep:
+            continue
+        shutil.rmtree(entry(cache_dir, key))
+        total = total - entry_size
+        print("Stage cache: entry ", key[:12], " deleted")
+
+
+def store(cache_dir, key, stage, files, max_size=DEFAULT_SIZE):
+    """
+    Copy the outputs of a completed stage to the cache.
+
+    :param cache_dir: folder of the cache
+    :param key: key of the stage
+    :param stage: name of the stage
+    :param files: output files (or folders) of the stage, relative to the working folder
+    :param max_size: maximum size of the cache in megabytes
+    """
+    folder = entry(cache_dir, key)
+    partial = folder + ".partial"
+    if path.exists(partial):
+        shutil.rmtree(partial)
+    os.makedirs(partial)
+    for k, file_name in enumerate(files):
+        copy(file_name, path.join(partial, str(k)))
+    with open(path.join(partial, MANIFEST), "w") as manifest:
+        json.dump({"stage": stage, "files": list(files), "time": time.time()}, manifest)
+    # The entry only appears complete when all its files are copied
+    if path.exists(folder):
+        shutil.rmtree(folder)
+    os.rename(partial, folder)
+    evict(cache_dir, max_size, keep=key)
+
+
+def restore(cache_dir, key):
+    # Copy the outputs of a stage from the cache to their place. Returns the name of the stage.
+    folder = entry(cache_dir, key)
+    manifest = path.join(folder, MANIFEST)
+    with open(manifest) as file:
+        description = json.load(file)
+    for k, file_name in enumerate(description["files"]):
+        copy(path.join(folder, str(k)), file_name)
+    # Mark the entry as used
+    os.utime(manifest, None)
+    print("Stage ", description["stage"], " restored from the cache")
+    return description["stage"]
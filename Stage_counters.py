@@ -0,0 +1,125 @@
+# Python 3.7
+# Stage_counters.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+Counters of the rows that go through each stage of the wrangling. For each stage they count the rows in and out, the
+rows dropped for each reason (multiallelic, unclassified, low depth, MAE...), the hits of each genotype case of the
+evaluation and the comparison with the models, and the same numbers for each sample or pair of samples. The coordinates
+of the SNPs that matched no genotype case are kept for a side table.
+
+The counters are a dictionary of numbers, so the counters of the chunks and of the shards are added together, and they
+are written at the end of the run as one JSON summary. The lines for the user are printed according to the verbosity:
+0 prints nothing but the warnings, 1 one line for each stage and 2 also the lines for each sample and pair. The errors
+are printed once at the end of the run, with the numbers of the whole run.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+# Verbosity when there are no counters
+DEFAULT_VERBOSITY = 1
+
+# Errors printed once at the end of the run, with the SNPs of all the chunks and shards, for the stages where SNPs
+# matched no genotype case
+ERRORS = {"Uniform": "Comparison of genotypes provided no case for "}
+
+
+def new_counters(verbosity=DEFAULT_VERBOSITY):
+    return {"verbosity": verbosity, "stages": {}, "unclassified": []}
+
+
+def log(counters, level, *message):
+    # Print a line for the user when the verbosity is at least level
+    verbosity = DEFAULT_VERBOSITY if counters is None else counters["verbosity"]
+    if verbosity >= level:
+        print(*message)
+
+
+def add(record, keys, value):
+    # Add a number to a nested key of a dictionary of counters
+    for key in keys[:-1]:
+        record = record.setdefault(str(key), {})
+    record[str(keys[-1])] = record.get(str(keys[-1]), 0) + int(value)
+
+
+def count(counters, stage, *keys_value):
+    # Add the value (the last argument) to the counter of the stage with the keys, for example
+    # count(counters, "AD10", "dropped", "low_depth", 12)
+    if counters is not None:
+        add(counters["stages"].setdefault(stage, {}), keys_value[:-1], keys_value[-1])
+
+
+def count_rows(counters, stage, rows_in, rows_out):
+    count(counters, stage, "rows_in", rows_in)
+    count(counters, stage, "rows_out", rows_out)
+
+
+def count_cases(counters, stage, cases, samples):
+    # Hits of each case code in all the samples and in each sample. cases is an array of SNPs x samples.
+    if counters is None:
+        return
+    for j, sample in enumerate(samples):
+        hits = np.bincount(cases[:, j].astype(np.intp))
+        for code in np.flatnonzero(hits):
+            count(counters, stage, "cases", code, hits[code])
+            count(counters, stage, "samples", sample, "cases", code, hits[code])
+
+
+def record_unclassified(counters, stage, df, mask, samples):
+    # Keep the coordinates of the SNPs that matched no case (mask of SNPs x samples) with the samples where they did not
+    if counters is None or not mask.any():
+        return
+    rows = mask.any(axis=1)
+    names = [",".join(str(sample) for sample, unclassified in zip(samples, row) if unclassified) for row in mask[rows]]
+    coordinates = df.loc[rows, ["CHROM", "POS"]]
+    counters["unclassified"].extend(
+        [str(chrom), int(pos), stage, sample_names]
+        for chrom, pos, sample_names in zip(coordinates["CHROM"], coordinates["POS"], names))
+
+
+def merge(counters, other):
+    # Add the counters of a chunk or a shard
+    def merge_record(record, other_record):
+        for key, value in other_record.items():
+            if isinstance(value, dict):
+                merge_record(record.setdefault(key, {}), value)
+            else:
+                record[key] = record.get(key, 0) + value
+
+    merge_record(counters["stages"], other["stages"])
+    counters["unclassified"].extend(other["unclassified"])
+
+
+def report_errors(counters, unclassified_file=None):
+    # Print the errors of the whole run, whatever the verbosity
+    for stage, message in ERRORS.items():
+        snps = counters["stages"].get(stage, {}).get("unclassified", 0)
+        if snps > 0:
+            print("ERROR: " + message, snps, " SNPs. You must check if the evaluation of these cases is correct",
+                  "" if unclassified_file is None else "(coordinates in " + unclassified_file + ")")
+
+
+def unclassified_table(counters):
+    # Side table with the coordinates of the SNPs that matched no case
+    return pd.DataFrame(counters["unclassified"], columns=["CHROM", "POS", "Stage", "Samples"])
+
+
+def write_summary(counters, file_name, unclassified_file=None):
+    """
+    Write the counters as one JSON summary.
+
+    :param counters: counters of the run
+    :param file_name: JSON file
+    :param unclassified_file: csv file for the coordinates of the SNPs that matched no case
+    """
+    summary = {"stages": counters["stages"], "unclassified_SNPs": len(counters["unclassified"])}
+    with open(file_name, "w") as file:
+        json.dump(summary, file, indent=2)
+    if unclassified_file is not None:
+        unclassified_table(counters).to_csv(unclassified_file, index=False)
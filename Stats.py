@@ -25,301 +25,393 @@ Another file is also the experimental design, including the groups that will be
 """
 
 # Import the libraries
+import numpy as np
 import pandas as pd
 from scipy import stats
-from scipy.stats import chisquare
-import scipy as sc
 import matplotlib.pyplot as plt
 import seaborn as sns
+import argparse
 import os
-import statsmodels.stats as smt
-from statsmodels.stats import multitest
+from os import path
 
-def heatmap(df, group_names):
-    af_groups = []
-    for group_name in group_names:
-        af_group = "AF_" + group_name
-        af_groups.append(af_group)
-
-    htmap = df[af_groups]
-    sns.heatmap(htmap, cmap='YlGnBu')
-    plt.show()
+import Count_tensor
+import Exact_tests
+import Multiple_testing
+import Plot_render
+import Run_report
+import Table_format
+import Test_cache
 
+# Report with the time and the memory used by each stage
+REPORT_FILE = "Stats_report.json"
 
+# End of the names of the columns with the p-values and the corrected p-values of each test
+PVALUES = {"chi": "_CHI_p-val", "fisher": "_Fisher_p-val", "binomial": "_Binomial_pvalue"}
+CORRECTED_PVALUES = {"chi": "_CHI_p-fdr", "fisher": "_Fisher_p-fdr", "binomial": "Binomial_fdr_pvalue"}
 
-def chi_test(df, af_samples, experiment, exp):
-    # Collect the row of the experiment where the design is described
-    design = exp[exp["Test_ID"].str.match(experiment)].iloc[0]
-    group1 = design["Group_1"]
-    group2 = design["Group_2"]
-    # Collect the columns of the dataframe that will go into the test:
-    group1_samples = [i for i in af_samples if group1 in i]
-    group2_samples = [i for i in af_samples if group2 in i]
-    if len(group1_samples) > len(group2_samples):
-        print("WARNING: CHI2 Test for ", experiment,
-              " not possible with the group distribution.\nThe number of samples will adjust for performing of the test")
+# Correction of the p-values of each test, corrected one test at a time, when no correction is given
+DEFAULT_CORRECTIONS = {"chi": "bonferroni", "fisher": "bh", "binomial": "bh"}
 
-        # Pop the extra samples:
-        to_pop = len(group1_samples) - len(group2_samples)
-        for j in range(to_pop):
-            group1_samples.pop(j)
-
-        cols_control = df[df.columns[df.columns.isin(group1_samples)]]
-        cols_exp = df[df.columns[df.columns.isin(group2_samples)]]
-        # Initialize the lists for collecting the statstics
-        chi_group2 = []
-        p_chi_group2 = []
-        stat_chi_group2 = []
-
-        # Perform the test
-        for i in range(len(df)):
-            chi_group2.append(chisquare(cols_exp.iloc[i,], f_exp=cols_control.iloc[i,]))
-            p_chi_group2.append(chi_group2[i].pvalue)
-            stat_chi_group2.append(chi_group2[i].statistic)
-
-        # add the multitest also
-        multi = smt.multitest.multipletests(p_chi_group2, alpha=0.05, method='bonferroni', is_sorted=False,
-                                            returnsorted=False)
-        # Append the p-values
-        pvalue = experiment + "_CHI_p-val"
-        pfdr = experiment + "_CHI_p-fdr"
-        df[pvalue] = p_chi_group2
-        df[pfdr] = multi[1][0]
-
-    elif len(group1_samples) < len(group2_samples):
-        print("WARNING: CHI2 Test for ", experiment,
-              " not possible with the group distribution.\nThe number of samples will adjust for performing of the test")
 
-        # Pop the extra samples
-        to_pop = len(group2_samples) - len(group1_samples)
-        for j in range(to_pop):
-            group2_samples.pop(j)
-        cols_control = df[df.columns[df.columns.isin(group1_samples)]]
-        cols_exp = df[df.columns[df.columns.isin(group2_samples)]]
-        # Initialize the lists for collecting the statstics
-        chi_group2 = []
-        p_chi_group2 = []
-        stat_chi_group2 = []
-
-        # Perform the test
-        for i in range(len(df)):
-            chi_group2.append(chisquare(cols_exp.iloc[i,], f_exp=cols_control.iloc[i,]))
-            p_chi_group2.append(chi_group2[i].pvalue)
-            stat_chi_group2.append(chi_group2[i].statistic)
-        # add the multitest also
-        multi = smt.multitest.multipletests(p_chi_group2, alpha=0.05, method='bonferroni', is_sorted=False,
-                                            returnsorted=False)
-
-        # Append the p-values
-        pvalue = experiment + "_CHI_p-val"
-        pfdr = experiment + "_CHI_p-fdr"
-        df[pvalue] = p_chi_group2
-        df[pfdr] = multi[1][0]
+def heatmap(df, group_names, folder=None, fmt="png", bins="snps", window=Plot_render.WINDOW,
+            clusters=Plot_render.CLUSTERS, max_rows=Plot_render.MAX_ROWS):
+    # Heatmap of the allele frequencies of the groups, shown or written in the folder as "Heatmap." + fmt. With bins
+    # "window", "gene" or "cluster" each row is the mean of the SNPs of a bin, with at most max_rows rows, and the
+    # heatmap is rasterized.
+    af_groups = []
+    for group_name in group_names:
+        af_group = "AF_" + group_name
+        af_groups.append(af_group)
 
+    if len(df) == 0:
+        print("WARNING: No SNPs for the heatmap")
+        return
+    if bins == "snps":
+        htmap = df[af_groups]
     else:
-        cols_control = df[df.columns[df.columns.isin(group1_samples)]]
-        cols_exp = df[df.columns[df.columns.isin(group2_samples)]]
-        # Initialize the lists for collecting the statstics
-        chi_group2 = []
-        p_chi_group2 = []
-        stat_chi_group2 = []
-
-        # Perform the test
-        for i in range(len(df)):
-            chi_group2.append(chisquare(cols_exp.iloc[i,], f_exp=cols_control.iloc[i,]))
-            p_chi_group2.append(chi_group2[i].pvalue)
-            stat_chi_group2.append(chi_group2[i].statistic)
-
-        # add the multitest also
-        multi = smt.multitest.multipletests(p_chi_group2, alpha=0.05, method='bonferroni', is_sorted=False,
-                                            returnsorted=False)
-        # Append the p-values
-        pvalue = experiment + "_CHI_p-val"
-        pfdr = experiment + "_CHI_p-fdr"
-        df[pvalue] = p_chi_group2
-        df[pfdr] = multi[1][0]
-
-    return df
-
-
-def chi_square(df, samples, exp, experiments):
-    # Create the strings corresponding to the allele frequency in each sample
-    global df_chi
-    af_samples = []
-    for sample in samples:
-        af_sample = "AF_" + sample
-        af_samples.append(af_sample)
-
-    # Elements for the test
-    for experiment in experiments:
-        df_chi = chi_test(df, af_samples, experiment, exp)
+        htmap = Plot_render.binned_frequencies(df, af_groups, bins, window, clusters, max_rows)
+    figure = plt.figure()
+    sns.heatmap(htmap, cmap='YlGnBu', rasterized=bins != "snps")
+    if folder is None:
+        Plot_render.finish(figure)
+        return
+    os.makedirs(folder, exist_ok=True)
+    Plot_render.finish(figure, Plot_render.plot_file(folder, "Heatmap", fmt))
+    print("Heatmap written in ", folder)
+
+
+
+def significant(df, tests, alpha=0.05):
+    # SNPs with a corrected p-value below alpha in any of the tests ("chi", "fisher", "binomial")
+    mask = np.zeros(len(df), dtype=bool)
+    for test in tests:
+        columns = [col for col in df.columns if str(col).endswith(CORRECTED_PVALUES[test])]
+        if not columns:
+            print("WARNING: No corrected p-values of the test ", test, " for the heatmap")
+            continue
+        mask |= (df[columns].to_numpy(dtype=np.float64) < alpha).any(axis=1)
+    return mask
+
+
+def contingency_chi2(r1, a1, r2, a2):
+    # Pearson chi-square statistic and p-value of the 2x2 tables [[r1, a1], [r2, a2]] given as arrays of any shape,
+    # without continuity correction. The tables with an empty row or column cannot be tested and give NaN.
+    r1, a1, r2, a2 = (np.asarray(x, dtype=np.float64) for x in (r1, a1, r2, a2))
+    margins = (r1 + a1) * (r2 + a2) * (r1 + r2) * (a1 + a2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        statistic = np.where(margins > 0, (r1 + a1 + r2 + a2) * (r1 * a2 - a1 * r2) ** 2 / margins, np.nan)
+    return statistic, stats.chi2.sf(statistic, 1)
+
+
+def test_groups(exp, experiments, layout):
+    # Control and experimental group of each test, and the groups of the tests in the order they appear
+    design = exp.drop_duplicates("Test_ID").set_index("Test_ID")
+    missing = [experiment for experiment in experiments if experiment not in design.index]
+    if missing:
+        raise ValueError("The tests " + ", ".join(missing) + " are not in the experimental design")
+    first = [str(group) for group in design.loc[experiments, "Group_1"]]
+    second = [str(group) for group in design.loc[experiments, "Group_2"]]
+    groups = list(dict.fromkeys(first + second))
+    unknown = [group for group in groups if group not in layout.members]
+    if unknown:
+        raise ValueError("The groups " + ", ".join(unknown) + " of the experimental design are not in the experimental "
+                                                              "groups")
+    return first, second, groups
+
+
+def chi_square(df, samples, exp, experiments, counts=None, layout=None):
+    # Chi-square test of independence between the group and the allele for each test of the experimental design, on the
+    # allele depths pooled over the samples of each group, so the groups of different sizes are compared with all their
+    # samples. The depths of the groups (SNPs x groups x alleles) are summed once with the membership matrix and all the
+    # SNPs and the tests are computed at once. The SNPs that cannot be tested get NaN. The p-values are corrected after
+    # all the tests by correct_pvalues, which writes test + "_CHI_p-fdr".
+    layout = counts.layout if layout is None and counts is not None else layout
+    if layout is None or not layout.groups:
+        raise ValueError("The chi-square test needs the layout of the experimental groups")
+    if counts is None:
+        counts = Count_tensor.from_table(df, layout)
+    first, second, groups = test_groups(exp, experiments, layout)
+    depths = Count_tensor.group_depths(counts, layout, groups)
+    control = [groups.index(group) for group in first]
+    treated = [groups.index(group) for group in second]
+    statistic, pvalue = contingency_chi2(depths[:, control, 0], depths[:, control, 1], depths[:, treated, 0],
+                                         depths[:, treated, 1])
+
+    new_cols = {}
+    for t, experiment in enumerate(experiments):
+        new_cols[experiment + "_CHI_stat"] = statistic[:, t]
+        new_cols[experiment + "_CHI_p-val"] = pvalue[:, t]
+    df = df.assign(**new_cols)
     print("Chi^2 test successfully performed on all the experiments\n")
 
-    return df_chi
-
-
+    return df
 
 
-def fisher_test(df, samples, exp, experiment):
-    # Prepare the strings for the column names
+def sample_pairs(samples, exp, experiment):
+    # Pairs of samples of the control and the experimental group of a test, in the order of the samples
     design = exp[exp["Test_ID"].str.match(experiment)].iloc[0]
     group1 = design["Group_1"]
     group2 = design["Group_2"]
 
-    # Collect the columns of the dataframe that will go into the test:
+    # Collect the samples of the groups:
     group1_samples = [i for i in samples if group1 in i]
     group2_samples = [i for i in samples if group2 in i]
-    r = "_R_.AD"
-    a = "_A_.AD"
-
-
-    if len(group1_samples) == len(group2_samples):
-
-        # Perform the test
-        k = 0  # Iterator for the samples in group 2
-        for group1_sample in group1_samples:
-            p_fisher = []
-            stat_fisher = []
-            for i in range(len(df)):
-                # sample names and positions
-                control_r = df.iloc[i, int(df.columns.get_loc(group1_sample + r))]
-                control_a = df.iloc[i, int(df.columns.get_loc(group1_sample + a))]
-                exp_r = df.iloc[i, int(df.columns.get_loc(group2_samples[k] + r))]
-                exp_a = df.iloc[i, int(df.columns.get_loc(group2_samples[k] + a))]
-
-                # test
-                oddsratio, pvalue = stats.fisher_exact([[exp_r, exp_a], [control_r, control_a]])
-                stat_fisher.append(oddsratio)
-                p_fisher.append(pvalue)
-
-            # add the multitest also
-            multi = smt.multitest.multipletests(p_fisher, alpha=0.05, method='fdr_bh', is_sorted=False,
-                                                returnsorted=False)
-
-            # Make columns of the dataframe with the results
-            fisher_pval = experiment + "_" + group1_sample + group2_samples[k] + "_Fisher_p-val"
-            fisher_fdr = experiment + "_" + group1_sample + group2_samples[k] + "_Fisher_p-fdr"
-            df[fisher_pval] = pd.Series(p_fisher, index = df.index)
-            df[fisher_fdr] = pd.Series(multi[1], index = df.index)
-            k = (k + 1)
-
-
-    elif len(group1_samples) > len(group2_samples):
+
+    if len(group1_samples) != len(group2_samples):
         print("WARNING: Fisher Test for ", experiment,
               " not possible with the group distribution.\nThe number of samples will adjust for performing of the test")
 
-        # Pop the extra samples
-        to_pop = len(group1_samples) - len(group2_samples)
+        # Pop the extra samples of the biggest group
+        bigger = group1_samples if len(group1_samples) > len(group2_samples) else group2_samples
+        to_pop = abs(len(group1_samples) - len(group2_samples))
         for j in range(to_pop):
-            group1_samples.pop(j)
-
-        # Perform the test
-        k = 0  # Iterator for the samples in group 2
-        for group1_sample in group1_samples:
-            p_fisher = []
-            stat_fisher = []
-            for i in range(len(df)):
-                # sample names and positions
-                control_r = df.iloc[i, int(df.columns.get_loc(group1_sample + r))]
-                control_a = df.iloc[i, int(df.columns.get_loc(group1_sample + a))]
-                exp_r = df.iloc[i, int(df.columns.get_loc(group2_samples[k] + r))]
-                exp_a = df.iloc[i, int(df.columns.get_loc(group2_samples[k] + a))]
-
-                # test
-                oddsratio, pvalue = stats.fisher_exact([[exp_r, exp_a], [control_r, control_a]])
-                stat_fisher.append(oddsratio)
-                p_fisher.append(pvalue)
-
-
-            # add the multitest also
-            multi = smt.multitest.multipletests(p_fisher, alpha=0.05, method='fdr_bh', is_sorted=False,
-                                                returnsorted=False)
-
-            # Make columns of the dataframe with the results
-            fisher_pval = experiment + "_" + group1_sample + group2_samples[k] + "_Fisher_p-val"
-            fisher_fdr = experiment + "_" + group1_sample + group2_samples[k] + "_Fisher_p-fdr"
-            df[fisher_pval] = pd.Series(p_fisher, index=df.index)
-            df[fisher_fdr] = pd.Series(multi[1], index=df.index)
-            k = k + 1
+            bigger.pop(j)
+    return list(zip(group1_samples, group2_samples))
+
+
+def fisher_test(df, samples, exp, experiment, counts, rounding=Exact_tests.DEFAULT_ROUNDING, cache=None):
+    # Fisher exact test of the reads of each pair of samples of the test, for all the SNPs and the pairs at once. The
+    # fractional counts of the average of the pseudogenomes are made whole with the rounding policy of Exact_tests, and
+    # each distinct table is tested once with the test cache.
+    # Returns the columns with the odds ratios and the p-values.
+    pairs = sample_pairs(samples, exp, experiment)
+    new_cols = {}
+    if not pairs:
+        return new_cols
+    control = np.stack([Count_tensor.sample_counts(counts, group1_sample) for group1_sample, _ in pairs], axis=1)
+    treated = np.stack([Count_tensor.sample_counts(counts, group2_sample) for _, group2_sample in pairs], axis=1)
+
+    # Tables [[exp_r, exp_a], [control_r, control_a]] of all the SNPs and pairs
+    tables = [Exact_tests.whole_counts(x, rounding) for x in (treated[:, :, 0], treated[:, :, 1], control[:, :, 0],
+                                                              control[:, :, 1])]
+    oddsratio, p_fisher = Test_cache.apply(cache, "fisher", Exact_tests.fisher_exact, tables)
+
+    for k, (group1_sample, group2_sample) in enumerate(pairs):
+        # Make columns of the dataframe with the results
+        name = experiment + "_" + group1_sample + group2_sample
+        new_cols[name + "_Fisher_odds-ratio"] = oddsratio[:, k]
+        new_cols[name + "_Fisher_p-val"] = p_fisher[:, k]
+    return new_cols
+
+
+def Fisher(df, samples, exp, experiments, counts=None, rounding=Exact_tests.DEFAULT_ROUNDING, cache=None):
+    # The allele depths are read from the arrays of the table, built here if they are not given
+    if counts is None:
+        counts = Count_tensor.from_table(df, Count_tensor.make_layout(samples))
+    new_cols = {}
+    for experiment in experiments:
+        new_cols.update(fisher_test(df, samples, exp, experiment, counts, rounding, cache))
+    df_fisher = df.assign(**new_cols)
+    print("Fisher exact test successfully performed on  all the experiments")
+    return df_fisher
 
-    else:
-        print("WARNING: Fisher Test for ", experiment,
-              " not possible with the group distribution.\nThe number of samples will adjust for performing of the test")
 
-        # Pop the extra samples
-        to_pop = len(group2_samples) - len(group1_samples)
-        for j in range(to_pop):
-            group2_samples.pop(j)
-
-        # Perform the test
-        k = 0  # Iterator for the samples in group 2
-        for group1_sample in group1_samples:
-            p_fisher = []
-            stat_fisher = []
-            for i in range(len(df)):
-                # sample names and positions
-                control_r = df.iloc[i, int(df.columns.get_loc(group1_sample + r))]
-                control_a = df.iloc[i, int(df.columns.get_loc(group1_sample + a))]
-                exp_r = df.iloc[i, int(df.columns.get_loc(group2_samples[k] + r))]
-                exp_a = df.iloc[i, int(df.columns.get_loc(group2_samples[k] + a))]
-
-                # test
-                oddsratio, pvalue = stats.fisher_exact([[exp_r, exp_a], [control_r, control_a]])
-                stat_fisher.append(oddsratio)
-                p_fisher.append(pvalue)
-
-            # add the multitest also
-            multi = smt.multitest.multipletests(p_fisher, alpha=0.05, method='fdr_bh', is_sorted=False,
-                                                returnsorted=False)
-
-            # Make columns of the dataframe with the results
-            fisher_pval = experiment + "_" + group1_sample + group2_samples[k] + "_Fisher_p-val"
-            fisher_fdr = experiment + "_" + group1_sample + group2_samples[k] + "_Fisher_p-fdr"
-            df[fisher_pval] = pd.Series(p_fisher, index=df.index)
-            df[fisher_fdr] = pd.Series(multi[1], index=df.index)
-            k = k + 1
+def binom_tests(ref, total_reads, proportion):
+    # Binomial test of each distinct reads of the reference allele, total reads and null proportion
+    return (Exact_tests.binomial_test(ref, total_reads, proportion),)
 
 
+def reference_proportions(counts, samples, rounding=Exact_tests.DEFAULT_ROUNDING):
+    # Proportion of the reads of the reference allele of each sample over all its SNPs, the null proportion of the
+    # binomial test corrected for the bias of the mapping to the reference allele
+    proportions = []
+    for sample in samples:
+        depths = Exact_tests.whole_counts(Count_tensor.sample_counts(counts, sample)[:, :2], rounding)
+        total = depths.sum()
+        proportions.append(depths[:, 0].sum() / total if total > 0 else Exact_tests.DEFAULT_PROPORTION)
+    return proportions
 
-    return df
 
+def binomial(df, samples, counts=None, cache=None, proportion=Exact_tests.DEFAULT_PROPORTION,
+             rounding=Exact_tests.DEFAULT_ROUNDING):
+    """
+    Binomial test of the reads of the reference allele over the total reads of each SNP in each sample, for all the
+    SNPs and the samples at once. Each distinct test is computed once with the test cache.
+
+    :param df: table of the SNPs
+    :param samples: names of the samples
+    :param counts: arrays of the allele depths, built from the table if they are not given
+    :param cache: test cache, or None
+    :param proportion: null proportion of the reference allele, a number, or "sample" for the proportion of the reads
+        of the reference allele of each sample, to correct the bias of the mapping to the reference allele
+    :param rounding: rounding policy of the fractional counts of the average of the pseudogenomes
+    :return: the table with the p-values of each sample
+    """
+    if counts is None:
+        counts = Count_tensor.from_table(df, Count_tensor.make_layout(samples))
+    if proportion == "sample":
+        proportions = reference_proportions(counts, samples, rounding)
+        for sample, sample_proportion in zip(samples, proportions):
+            print("Binomial test: null proportion of the reference allele of ", sample, " ", round(sample_proportion, 4))
+    else:
+        proportions = [float(proportion)] * len(samples)
+
+    # Reads of the reference allele and total reads of all the SNPs and samples, the reads of each allele made whole
+    depths = Exact_tests.whole_counts(np.stack([Count_tensor.sample_counts(counts, sample)[:, :2] for sample in samples],
+                                               axis=1), rounding)
+    ref = depths[:, :, 0]
+    total_reads = depths[:, :, 0] + depths[:, :, 1]
+    pval = Test_cache.apply(cache, "binomial", binom_tests, [ref, total_reads, np.array(proportions)])[0]
 
-def Fisher(df, samples, exp, experiments):
+    new_cols = {sample + "_Binomial_pvalue": pval[:, j] for j, sample in enumerate(samples)}
+    df_binomial = df.assign(**new_cols)
+    print("Binomial test successfully performed on all the experiments")
+    return df_binomial
+
+
+def null_proportion(value):
+    # Null proportion of the binomial test given in the options, a number between 0 and 1 or "sample"
+    if value == "sample":
+        return value
+    try:
+        proportion = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("the null proportion must be a number or 'sample'")
+    if not 0 <= proportion <= 1:
+        raise argparse.ArgumentTypeError("the null proportion must be between 0 and 1")
+    return proportion
+
+
+def pvalue_columns(df, samples, experiments):
+    # Columns of the p-values of the tests in the table, as (test, experiment, column, column of the corrected p-values).
+    # A column of the Fisher test belongs to the longest experiment its name starts with. The binomial tests of the
+    # samples belong to no experiment and are corrected together as the experiment "Binomial".
+    columns = []
+    claimed = set()
+    for experiment in sorted(experiments, key=len, reverse=True):
+        for col in df.columns:
+            col = str(col)
+            if col.startswith(experiment + "_") and col.endswith(PVALUES["fisher"]) and col not in claimed:
+                claimed.add(col)
+                columns.append(("fisher", experiment, col, col[:-len(PVALUES["fisher"])] + CORRECTED_PVALUES["fisher"]))
     for experiment in experiments:
-        df_fisher = fisher_test(df, samples, exp, experiment)
-    print("Fisher exact test successfully performed on  all the experiments")
-    return df_fisher
+        if experiment + PVALUES["chi"] in df.columns:
+            columns.append(("chi", experiment, experiment + PVALUES["chi"], experiment + CORRECTED_PVALUES["chi"]))
+    for sample in samples:
+        if sample + PVALUES["binomial"] in df.columns:
+            columns.append(("binomial", "Binomial", sample + PVALUES["binomial"], sample + CORRECTED_PVALUES["binomial"]))
+    return columns
 
 
-def binomial(df,samples):
-    r = "_R_.AD"
-    a = "_A_.AD"
-    for sample in samples:
-        pval = []
-        fdr_pval = []
-
-        for i in range(len(df)):
-            # Get the values of the rows
-            ref = df.iloc[i, int(df.columns.get_loc(sample + r))]
-            alt = df.iloc[i, int(df.columns.get_loc(sample + a))]
-            total_reads = ref + alt
-
-            # Perform the test
-            binom = (sc.stats.binom_test(ref, total_reads, 0.5, alternative='two-sided'))
-            pval.append(binom)
-
-        # add the multitest also
-        multi = smt.multitest.multipletests(pval, alpha=0.05, method='fdr_bh', is_sorted=False,
-                                            returnsorted=False)
-        col_name_binom = sample + "_Binomial_pvalue"
-        col_name_multi = sample + "Binomial_fdr_pvalue"
-        df[col_name_binom] = pd.Series(pval, index=df.index)
-        df[col_name_multi] = pd.Series(multi[1], index=df.index)
-    print("Binomial test successfully performed on all the experiments")
-    return df
+def correct_pvalues(df, samples, experiments, method=None, family="test", block=Multiple_testing.BLOCK, folder=None):
+    """
+    Correct the p-values of all the tests for the multiple testing, after all the tests. The corrected p-values are
+    written after the columns of their p-values.
+
+    :param df: table with the p-values of the tests
+    :param samples: names of the samples
+    :param experiments: names of the experimental tests
+    :param method: "bonferroni", "holm", "bh", "by" or "storey". When it is not given the p-values of the chi-square
+        test are corrected with Bonferroni and the ones of the Fisher and binomial tests with Benjamini-Hochberg, or
+        all with Benjamini-Hochberg when the family is not "test".
+    :param family: p-values corrected together: "test" for each column of p-values, "experiment" for all the tests of
+        each experiment (the binomial tests of all the samples together) or "global" for all the p-values of the table
+    :param block: number of p-values sorted in memory at once, the p-values of bigger families are sorted on disk
+    :param folder: folder of the temporary files of the sort on disk
+    :return: the table with the corrected p-values
+    """
+    if family not in Multiple_testing.FAMILIES:
+        raise ValueError("Unknown family " + str(family) + ", use one of " + ", ".join(Multiple_testing.FAMILIES))
+    families = {}
+    for test, experiment, column, corrected in pvalue_columns(df, samples, experiments):
+        key = {"test": column, "experiment": experiment, "global": "global"}[family]
+        families.setdefault(key, []).append((test, column, corrected))
+
+    new_cols = {}
+    after = {}
+    for key, members in families.items():
+        if method is not None:
+            family_method = method
+        elif family == "test":
+            family_method = DEFAULT_CORRECTIONS[members[0][0]]
+        else:
+            family_method = Multiple_testing.DEFAULT_METHOD
+        corrected = Multiple_testing.correct([df[column].to_numpy(dtype=np.float64) for test, column, name in members],
+                                             family_method, block, folder)
+        for (test, column, name), values in zip(members, corrected):
+            new_cols[name] = values
+            after[column] = name
+
+    # Each corrected column after its p-values
+    df = df.drop(columns=[col for col in new_cols if col in df.columns])
+    order = []
+    for col in df.columns:
+        order.append(col)
+        if col in after:
+            order.append(after[col])
+    df_corrected = pd.concat([df, pd.DataFrame(new_cols, index=df.index)], axis=1)[order]
+    print("P-values corrected for the multiple testing in ", len(families), " families of ", family)
+    return df_corrected
+
+
+def parse_arguments():
+    # Options of the statistical tests
+    parser = argparse.ArgumentParser(description="Statistical tests of allele specific expression")
+    parser.add_argument("--format", choices=list(Table_format.FORMATS), default=Table_format.DEFAULT_FORMAT,
+                        help="Format of the tables QC, Chi_test, Fisher and SNPs_analysed. The binary formats keep the "
+                             "column types and need pyarrow")
+    parser.add_argument("--csv", action="store_true",
+                        help="Also export the final table SNPs_analysed as csv")
+    parser.add_argument("--prune", action="store_true",
+                        help="Read only the allele depth and allele frequency columns of the samples in the sample "
+                             "names file. The genotypes and the other samples are left out of the final table")
+    parser.add_argument("--tensor", action="store_true",
+                        help="Read the allele depths from the arrays in the folder SNPs_ready_counts written by "
+                             "ASE_data_wrangling.py --tensor instead of the columns of the QC table")
+    parser.add_argument("--plots", default=None,
+                        help="Folder where the heatmap is written instead of shown, for the runs without display")
+    parser.add_argument("--plot-format", choices=Plot_render.PLOT_FORMATS, default="png",
+                        help="Format of the heatmap written with --plots")
+    parser.add_argument("--rounding", choices=Exact_tests.ROUNDING, default=Exact_tests.DEFAULT_ROUNDING,
+                        help="Rounding of the fractional read counts, from the average of the pseudogenomes, in the "
+                             "exact tests: floor drops the fraction as scipy, rint rounds to the nearest whole number")
+    parser.add_argument("--null-proportion", type=null_proportion, default=Exact_tests.DEFAULT_PROPORTION,
+                        help="Null proportion of the reads of the reference allele of the binomial test, or 'sample' "
+                             "for the proportion of the reads of the reference allele of each sample, to correct the "
+                             "bias of the mapping to the reference allele")
+    parser.add_argument("--correction", choices=Multiple_testing.METHODS, default=None,
+                        help="Correction of the p-values for the multiple testing. By default the chi-square test is "
+                             "corrected with bonferroni and the Fisher and binomial tests with bh, or all with bh when "
+                             "the family is not 'test'")
+    parser.add_argument("--family", choices=Multiple_testing.FAMILIES, default="test",
+                        help="P-values corrected together: each test, each experiment, or all the p-values of the run "
+                             "for a genome-wide correction")
+    parser.add_argument("--correction-block", type=int, default=Multiple_testing.BLOCK,
+                        help="Number of p-values sorted in memory at once for the correction, bigger families are "
+                             "sorted on disk in the temp folder")
+    parser.add_argument("--test-cache", default=None,
+                        help="File of the test cache. Each distinct table of counts is tested once, and the results "
+                             "are read from the file at the start and written to it at the end of the run")
+    parser.add_argument("--test-cache-size", type=int, default=Test_cache.DEFAULT_ENTRIES,
+                        help="Maximum number of tables of the test cache. The tables used least recently are deleted "
+                             "first")
+    parser.add_argument("--heatmap", choices=Plot_render.HEATMAP_BINS, default="snps",
+                        help="Rows of the heatmap: one for each SNP, or the mean of the SNPs of each genomic window, gene "
+                             "or cluster of allele frequencies, for millions of SNPs")
+    parser.add_argument("--window", type=int, default=Plot_render.WINDOW,
+                        help="Size in bases of the genomic windows of the heatmap")
+    parser.add_argument("--clusters", type=int, default=Plot_render.CLUSTERS,
+                        help="Number of clusters of the heatmap, found with a mini-batch k-means")
+    parser.add_argument("--max-rows", type=int, default=Plot_render.MAX_ROWS,
+                        help="Maximum number of rows of the binned heatmap, the neighbour bins are joined")
+    parser.add_argument("--significant", nargs="+", choices=list(CORRECTED_PVALUES), default=None,
+                        help="Draw the heatmap after the tests with only the SNPs significant in these tests")
+    parser.add_argument("--alpha", type=float, default=0.05,
+                        help="Threshold of the corrected p-values of the SNPs drawn with --significant")
+    parser.add_argument("--profile", default=None,
+                        help="Folder where the cProfile statistics of each stage are written, as stage + '.prof'")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Measure the peak memory allocated by Python in each stage with tracemalloc, which slows "
+                             "the run down")
+    return parser.parse_args()
 
 
 def main ():
+    args = parse_arguments()
+    Run_report.start(args.profile, args.trace_memory)
+    if args.plots is not None:
+        Plot_render.headless()
+
     # Read the working path
     cwd = os.getcwd()
 
@@ -327,10 +419,13 @@ def main ():
     exp = pd.read_csv("Experimental_design_Weismann.csv")
     groups_df = pd.read_csv("Experimental_groups_Weismann.csv")
     sample_names = pd.read_csv("Sample_names_Weismann.csv")
-    df_qc = pd.read_csv("QC_Weismann.csv")
-
-    # Create a numpy array of arrays with the samples of each group and the total samples of the experiment
-    groups = groups_df.values
+    with Run_report.stage("Read") as record:
+        if args.prune:
+            df_qc = Table_format.read_table("QC_Weismann", args.format, sample_names["Sample_name"].values,
+                                            ("AD", "AF"))
+        else:
+            df_qc = Table_format.read_table("QC_Weismann", args.format)
+        record["rows"] = len(df_qc)
 
     # Create a numpy array with the name of each group
     group_names = list(groups_df["Group"])
@@ -341,6 +436,20 @@ def main ():
     # Create an array with the name of each experimental test
     experiments = list(exp["Test_ID"])
 
+    # Arrays of SNPs x samples x alleles with the allele depths, with the position of each sample and the samples of each
+    # group. They are opened memory-mapped from the folder written by the wrangling or built from the QC table.
+    with Run_report.stage("Counts", len(df_qc)):
+        if args.tensor:
+            counts = Count_tensor.open_counts(path.join(cwd, "SNPs_ready_counts"))
+            if len(counts.ad) != len(df_qc):
+                raise ValueError("The arrays in SNPs_ready_counts do not match the table QC_Weismann")
+        else:
+            counts = Count_tensor.from_table(df_qc, Count_tensor.make_layout(samples, groups_df))
+        layout = Count_tensor.make_layout(counts.layout.samples, groups_df)
+
+    # Results of the tests of each distinct table of counts, read from the file of the test cache when there is one
+    test_cache = Test_cache.load(args.test_cache, args.test_cache_size)
+
     """
     PLOT HEATMAP
     ------------
@@ -348,78 +457,57 @@ def main ():
     The matrix has to be specific for allele frequencies per group and Chromosome position.
     Now make a general comparison between treatments. Most of the colors in these graphs are or 0 or 1, since they 
     correspond to the allelic imbalance with significance.
+    With "--heatmap window", "gene" or "cluster" the rows are the mean allele frequencies of bins of SNPs, so millions of
+    SNPs can be drawn, and with "--significant" the heatmap is drawn after the tests with only the significant SNPs.
     """
 
-    heatmap(df_qc, group_names)
+    heatmap_options = (args.plots, args.plot_format, args.heatmap, args.window, args.clusters, args.max_rows)
+    if args.significant is None:
+        with Run_report.stage("Heatmap", len(df_qc)):
+            heatmap(df_qc, group_names, *heatmap_options)
 
     """ 
     STATISTICAL TESTS
     -----------------
     We implement: 
-        Chi² test for allele specific expression in each experimental group based in allele frequencies
+        Chi² test for allele specific expression in each experimental group based in allele counts
         Binomial test for allelic imbalance in each sample based in allele counts 
         Fisher exact test for allele specific expression in samples from the same individual based in allele counts
     A Bonferroni one-step correction will be applied to the p-values of the chi-square test and a Benjamini-Hochberg 
-    non-negative test will be applied to the Fisher and Binomial tests respectively.
-
-
-    Chi-square test for conditions based on allele frequencies
-    ----------------------------------------------------------
-    In this test we compare the allele frequencies in allelic imbalance according to the experimental design described in 
-    the file "Experimental_design.csv". It is possible to test more than one factor but it will compare them by pairs, being 
-    the "group1" the control group and the "group2" the experimental.
-
-    The function used is "chisquare" from the package scipy:
-        scipy.stats.chisquare(f_obs, f_exp=None, ddof=0, axis=0)[source]¶
-
-        Calculate a one-way chi-square test.
-
-        The chi-square test tests the null hypothesis: the categorical data has the expected frequencies.
-
-        Parameters
-
-            f_obsarray_like
-                Observed frequencies in each category.
-
-            f_exparray_like, optional
-                Expected frequencies in each category. By default the categories are assumed to be equally likely.
+    non-negative test will be applied to the Fisher and Binomial tests respectively, after all the tests (see Multiple
+    testing below).
 
-            ddofint, optional
-                “Delta degrees of freedom”: adjustment to the degrees of freedom for the p-value. The p-value is computed using 
-                a chi-squared distribution with k - 1 - ddof degrees of freedom, where k is the number of observed frequencies. 
-                The default value of ddof is 0.
 
-            axisint or None, optional
-                The axis of the broadcast result of f_obs and f_exp along which to apply the test. If axis is None, all values 
-                in f_obs are treated as a single data set. Default is 0.
-
-
-        Returns
-
-            chisqfloat or ndarray
-                The chi-squared test statistic. The value is a float if axis is None or f_obs and f_exp are 1-D.
-            pfloat or ndarray
-                The p-value of the test. The value is a float if ddof and the return value chisq are scalars.
+    Chi-square test for conditions based on allele counts
+    -----------------------------------------------------
+    In this test we compare the allele specific expression of the groups according to the experimental design described
+    in the file "Experimental_design.csv". It is possible to test more than one factor but it will compare them by pairs,
+    being the "group1" the control group and the "group2" the experimental.
 
     Chi-square for each described test
     ----------------------------------
-    This test will compare the differences between the two experimental groups described in the test. For this, the 
-    dataframe can't have allele frequencies equal to 0 for all the members of the experimental group. The formula needs the 
-    next variables: 
-        sampling size
-        expected probability (reference allele frequency from control group) 
-        observed probability (reference allele frequency from the experimental group) 
+    The reads of the reference and the alternative allele are summed over the samples of each group, as given in
+    "Experimental_groups.csv", and the test is the Pearson chi-square test of independence of the 2x2 contingency table:
+
+                        reference   alternative
+        control group      R1           A1
+        experimental       R2           A2
 
-    NOTE: The number of samples in the control and experimental groups have to be the same. Otherwise the script will 
-    pop the extra samples in the biggest group.
+    with one degree of freedom and without continuity correction. The groups can have different numbers of samples, as
+    all the reads of each group are pooled. A SNP without reads in one of the groups or in one of the alleles cannot be
+    tested and gets empty values. The statistic and the p-value are written for each test, as test + "_CHI_stat" and
+    "_CHI_p-val" in "Chi_test". The p-value corrected with Bonferroni, unless "--correction" gives another method, is
+    written as "_CHI_p-fdr" by the correction of all the tests at the end, in "SNPs_analysed_Weismann".
 
     Now let's perform the test.
     """
 
     os.chdir("temp")
-    df_chi = chi_square(df_qc, samples, exp, experiments)
+    with Run_report.stage("Chi", len(df_qc)):
+        df_chi = chi_square(df_qc, samples, exp, experiments, counts, layout)
 
-    df_chi.to_csv("Chi_test.csv")
+    with Run_report.stage("Write", len(df_chi)):
+        Table_format.write_table(df_chi, "Chi_test", args.format)
 
     """ 
     Fisher exact test for ASE
@@ -428,9 +516,11 @@ def main ():
 
     """
 
-    df_fisher = Fisher(df_chi, samples, exp, experiments)
+    with Run_report.stage("Fisher", len(df_chi)):
+        df_fisher = Fisher(df_chi, samples, exp, experiments, counts, args.rounding, test_cache)
 
-    df_fisher.to_csv("Fisher.csv")
+    with Run_report.stage("Write", len(df_fisher)):
+        Table_format.write_table(df_fisher, "Fisher", args.format)
 
     """
     Binomial test
@@ -443,14 +533,47 @@ def main ():
     experimental group or by individual) (n). For this analysis, the expected frequency is 0.5 and the observed allele 
     frequency is determined for the reference allele in each individual or for the control group (p). This test will 
     provide the p-values for the significant differences of the groups. The formula is extracted from Wikipedia and 
-    adapted to each test. In python the formula is scipy.stats.binom_test (x,n,p, alternative "two-sided"). 
+    adapted to each test. The p-values are the ones of scipy.stats.binomtest (x, n, p, alternative "two-sided"),
+    computed for all the SNPs and samples at once in Exact_tests. With "--null-proportion" the expected frequency can be
+    lower than 0.5, or with "sample" the proportion of the reads of the reference allele of each sample, to correct the
+    bias of the mapping to the reference allele.
+    """
+
+    with Run_report.stage("Binomial", len(df_fisher)):
+        df_binomial = binomial(df_fisher, samples, counts, test_cache, args.null_proportion, args.rounding)
+
+    """
+    Multiple testing
+    ----------------
+    The p-values of all the tests are corrected at the end, in families of p-values corrected together: each test (the
+    default), each experiment or all the p-values of the run with "--family". The correction is chosen with
+    "--correction" among Bonferroni, Holm, Benjamini-Hochberg, Benjamini-Yekutieli and the q-values of Storey. The
+    families bigger than "--correction-block" p-values are sorted on disk in the temp folder.
     """
 
-    df_binomial = binomial(df_fisher, samples)
+    with Run_report.stage("Correction", len(df_binomial)):
+        df_binomial = correct_pvalues(df_binomial, samples, experiments, args.correction, args.family,
+                                      args.correction_block, ".")
 
     os.chdir(cwd)
-    df_binomial.to_csv("SNPs_analysed_Weismann.csv")
-    print("Analyzed data available in 'SNPs_analysed.csv'")
+    print(Test_cache.summary(test_cache))
+    if args.test_cache:
+        Test_cache.save(test_cache, args.test_cache)
+
+    # Heatmap of the SNPs significant in the tests
+    if args.significant is not None:
+        with Run_report.stage("Heatmap", len(df_binomial)):
+            heatmap(df_binomial[significant(df_binomial, args.significant, args.alpha)], group_names,
+                    *heatmap_options)
+
+    with Run_report.stage("Write", len(df_binomial)):
+        analysed = Table_format.write_table(df_binomial, "SNPs_analysed_Weismann", args.format)
+        if args.csv and args.format != "csv":
+            analysed = Table_format.write_table(df_binomial, "SNPs_analysed_Weismann", "csv")
+    print("Analyzed data available in '" + analysed + "'")
+
+    # Time and memory of each stage
+    Run_report.write(REPORT_FILE)
 
 if __name__ == '__main__' :
     main()
\ No newline at end of file
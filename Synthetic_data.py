@@ -0,0 +1,325 @@
+# Python 3.7
+# Synthetic_data.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+Generator of synthetic input files for the workflow, to measure and check the scripts without the real data. It writes:
+    The two tables of SNPs "SNPs_for_wrangling_" + name + "_" + PSG + ".csv", one for each pseudogenome, with the
+    columns of the VariantsToTable output converted to csv: CHROM, POS, the annotations, AF and four columns for each
+    sample.
+    "Sample_names_" + name + ".csv", "Pseudogenome_codes.csv", "Experimental_groups.csv" (also as
+    "Experimental_groups_" + name + ".csv"), "Experimental_design_" + name + ".csv" and, with two tissues or more,
+    "Samples_MAE.csv" with the samples of the same individual in the first two tissues.
+
+The groups are a tissue and a condition, as "GF" for gills in freshwater, and the samples are numbered in each group, as
+"1GF". Every SNP has a reference and an alternative base and every sample a true genotype drawn from the genotype mix:
+homozygot for the reference, heterozygot, homozygot for the alternative or not expressed. Each pseudogenome calls the
+genotype of the sample, with:
+    discordance: probability that the second pseudogenome calls a homozygot for a heterozygot or a heterozygot for a
+        homozygot, which gives the evaluation cases 4 to 8
+    swap: probability that a pseudogenome writes the alleles of a heterozygot in the other order, which gives case 3
+    multiallelic: probability that the second pseudogenome calls a third base
+    missing: probability that a pseudogenome has no call, "." genotypes and no reads
+The reads of a sample follow a negative binomial distribution with mean depth_mean and dispersion depth_dispersion. The
+reads of a heterozygot are split between the alleles with a binomial of frequency 0.5, or of a frequency from a beta
+distribution for the SNPs with allelic imbalance, and the homozygots have reads of the other allele with the
+probability error.
+
+The SNPs are generated in blocks of rows with a random generator seeded by the seed and the number of the block, so the
+data only depend on the configuration and can be written in chunks of any size.
+"""
+
+import argparse
+import os
+from collections import namedtuple
+from os import path
+
+import numpy as np
+import pandas as pd
+
+# Letters of the tissues and the conditions of the groups
+TISSUES = "GKLMHB"
+CONDITIONS = "FSTUVW"
+
+# Names of the tissues for the columns of Samples_MAE.csv, in plural
+TISSUE_NAMES = {"G": "Gills", "K": "Kidneys", "L": "Livers", "M": "Muscles", "H": "Hearts", "B": "Brains"}
+
+BASES = np.array(["A", "C", "G", "T"], dtype=object)
+
+# True genotypes of the genotype mix
+HOM_REF, HET, HOM_ALT, NOT_EXPRESSED = 0, 1, 2, 3
+
+# Rows of each block of generated SNPs
+BLOCK = 100000
+
+# Annotations of the SNPs and their weights
+FUNCTIONS = ["exonic", "intronic", "UTR3", "UTR5", "ncRNA_exonic"]
+FUNCTION_WEIGHTS = [0.4, 0.25, 0.2, 0.1, 0.05]
+EXONIC_FUNCTIONS = ["synonymous SNV", "nonsynonymous SNV"]
+
+Config = namedtuple("Config", ["snps", "samples", "tissues", "conditions", "PSGs", "chromosomes", "genotype_mix",
+                               "discordance", "swap", "multiallelic", "missing", "depth_mean", "depth_dispersion",
+                               "imbalance", "error", "dropouts", "name", "seed"],
+                    defaults=[10000, 3, 2, 2, ("GF3", "KF6"), 3, (0.3, 0.4, 0.2, 0.1), 0.02, 0.3, 0.001, 0.002, 30.0,
+                              2.0, 0.1, 0.01, 0, "Weismann", 0])
+
+
+def groups(config):
+    # Group names, tissue by tissue
+    return [tissue + condition for tissue in TISSUES[:config.tissues] for condition in CONDITIONS[:config.conditions]]
+
+
+def group_table(config):
+    # Samples of each group, as Experimental_groups.csv. The last samples of the groups are left out, one by one, as
+    # many as dropouts, and their slots are empty.
+    names = groups(config)
+    table = pd.DataFrame({"Group": names})
+    for i in range(1, config.samples + 1):
+        table["ID_" + str(i)] = [str(i) + group for group in names]
+    for k in range(min(config.dropouts, len(names) * config.samples)):
+        row = len(names) - 1 - k % len(names)
+        table.iloc[row, config.samples - k // len(names)] = np.nan
+    return table
+
+
+def sample_names(config):
+    # Samples of the groups in the order of Experimental_groups.csv
+    table = group_table(config)
+    return [sample for row in table.itertuples(index=False) for sample in row[1:] if not pd.isna(sample)]
+
+
+def design_table(config):
+    # Tests of the experimental design: the first condition against the others in each tissue and the first tissue
+    # against the others in each condition
+    tests = []
+    for tissue in TISSUES[:config.tissues]:
+        for condition in CONDITIONS[1:config.conditions]:
+            tests.append((tissue + CONDITIONS[0], tissue + condition))
+    for condition in CONDITIONS[:config.conditions]:
+        for tissue in TISSUES[1:config.tissues]:
+            tests.append((TISSUES[0] + condition, tissue + condition))
+    return pd.DataFrame({"Test_ID": ["Test_" + str(k + 1) for k in range(len(tests))],
+                         "Group_1": [first for first, second in tests],
+                         "Group_2": [second for first, second in tests]})
+
+
+def mae_table(config):
+    # Samples of the same individual and condition in the first two tissues
+    if config.tissues < 2:
+        return None
+    samples = set(sample_names(config))
+    first, second = TISSUES[0], TISSUES[1]
+    pairs = [(str(i) + first + condition, str(i) + second + condition)
+             for condition in CONDITIONS[:config.conditions] for i in range(1, config.samples + 1)]
+    pairs = [pair for pair in pairs if pair[0] in samples and pair[1] in samples]
+    return pd.DataFrame(pairs, columns=[TISSUE_NAMES[first], TISSUE_NAMES[second]])
+
+
+def positions(rng, chrom, state):
+    # Sorted positions of the rows of a block. state has the last position of each chromosome of the previous blocks.
+    pos = np.empty(len(chrom), dtype=np.int64)
+    starts = np.concatenate([[0], np.flatnonzero(chrom[1:] != chrom[:-1]) + 1, [len(chrom)]])
+    for start, end in zip(starts[:-1], starts[1:]):
+        gaps = rng.geometric(0.01, end - start)
+        pos[start:end] = state.get(chrom[start], 0) + np.cumsum(gaps)
+        state[chrom[start]] = int(pos[end - 1])
+    return pos
+
+
+def calls(rng, genotype, ref, alt, swap):
+    # Alleles called by a pseudogenome for the true genotypes, shape SNPs x samples. The heterozygots are written in
+    # the other order with probability swap.
+    ref = ref[:, np.newaxis]
+    alt = alt[:, np.newaxis]
+    swapped = rng.random(genotype.shape) < swap
+    first = np.select([genotype == HOM_REF, genotype == HET, genotype == HOM_ALT],
+                      [ref, np.where(swapped, alt, ref), alt], ".")
+    second = np.select([genotype == HOM_REF, genotype == HET, genotype == HOM_ALT],
+                       [ref, np.where(swapped, ref, alt), alt], ".")
+    return first.astype(object), second.astype(object)
+
+
+def reads(rng, config, genotype, frequency):
+    # Reads of the reference and the alternative allele for the true genotypes, shape SNPs x samples
+    shape = genotype.shape
+    mean = rng.gamma(config.depth_dispersion, config.depth_mean / config.depth_dispersion, shape)
+    depth = rng.poisson(mean)
+    p_ref = np.select([genotype == HOM_REF, genotype == HET, genotype == HOM_ALT],
+                      [1 - config.error, frequency[:, np.newaxis], config.error], 0)
+    depth = np.where(genotype == NOT_EXPRESSED, 0, depth)
+    r = rng.binomial(depth, p_ref)
+    return r, depth - r
+
+
+def block(config, k, state):
+    """
+    Generate a block of SNPs.
+
+    :param config: Config
+    :param k: number of the block
+    :param state: last position of each chromosome, updated with the block
+    :return: dictionary with the table of each pseudogenome
+    """
+    rng = np.random.default_rng([config.seed, k])
+    rows = np.arange(k * BLOCK, min((k + 1) * BLOCK, config.snps))
+    n = len(rows)
+    samples = sample_names(config)
+    chrom_number = rows * config.chromosomes // config.snps
+    chrom = np.array(["chr" + str(c + 1) for c in range(config.chromosomes)], dtype=object)[chrom_number]
+    pos = positions(rng, chrom_number, state)
+
+    ref_code = rng.integers(0, 4, n)
+    alt_code = (ref_code + rng.integers(1, 4, n)) % 4
+    # Third base, after the alternative base and not the reference base
+    third_code = (alt_code + 1) % 4
+    third_code = np.where(third_code == ref_code, (third_code + 1) % 4, third_code)
+    ref, alt, third = BASES[ref_code], BASES[alt_code], BASES[third_code]
+
+    # Frequency of the reference allele in the heterozygots, away from 0.5 for the SNPs with allelic imbalance
+    imbalanced = rng.random(n) < config.imbalance
+    skew = rng.beta(2, 6, n)
+    frequency = np.where(imbalanced, np.where(rng.random(n) < 0.5, skew, 1 - skew), 0.5)
+
+    mix = np.asarray(config.genotype_mix, dtype=float)
+    genotype = rng.choice(4, (n, len(samples)), p=mix / mix.sum())
+    discordant = (rng.random(genotype.shape) < config.discordance) & (genotype != NOT_EXPRESSED)
+    # The discordant calls lose or gain an allele: a heterozygot becomes a homozygot and a homozygot a heterozygot
+    other = np.where(genotype == HET, np.where(rng.random(genotype.shape) < 0.5, HOM_REF, HOM_ALT), HET)
+    genotypes = [genotype, np.where(discordant, other, genotype)]
+
+    function = rng.choice(FUNCTIONS, n, p=FUNCTION_WEIGHTS)
+    exonic = np.where(function == "exonic", rng.choice(EXONIC_FUNCTIONS, n), ".")
+    expressed = genotype != NOT_EXPRESSED
+    with np.errstate(divide="ignore", invalid="ignore"):
+        af = ((genotype == HET) * 0.5 + (genotype == HOM_ALT)).sum(axis=1) / expressed.sum(axis=1)
+    annotations = {"CHROM": chrom, "POS": pos, "Gene.refGene": np.char.add("gene", (pos // 20000).astype(str)),
+                   "Func.refGene": function, "ExonicFunc.refGene": exonic, "AF": np.round(np.nan_to_num(af), 3)}
+
+    tables = {}
+    for p, PSG in enumerate(config.PSGs[:2]):
+        first, second = calls(rng, genotypes[p], ref, alt, config.swap)
+        r_ad, a_ad = reads(rng, config, genotypes[p], frequency)
+        if p == 1:
+            # Third base in the calls of the second pseudogenome
+            multi = (rng.random(genotype.shape) < config.multiallelic) & (second != ".")
+            second = np.where(multi, third[:, np.newaxis], second)
+        missing = rng.random(genotype.shape) < config.missing
+        first = np.where(missing, ".", first)
+        second = np.where(missing, ".", second)
+        r_ad = np.where(missing, 0, r_ad)
+        a_ad = np.where(missing, 0, a_ad)
+        columns = dict(annotations)
+        for j, sample in enumerate(samples):
+            columns[sample + "_R_" + PSG + ".AD"] = r_ad[:, j]
+            columns[sample + "_A_" + PSG + ".AD"] = a_ad[:, j]
+            columns[sample + "_R_" + PSG + ".GT"] = first[:, j]
+            columns[sample + "_A_" + PSG + ".GT"] = second[:, j]
+        tables[PSG] = pd.DataFrame(columns, index=rows)
+    return tables
+
+
+def blocks(config):
+    # Generate the blocks of SNPs in order
+    state = {}
+    for k in range((config.snps + BLOCK - 1) // BLOCK):
+        yield block(config, k, state)
+
+
+def generate(config):
+    """
+    Generate the two tables of SNPs in memory.
+
+    :param config: Config
+    :return: dictionary with the table of each pseudogenome code
+    """
+    parts = list(blocks(config))
+    return {PSG: pd.concat([part[PSG] for part in parts]).reset_index(drop=True) for PSG in config.PSGs[:2]}
+
+
+def snps_file(config, PSG):
+    return "SNPs_for_wrangling_" + config.name + "_" + PSG + ".csv"
+
+
+def write_design(config, folder="."):
+    # Files with the samples, the pseudogenome codes, the groups, the design and the pairs of tissues
+    os.makedirs(folder, exist_ok=True)
+    pd.DataFrame({"Sample_name": sample_names(config)}).to_csv(
+        path.join(folder, "Sample_names_" + config.name + ".csv"), index=False)
+    pd.DataFrame({"PSGs": list(config.PSGs[:2])}).to_csv(path.join(folder, "Pseudogenome_codes.csv"), index=False)
+    table = group_table(config)
+    table.to_csv(path.join(folder, "Experimental_groups.csv"), index=False)
+    table.to_csv(path.join(folder, "Experimental_groups_" + config.name + ".csv"), index=False)
+    design_table(config).to_csv(path.join(folder, "Experimental_design_" + config.name + ".csv"), index=False)
+    mae = mae_table(config)
+    if mae is not None:
+        mae.to_csv(path.join(folder, "Samples_MAE.csv"), index=False)
+    elif path.exists(path.join(folder, "Samples_MAE.csv")):
+        os.remove(path.join(folder, "Samples_MAE.csv"))
+
+
+def write(config, folder="."):
+    """
+    Write the two tables of SNPs and the design files, block by block, so the memory does not depend on the number of
+    SNPs.
+
+    :param config: Config
+    :param folder: output folder
+    """
+    write_design(config, folder)
+    for k, tables in enumerate(blocks(config)):
+        for PSG, table in tables.items():
+            table.to_csv(path.join(folder, snps_file(config, PSG)), mode="w" if k == 0 else "a", header=k == 0,
+                         index=False)
+        print("SNPs written: ", tables[config.PSGs[0]].index[-1] + 1)
+
+
+def parse_arguments():
+    # Options of the generator
+    defaults = Config()
+    parser = argparse.ArgumentParser(description="Synthetic SNP tables and design files for the workflow")
+    parser.add_argument("--snps", type=int, default=defaults.snps, help="Number of SNPs")
+    parser.add_argument("--samples", type=int, default=defaults.samples, help="Number of samples of each group")
+    parser.add_argument("--tissues", type=int, default=defaults.tissues, help="Number of tissues, up to 6")
+    parser.add_argument("--conditions", type=int, default=defaults.conditions, help="Number of conditions, up to 6")
+    parser.add_argument("--psgs", nargs=2, default=list(defaults.PSGs), help="Codes of the two pseudogenomes")
+    parser.add_argument("--chromosomes", type=int, default=defaults.chromosomes, help="Number of chromosomes")
+    parser.add_argument("--genotype-mix", type=float, nargs=4, default=list(defaults.genotype_mix),
+                        help="Weights of the true genotypes: homozygot reference, heterozygot, homozygot alternative "
+                             "and not expressed")
+    parser.add_argument("--discordance", type=float, default=defaults.discordance,
+                        help="Probability that the second pseudogenome calls a homozygot for a heterozygot or the opposite")
+    parser.add_argument("--swap", type=float, default=defaults.swap,
+                        help="Probability that a heterozygot is written with the alleles in the other order")
+    parser.add_argument("--multiallelic", type=float, default=defaults.multiallelic,
+                        help="Probability that the second pseudogenome calls a third base")
+    parser.add_argument("--missing", type=float, default=defaults.missing,
+                        help="Probability that a pseudogenome has no call for a sample, with '.' genotypes")
+    parser.add_argument("--depth-mean", type=float, default=defaults.depth_mean, help="Mean number of reads")
+    parser.add_argument("--depth-dispersion", type=float, default=defaults.depth_dispersion,
+                        help="Dispersion of the negative binomial of the reads, smaller is more spread")
+    parser.add_argument("--imbalance", type=float, default=defaults.imbalance,
+                        help="Fraction of the SNPs with allelic imbalance")
+    parser.add_argument("--error", type=float, default=defaults.error,
+                        help="Probability of a read of the other allele in the homozygots")
+    parser.add_argument("--dropouts", type=int, default=defaults.dropouts,
+                        help="Number of samples left out of the groups, with empty slots in Experimental_groups.csv")
+    parser.add_argument("--name", default=defaults.name, help="Name of the experiment in the file names")
+    parser.add_argument("--seed", type=int, default=defaults.seed, help="Seed of the random generator")
+    parser.add_argument("--output", default=".", help="Output folder")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    config = Config(args.snps, args.samples, args.tissues, args.conditions, tuple(args.psgs), args.chromosomes,
+                    tuple(args.genotype_mix), args.discordance, args.swap, args.multiallelic, args.missing,
+                    args.depth_mean, args.depth_dispersion, args.imbalance, args.error, args.dropouts, args.name,
+                    args.seed)
+    write(config, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+# Python 3.7
+# Table_format.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+Reading and writing of the tables passed between the steps of the workflow. The intermediate tables can be written as
+csv, or as parquet or feather files, which keep the types of the columns (counts, frequencies, categories) and are
+compressed, so the numbers are not formatted as text and parsed again at every step. The binary formats need the
+package pyarrow.
+
+The tables are named without extension, for example "temp/AD10_SNPs", and the extension of the format is added.
+
+The csv tables of SNPs are read with the types given by the names of the columns instead of inferring them: the allele
+depths of the pseudogenomes (sample + "_R_" + pseudogenome code + ".AD") are read counts stored as uint32, the averaged
+allele depths (sample + "_R_.AD") are float32, and the genotypes and the annotations are categories. Only the columns of
+the samples and the fields (AD, GT, AF) that a step uses can be read, and the csv is parsed by the multi-threaded csv
+reader of pyarrow when it is installed.
+
+A parquet or feather table written in several chunks is a folder with one file for each chunk, "part_0", "part_1"...
+The chunks are read in order and joined, so a table read from a folder is the same as a table written at once.
+"""
+
+import csv
+import os
+import shutil
+from os import path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# Extension of each format
+FORMATS = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+
+# Compression of the binary formats
+COMPRESSION = {"parquet": "zstd", "feather": "lz4"}
+
+# Format of the intermediate tables when it is not chosen: parquet when pyarrow is installed
+DEFAULT_FORMAT = "parquet" if pyarrow is not None else "csv"
+
+# Annotation columns that repeat across many rows and are kept as categories
+ANNOTATION_COLUMNS = ["Gene.refGene", "Func.refGene", "ExonicFunc.refGene"]
+
+# Fields of the columns of a sample: allele depth, genotype and allele frequency
+FIELDS = ("AD", "GT", "AF")
+
+
+def table_file(name, fmt):
+    # File name of a table in a format
+    return name + FORMATS[fmt]
+
+
+def part_file(folder, part, fmt):
+    # File name of the chunk number part of a table written in chunks
+    return path.join(folder, "part_" + str(part) + FORMATS[fmt])
+
+
+def write_file(df, file_name, fmt):
+    if fmt == "parquet":
+        df.to_parquet(file_name, compression=COMPRESSION[fmt])
+    elif fmt == "feather":
+        # Feather does not store the index, it is kept as a column
+        df.reset_index().to_feather(file_name, compression=COMPRESSION[fmt])
+    else:
+        df.to_csv(file_name)
+
+
+def read_file(file_name, fmt, **kwargs):
+    if fmt == "parquet":
+        return pd.read_parquet(file_name, **kwargs)
+    if fmt == "feather":
+        if "columns" in kwargs:
+            kwargs["columns"] = ["index"] + list(kwargs["columns"])
+        df = pd.read_feather(file_name, **kwargs)
+        df = df.set_index(df.columns[0])
+        df.index.name = None
+        return df
+    return pd.read_csv(file_name, **kwargs)
+
+
+def count_parts(folder, fmt):
+    # Number of chunks of a table written in chunks
+    part = 0
+    while path.exists(part_file(folder, part, fmt)):
+        part = part + 1
+    return part
+
+
+def remove(file_name):
+    if path.isdir(file_name):
+        shutil.rmtree(file_name)
+    elif path.exists(file_name):
+        os.remove(file_name)
+
+
+def write_table(df, name, fmt="csv", append=False):
+    """
+    Write a table, or append it to the table written for the previous chunks.
+
+    :param df: dataframe to write
+    :param name: name of the table without extension
+    :param fmt: "csv", "parquet" or "feather"
+    :param append: add the rows to the existing table. A csv table gets the rows without header, and a binary table
+        becomes a folder with a file for each chunk.
+    :return: file name of the table
+    """
+    file_name = table_file(name, fmt)
+    if fmt == "csv":
+        if append:
+            df.to_csv(file_name, mode="a", header=False)
+        else:
+            df.to_csv(file_name)
+        return file_name
+
+    if not append or not path.exists(file_name):
+        remove(file_name)
+        write_file(df, file_name, fmt)
+        return file_name
+
+    if not path.isdir(file_name):
+        # Second chunk: the table written for the first chunk becomes the first part of the folder
+        first_part = file_name + ".part_0"
+        os.rename(file_name, first_part)
+        os.makedirs(file_name)
+        os.rename(first_part, part_file(file_name, 0, fmt))
+    write_file(df, part_file(file_name, count_parts(file_name, fmt), fmt), fmt)
+    return file_name
+
+
+def concatenate(parts):
+    # Join the chunks of a table. The columns that are categories in a chunk are kept as categories with all the
+    # categories of the chunks, in the order they appear, also when other chunks have them with another type.
+    df = pd.concat(parts)
+    for col in df.columns:
+        categorical = [isinstance(part[col].dtype, pd.CategoricalDtype) for part in parts if col in part.columns]
+        if any(categorical) and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            categories = []
+            for part in parts:
+                if col in part.columns:
+                    categories.extend(part[col].astype("category").cat.categories)
+            df[col] = pd.Categorical(df[col], categories=pd.unique(pd.Series(categories, dtype=object)))
+    return df
+
+
+def table_columns(file_name, fmt):
+    # Names of the columns of a binary table, without the columns of the index
+    if path.isdir(file_name):
+        file_name = part_file(file_name, 0, fmt)
+    if fmt == "parquet":
+        import pyarrow.parquet
+        return [col for col in pyarrow.parquet.read_schema(file_name).names if not col.startswith("__index_level_")]
+    import pyarrow.ipc
+    return pyarrow.ipc.open_file(file_name).schema.names[1:]
+
+
+def read_table(name, fmt="csv", samples=None, fields=FIELDS, **kwargs):
+    """
+    Read a table written with write_table.
+
+    :param name: name of the table without extension
+    :param fmt: "csv", "parquet" or "feather"
+    :param samples: samples whose columns are read, None for all the samples
+    :param fields: fields of the sample columns that are read, from "AD", "GT" and "AF"
+    :param kwargs: arguments for the pandas reader of the format
+    :return: dataframe
+    """
+    file_name = table_file(name, fmt)
+    if fmt == "csv":
+        return read_csv_typed(file_name, samples, fields, **kwargs)
+    if samples is not None or tuple(fields) != FIELDS:
+        kwargs["columns"] = select_columns(table_columns(file_name, fmt), samples, fields)
+    if path.isdir(file_name):
+        parts = [read_file(part_file(file_name, part, fmt), fmt, **kwargs)
+                 for part in range(count_parts(file_name, fmt))]
+        return concatenate(parts)
+    return read_file(file_name, fmt, **kwargs)
+
+
+def join_tables(file_names, name, fmt):
+    # Join binary tables written in separate folders, in order. Their files are moved as the chunks of one table.
+    folder = table_file(name, fmt)
+    remove(folder)
+    os.makedirs(folder)
+    part = 0
+    for file_name in file_names:
+        if path.isdir(file_name):
+            chunks = [part_file(file_name, k, fmt) for k in range(count_parts(file_name, fmt))]
+        else:
+            chunks = [file_name]
+        for chunk in chunks:
+            os.rename(chunk, part_file(folder, part, fmt))
+            part = part + 1
+
+
+def column_field(col):
+    # Field and sample of a column of a table of SNPs, and the pseudogenome code of the allele depths and genotypes.
+    # The columns that are not of a sample give (None, None, None).
+    col = str(col)
+    if col.endswith(".AD") or col.endswith(".GT"):
+        allele = max(col.rfind("_R_"), col.rfind("_A_"))
+        if allele > 0:
+            return col[-2:], col[:allele], col[allele + 3:-3]
+    if col.startswith("AF_"):
+        return "AF", col[3:], None
+    return None, None, None
+
+
+def column_dtype(col):
+    # Type of a column from its name, None to let pandas infer it
+    field, sample, PSG = column_field(col)
+    if field == "GT" or col in ANNOTATION_COLUMNS:
+        return "category"
+    if field == "AD":
+        # The depths are read as float32 because the empty cells are NaN, and the read counts of the pseudogenomes are
+        # then converted to uint32 by downcast_counts
+        return "float32"
+    return None
+
+
+def categorize(df):
+    # Columns of categories with the categories of their own values, sorted as read_csv gives them, so a chunk has the
+    # same types whatever the chunks it was joined from or split of
+    columns = {col: df[col].astype(object).astype("category") for col in df.columns if column_dtype(col) == "category"}
+    return df.assign(**columns)
+
+
+def select_columns(columns, samples=None, fields=FIELDS):
+    # Columns of the samples and the fields that are used. The columns that are not of a sample are always kept, and the
+    # allele frequencies of groups are kept with the field AF.
+    samples = None if samples is None else set(str(sample) for sample in samples)
+    selected = []
+    for col in columns:
+        field, sample, PSG = column_field(col)
+        if field is None or (field in fields and (field == "AF" or samples is None or sample in samples)):
+            selected.append(col)
+    return selected
+
+
+def downcast_counts(df):
+    # Read counts of the pseudogenomes as uint32 when the column has no empty cells, as pandas gives int64 to the
+    # columns without empty cells
+    counts = {}
+    for col in df.columns:
+        field, sample, PSG = column_field(col)
+        if field == "AD" and PSG and df[col].dtype.kind == "f":
+            values = df[col].to_numpy()
+            if not np.isnan(values).any() and (values >= 0).all() and (values % 1 == 0).all():
+                counts[col] = values.astype(np.uint32)
+    return df.assign(**counts) if counts else df
+
+
+def read_csv_typed(file_name, samples=None, fields=FIELDS, **kwargs):
+    """
+    Read a csv table of SNPs with the types derived from the column names and only the columns that are used.
+
+    :param file_name: csv file
+    :param samples: samples whose columns are read, None for all the samples
+    :param fields: fields of the sample columns that are read, from "AD", "GT" and "AF"
+    :param kwargs: arguments for pandas.read_csv, for example index_col or chunksize
+    :return: dataframe, or an iterator of dataframes with chunksize
+    """
+    header = pd.read_csv(file_name, nrows=0).columns
+    columns = select_columns(header, samples, fields)
+    if kwargs.get("index_col") == 0 and header[0] not in columns:
+        columns = [header[0]] + columns
+    dtypes = {col: column_dtype(col) for col in columns if column_dtype(col) is not None}
+    if len(columns) < len(header):
+        kwargs["usecols"] = columns
+
+    with open(file_name, newline="") as file:
+        raw_header = next(csv.reader(file))
+    if pyarrow is not None and "chunksize" not in kwargs and len(set(raw_header)) == len(raw_header):
+        # The multi-threaded reader of pyarrow. It keeps the empty column names, which pandas calls "Unnamed: k".
+        raw_names = dict(zip(header, raw_header))
+        if "usecols" in kwargs:
+            kwargs["usecols"] = [raw_names[col] for col in kwargs["usecols"]]
+        dtypes = {raw_names[col]: dtype for col, dtype in dtypes.items()}
+        df = pd.read_csv(file_name, dtype=dtypes, engine="pyarrow", **kwargs)
+        df = df.rename(columns=dict(zip(raw_header, header)))
+        if df.index.name == "":
+            df.index.name = None
+        return downcast_counts(df)
+    # The floats are parsed exactly, as by pyarrow
+    reader = pd.read_csv(file_name, dtype=dtypes, low_memory=False, float_precision="round_trip", **kwargs)
+    if "chunksize" in kwargs:
+        return (downcast_counts(chunk) for chunk in reader)
+    return downcast_counts(reader)
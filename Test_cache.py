@@ -0,0 +1,141 @@
+# Python 3.7
+# Test_cache.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+Cache of the results of the statistical tests of the read counts. The read depths of the SNPs are small and the same
+tables of counts come again and again across the SNPs, the pairs of samples and the experiments, so each test is
+computed once for each distinct table: the tables of a call are collapsed with numpy.unique, the tables already in the
+cache are read from it, only the others are tested, and the results are scattered back to all the tables.
+
+The cache is a dictionary with an entry for each test, named with the parameters that change its results (for instance
+the null proportion of the binomial test). Each entry has the distinct tables, their results and the last call that used
+them. It can be written to a file at the end of a run and read at the start of the next one. The cache has a maximum
+number of tables, and when it is full the tables used least recently are deleted first. A cache written by another
+version of the tests is not used.
+"""
+
+import os
+from os import path
+
+import numpy as np
+
+# Version of the tests of the cached results, a cache of another version is not used
+VERSION = 2
+
+# Maximum number of tables of the cache when it is not given, about 56 bytes each for the Fisher test
+DEFAULT_ENTRIES = 1 << 22
+
+
+def new_cache(max_entries=DEFAULT_ENTRIES):
+    return {"max_entries": max_entries, "tests": {}, "clock": 0, "tables": 0, "distinct": 0, "computed": 0}
+
+
+def lookup(keys, tables):
+    # Position of each table in the keys of the cache, or -1 for the tables that are not in it. The keys and the tables
+    # are distinct rows.
+    if len(keys) == 0:
+        return np.full(len(tables), -1, dtype=np.intp)
+    codes = np.unique(np.concatenate([keys, tables]), axis=0, return_inverse=True)[1].ravel()
+    position = np.full(int(codes.max()) + 1, -1, dtype=np.intp)
+    position[codes[:len(keys)]] = np.arange(len(keys))
+    return position[codes[len(keys):]]
+
+
+def evict(cache):
+    # Delete the tables used least recently, over all the tests, until the cache has at most max_entries tables
+    names = list(cache["tests"])
+    used = [cache["tests"][name]["used"] for name in names]
+    total = sum(len(u) for u in used)
+    if total <= cache["max_entries"]:
+        return
+    # The most recent tables are kept, the ones of the current call first
+    kept = np.zeros(total, dtype=bool)
+    kept[np.argsort(-np.concatenate(used), kind="stable")[:cache["max_entries"]]] = True
+    start = 0
+    for name, u in zip(names, used):
+        entry = cache["tests"][name]
+        keep = kept[start:start + len(u)]
+        cache["tests"][name] = {column: values[keep] for column, values in entry.items()}
+        start = start + len(u)
+
+
+def apply(cache, name, test, counts):
+    """
+    Results of a test for arrays of counts, computed once for each distinct table.
+
+    :param cache: cache of the results, or None to only compute the distinct tables of this call once
+    :param name: name of the test in the cache, with the parameters that change its results
+    :param test: function of one array for each count, of the distinct tables, that returns a tuple of arrays of results
+    :param counts: arrays of the counts of the tables, of the same shape. Use whole counts when the test rounds them,
+        so the tables with the same rounded counts are the same.
+    :return: tuple with an array of each result, of the shape of the counts
+    """
+    counts = np.broadcast_arrays(*(np.asarray(x, dtype=np.float64) for x in counts))
+    shape = counts[0].shape
+    tables, inverse = np.unique(np.stack([x.ravel() for x in counts], axis=1), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+
+    entry = None if cache is None else cache["tests"].get(name)
+    found = np.full(len(tables), -1, dtype=np.intp) if entry is None else lookup(entry["keys"], tables)
+    missing = found < 0
+    computed = test(*tables[missing].T)
+    results = np.empty((len(tables), len(computed)))
+    results[missing] = np.stack([np.asarray(result, dtype=np.float64) for result in computed], axis=1)
+    if entry is not None:
+        results[~missing] = entry["values"][found[~missing]]
+
+    if cache is not None:
+        cache["clock"] = cache["clock"] + 1
+        if entry is None:
+            entry = {"keys": tables[:0], "values": results[:0], "used": np.zeros(0, dtype=np.int64)}
+        entry["used"][found[~missing]] = cache["clock"]
+        cache["tests"][name] = {"keys": np.concatenate([entry["keys"], tables[missing]]),
+                                "values": np.concatenate([entry["values"], results[missing]]),
+                                "used": np.concatenate([entry["used"],
+                                                        np.full(int(missing.sum()), cache["clock"], dtype=np.int64)])}
+        cache["tables"] = cache["tables"] + len(inverse)
+        cache["distinct"] = cache["distinct"] + len(tables)
+        cache["computed"] = cache["computed"] + int(missing.sum())
+        evict(cache)
+
+    return tuple(results[inverse, j].reshape(shape) for j in range(results.shape[1]))
+
+
+def summary(cache):
+    # Line for the user with the tables tested in the run
+    return "Test cache: " + str(cache["tables"]) + " tables, " + str(cache["distinct"]) + " distinct, " + \
+           str(cache["computed"]) + " tested, " + str(sum(len(entry["used"]) for entry in cache["tests"].values())) + \
+           " kept"
+
+
+def load(file_name, max_entries=DEFAULT_ENTRIES):
+    # Cache written by save, or an empty cache when the file does not exist or was written by another version
+    cache = new_cache(max_entries)
+    if file_name is None or not path.exists(file_name):
+        return cache
+    with np.load(file_name) as data:
+        if int(data["version"]) != VERSION:
+            print("Test cache: ", file_name, " was written by another version of the tests and is not used")
+            return cache
+        cache["clock"] = int(data["clock"])
+        for name in data["names"]:
+            cache["tests"][str(name)] = {column: data[str(name) + "/" + column] for column in ("keys", "values", "used")}
+    evict(cache)
+    print("Test cache: ", sum(len(entry["used"]) for entry in cache["tests"].values()), " tables read from ", file_name)
+    return cache
+
+
+def save(cache, file_name):
+    # Write the cache to a file. The file only appears when it is complete.
+    arrays = {"version": np.array(VERSION), "clock": np.array(cache["clock"]), "names": np.array(list(cache["tests"]))}
+    for name, entry in cache["tests"].items():
+        for column, values in entry.items():
+            arrays[name + "/" + column] = values
+    partial = file_name + ".partial"
+    with open(partial, "wb") as file:
+        np.savez_compressed(file, **arrays)
+    os.replace(partial, file_name)
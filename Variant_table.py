@@ -0,0 +1,295 @@
+# Python 3.7
+# Variant_table.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+Reading of the SNPs of a pseudogenome directly from the output of GATK, without the conversion to csv. Two inputs are
+read:
+    The tab-separated table of VariantsToTable ("*.table", "*.tsv" or "*.txt"), with the columns CHROM, POS, the
+    annotations of annovar and AF, and two columns for each sample: sample + ".AD" with the allele depths ("12,9") and
+    sample + ".GT" with the genotype as bases ("T/C").
+    The vcf annotated by annovar ("*.vcf"), with the annotations and AF in the INFO column and the fields GT and AD of
+    each sample in the FORMAT column. The genotypes are allele numbers ("0/1") and are converted to bases with REF and
+    ALT.
+Both can be compressed with gzip ("*.gz" or "*.bgz").
+
+The file is read in chunks of rows and every chunk is converted to the columns of the csv tables of SNPs: sample + "_R_"
++ pseudogenome code + ".AD" with the depth of the reference allele, sample + "_A_" + pseudogenome code + ".AD" with the
+depth of the first alternative allele, and the two alleles of the genotype in sample + "_R_" + pseudogenome code + ".GT"
+and sample + "_A_" + pseudogenome code + ".GT". A missing genotype gives "." in both columns and a missing allele depth
+is empty. The columns have the same types as the csv tables read by Table_format.read_csv_typed, so the chunks go
+straight into the wrangling. The allele depths and genotypes can also be written directly into the arrays of
+Count_tensor.
+"""
+
+import gzip
+import os
+
+import numpy as np
+import pandas as pd
+
+import Count_tensor
+import Table_format
+
+# Extensions of the inputs without the compression
+VCF_EXTENSIONS = (".vcf",)
+TABLE_EXTENSIONS = (".table", ".tsv", ".txt")
+GZIP_EXTENSIONS = (".gz", ".bgz")
+
+# Columns of the csv tables of SNPs before the columns of the samples
+SNP_COLUMNS = ["CHROM", "POS"] + Table_format.ANNOTATION_COLUMNS + ["AF"]
+
+# Annotations missing in the INFO column of a vcf, as written by annovar
+MISSING_ANNOTATION = "."
+
+# Number of rows parsed at a time when the counts are written into the arrays
+CHUNKSIZE = 100000
+
+
+def variant_format(file_name):
+    # "vcf" or "table" for the outputs of GATK, None for a csv table
+    name = str(file_name).lower()
+    for extension in GZIP_EXTENSIONS:
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    if name.endswith(VCF_EXTENSIONS):
+        return "vcf"
+    if name.endswith(TABLE_EXTENSIONS):
+        return "table"
+    return None
+
+
+def open_text(file_name):
+    if str(file_name).lower().endswith(GZIP_EXTENSIONS):
+        return gzip.open(file_name, "rt", newline="")
+    return open(file_name, newline="")
+
+
+def read_header(file):
+    # Column names of a vcf. The lines of meta-information are skipped and the file is left at the first variant.
+    for line in file:
+        if line.startswith("#CHROM"):
+            return ["CHROM"] + line.rstrip("\r\n").split("\t")[1:]
+        if not line.startswith("##"):
+            break
+    raise ValueError("The vcf " + str(file.name) + " has no #CHROM header line")
+
+
+def check_samples(columns, samples, file_name):
+    missing = [str(sample) for sample in samples if str(sample) not in columns]
+    if missing:
+        raise ValueError("The samples " + ", ".join(missing) + " are not in " + str(file_name))
+
+
+def split_depths(ad):
+    # Depths of the reference and the first alternative allele from the AD field. The empty and "." depths are NaN.
+    ref, sep, rest = ad.str.partition(",").T.values
+    alt = pd.Series(rest).str.partition(",")[0]
+    return (pd.to_numeric(pd.Series(ref), errors="coerce").to_numpy(dtype=np.float32),
+            pd.to_numeric(alt, errors="coerce").to_numpy(dtype=np.float32))
+
+
+def split_genotype(gt):
+    # The two alleles of a genotype. A haploid call gives the same allele twice and a missing call gives "." twice.
+    first, sep, second = gt.str.replace("|", "/", regex=False).str.partition("/").T.values
+    first = np.where((first == "") | pd.isna(first), ".", first)
+    second = np.where(sep == "", first, second)
+    return first.astype(object), second.astype(object)
+
+
+def allele_bases(numbers, alleles):
+    # Bases of the allele numbers of a vcf genotype. The numbers that are missing or out of range give ".".
+    index = pd.to_numeric(pd.Series(numbers), errors="coerce").to_numpy()
+    valid = ~np.isnan(index) & (index >= 0) & (index < alleles.shape[1])
+    bases = np.full(len(index), ".", dtype=object)
+    rows = np.flatnonzero(valid)
+    bases[rows] = alleles[rows, index[rows].astype(np.intp)]
+    return bases
+
+
+def sample_columns(sample, PSG, ad, gt, fields):
+    # Columns of a sample in the layout of the csv tables
+    columns = {}
+    if "AD" in fields:
+        r_ad, a_ad = split_depths(ad)
+        columns[Count_tensor.column(sample, "_R_", ".AD", PSG)] = r_ad
+        columns[Count_tensor.column(sample, "_A_", ".AD", PSG)] = a_ad
+    if "GT" in fields:
+        r_gt, a_gt = gt
+        columns[Count_tensor.column(sample, "_R_", ".GT", PSG)] = pd.Categorical(r_gt)
+        columns[Count_tensor.column(sample, "_A_", ".GT", PSG)] = pd.Categorical(a_gt)
+    return columns
+
+
+def snp_columns(df):
+    # Chromosome, position, annotations and allele frequency, with the types of the csv tables
+    columns = {}
+    for col in SNP_COLUMNS:
+        if col not in df.columns:
+            continue
+        if col == "POS":
+            columns[col] = df[col].astype(np.int64).to_numpy()
+        elif col == "AF":
+            try:
+                columns[col] = pd.to_numeric(df[col]).to_numpy()
+            except ValueError:
+                # Sites with several alternative alleles have one frequency for each
+                columns[col] = df[col].to_numpy()
+        elif col in Table_format.ANNOTATION_COLUMNS:
+            columns[col] = pd.Categorical(df[col])
+        else:
+            columns[col] = df[col].to_numpy()
+    return columns
+
+
+def convert_table(df, PSG, samples, fields):
+    # Chunk of a VariantsToTable output to the layout of the csv tables
+    columns = snp_columns(df)
+    for sample in samples:
+        sample = str(sample)
+        ad = df[sample + ".AD"] if "AD" in fields else None
+        gt = split_genotype(df[sample + ".GT"]) if "GT" in fields else None
+        columns.update(sample_columns(sample, PSG, ad, gt, fields))
+    return pd.DataFrame(columns, index=df.index)
+
+
+def info_field(info, key):
+    # Values of a key of the INFO column
+    return info.str.extract("(?:^|;)" + key.replace(".", r"\.") + "=([^;]*)", expand=False)
+
+
+def convert_vcf(df, PSG, samples, fields):
+    # Chunk of a vcf to the layout of the csv tables. The FORMAT column can change between rows, so the samples are
+    # parsed for each FORMAT separately.
+    info = df["INFO"]
+    snps = df[["CHROM", "POS"]].copy()
+    for col in Table_format.ANNOTATION_COLUMNS:
+        snps[col] = info_field(info, col).fillna(MISSING_ANNOTATION)
+    snps["AF"] = info_field(info, "AF")
+    columns = snp_columns(snps)
+    if not samples or not fields:
+        return pd.DataFrame(columns, index=df.index)
+
+    alleles = pd.concat([df["REF"], df["ALT"].str.split(",", expand=True)], axis=1).to_numpy(dtype=object)
+    n = len(df)
+    ad = {str(sample): np.full(n, "", dtype=object) for sample in samples}
+    gt = {str(sample): (np.full(n, ".", dtype=object), np.full(n, ".", dtype=object)) for sample in samples}
+    for fmt, rows in df.groupby("FORMAT", sort=False).indices.items():
+        keys = fmt.split(":")
+        for sample in samples:
+            sample = str(sample)
+            values = df[sample].iloc[rows].str.split(":", expand=True)
+            if "AD" in keys and keys.index("AD") < values.shape[1]:
+                ad[sample][rows] = values[keys.index("AD")].fillna("").to_numpy()
+            if "GT" in keys and keys.index("GT") < values.shape[1]:
+                first, second = split_genotype(values[keys.index("GT")].fillna("."))
+                gt[sample][0][rows] = allele_bases(first, alleles[rows])
+                gt[sample][1][rows] = allele_bases(second, alleles[rows])
+    for sample in samples:
+        sample = str(sample)
+        columns.update(sample_columns(sample, PSG, pd.Series(ad[sample]), gt[sample], fields))
+    return pd.DataFrame(columns, index=df.index)
+
+
+def read_variants(file_name, PSG, samples=None, fields=Table_format.FIELDS, chunksize=None):
+    """
+    Read a VariantsToTable output or a vcf as a table of SNPs of one pseudogenome.
+
+    :param file_name: VariantsToTable output or vcf, compressed or not
+    :param PSG: pseudogenome code added to the column names of the samples
+    :param samples: samples whose columns are read, None for all the samples of the file
+    :param fields: fields of the sample columns that are read, from "AD" and "GT"
+    :param chunksize: read the file in chunks of this number of rows
+    :return: dataframe with the columns of the csv tables of SNPs, or an iterator of dataframes with chunksize
+    """
+    kind = variant_format(file_name)
+    file = open_text(file_name)
+    if kind == "vcf":
+        names = read_header(file)
+        file_samples = names[9:]
+        usecols = ["CHROM", "POS", "REF", "ALT", "INFO", "FORMAT"]
+        convert = convert_vcf
+    else:
+        names = file.readline().rstrip("\r\n").split("\t")
+        file_samples = [col[:-3] for col in names if col.endswith(".GT")]
+        usecols = [col for col in SNP_COLUMNS if col in names]
+        convert = convert_table
+    samples = file_samples if samples is None else [str(sample) for sample in samples]
+    check_samples(file_samples, samples, file_name)
+    if fields:
+        if kind == "vcf":
+            usecols = usecols + samples
+        else:
+            usecols = usecols + [sample + "." + field for sample in samples for field in ("AD", "GT") if field in fields]
+
+    # All the cells are read as text and converted by column, "." and the empty cells included
+    reader = pd.read_csv(file, sep="\t", header=None, names=names, usecols=usecols, dtype=str, na_filter=False,
+                         chunksize=chunksize)
+
+    def chunks():
+        with file:
+            for chunk in reader:
+                yield Table_format.downcast_counts(convert(chunk, PSG, samples, fields))
+
+    if chunksize is not None:
+        return chunks()
+    with file:
+        return Table_format.downcast_counts(convert(reader, PSG, samples, fields))
+
+
+def count_rows(file_name):
+    # Number of variants of a file, to allocate the arrays before they are filled
+    with open_text(file_name) as file:
+        if variant_format(file_name) == "vcf":
+            read_header(file)
+        else:
+            file.readline()
+        return sum(1 for line in file if line.strip())
+
+
+def read_counts(file_name, PSG, layout, folder=None, chunksize=CHUNKSIZE):
+    """
+    Write the allele depths and genotypes of a VariantsToTable output or a vcf directly into the arrays of
+    Count_tensor, one chunk of rows at a time.
+
+    :param file_name: VariantsToTable output or vcf, compressed or not
+    :param PSG: pseudogenome code of the file, the only position of the pseudogenome axis
+    :param layout: Count_tensor.Layout with the samples to read
+    :param folder: write the arrays as memory-mapped .npy files in this folder instead of keeping them in memory
+    :param chunksize: number of rows parsed at a time
+    :return: Count_tensor.Counts
+    """
+    n = count_rows(file_name)
+    if folder is not None:
+        os.makedirs(folder, exist_ok=True)
+    shape = (n, len(layout.samples), len(Count_tensor.ALLELES), 1)
+    ad = Count_tensor.allocate(folder, "ad", shape, np.float64)
+    # The alleles are numbered as they are found, so the codes can need more than 8 bits only after all the chunks
+    gt = Count_tensor.allocate(folder, "gt", shape, np.int16)
+    alleles = []
+    codes = {}
+    snps = []
+    start = 0
+    for chunk in read_variants(file_name, PSG, layout.samples, chunksize=chunksize):
+        counts = Count_tensor.from_table(chunk, layout, PSGs=[PSG])
+        end = start + len(chunk)
+        ad[start:end] = counts.ad
+        for allele in counts.alleles:
+            if allele not in codes:
+                codes[allele] = len(alleles)
+                alleles.append(allele)
+        recode = np.array([codes[allele] for allele in counts.alleles] + [-1], dtype=np.int16)
+        # The missing genotypes have the code -1, the last position of recode
+        gt[start:end] = recode[counts.gt]
+        snps.append(counts.snps)
+        start = end
+
+    snps = pd.concat(snps) if snps else pd.DataFrame(columns=["CHROM", "POS"])
+    snps.index = pd.RangeIndex(len(snps))
+    counts = Count_tensor.Counts(ad, gt, alleles, layout, snps, [str(PSG)])
+    if folder is not None:
+        Count_tensor.save(counts, folder)
+    return counts
@@ -0,0 +1,15 @@
+# Python 3.7
+# conftest.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+The modules of the workflow are scripts in the folder above the tests, they are imported from there.
+"""
+
+import sys
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
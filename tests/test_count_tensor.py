@@ -0,0 +1,71 @@
+# Python 3.7
+# test_count_tensor.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+The arrays of Count_tensor hold the depths and the genotypes of the columns of the table, are saved and opened again
+with the same values, and sum the groups as the columns of their samples.
+"""
+
+import numpy as np
+import pandas as pd
+
+import Count_tensor
+
+SAMPLES = ["1GF", "2GF", "1KF", "2KF", "3KF"]
+GROUPS = pd.DataFrame({"Group": ["GF", "KF"], "ID_1": ["1GF", "1KF"], "ID_2": ["2GF", "2KF"], "ID_3": [None, "3KF"]})
+
+
+def table(n=40, PSG=""):
+    # Table of SNPs with the depths and the genotypes of the samples
+    rng = np.random.default_rng(2)
+    columns = {"CHROM": ["chr" + str(k % 3) for k in range(n)], "POS": np.arange(n) * 10}
+    for sample in SAMPLES:
+        for allele in Count_tensor.ALLELES:
+            columns[Count_tensor.column(sample, allele, ".AD", PSG)] = rng.integers(0, 50, n) / 2
+            columns[Count_tensor.column(sample, allele, ".GT", PSG)] = rng.choice([".", "A", "C", "GT"], n)
+    return pd.DataFrame(columns, index=np.arange(100, 100 + n))
+
+
+def test_layout_members():
+    layout = Count_tensor.make_layout(SAMPLES, GROUPS)
+    assert layout.groups == ["GF", "KF"]
+    assert list(layout.members["KF"]) == [2, 3, 4]
+    matrix = Count_tensor.membership(layout).toarray()
+    assert matrix.tolist() == [[1, 0], [1, 0], [0, 1], [0, 1], [0, 1]]
+
+
+def test_arrays_of_the_table():
+    df = table()
+    layout = Count_tensor.make_layout(SAMPLES, GROUPS)
+    counts = Count_tensor.from_table(df, layout)
+    assert counts.ad.shape == (len(df), len(SAMPLES), 2)
+    np.testing.assert_array_equal(Count_tensor.sample_counts(counts, "2KF")[:, 1], df["2KF_A_.AD"])
+    codes = counts.gt[:, layout.positions["1GF"], 0]
+    np.testing.assert_array_equal(np.array(counts.alleles)[codes], df["1GF_R_.GT"])
+
+    depths = Count_tensor.group_depths(counts)
+    for g, group in enumerate(layout.groups):
+        members = [sample for sample in SAMPLES if sample[1:] == group]
+        for a, allele in enumerate(Count_tensor.ALLELES):
+            expected = df[[sample + allele + ".AD" for sample in members]].sum(axis=1)
+            np.testing.assert_allclose(depths[:, g, a], expected)
+            np.testing.assert_allclose(Count_tensor.group_counts(counts, group)[:, a], expected)
+
+
+def test_save_and_open(tmp_path):
+    df = table(PSG="GF3")
+    layout = Count_tensor.make_layout(SAMPLES, GROUPS)
+    written = Count_tensor.from_table(df, layout, ["GF3"], folder=str(tmp_path))
+    counts = Count_tensor.open_counts(str(tmp_path))
+    assert counts.ad.shape == (len(df), len(SAMPLES), 2, 1)
+    np.testing.assert_array_equal(counts.ad, written.ad)
+    np.testing.assert_array_equal(counts.gt, written.gt)
+    assert counts.alleles == written.alleles and counts.PSGs == ["GF3"]
+    assert counts.layout.groups == layout.groups
+    np.testing.assert_array_equal(counts.snps.index, df.index)
+    np.testing.assert_array_equal(counts.snps["CHROM"].astype(str), df["CHROM"])
+    np.testing.assert_array_equal(counts.snps["POS"], df["POS"])
@@ -0,0 +1,78 @@
+# Python 3.7
+# test_exact_tests.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+The exact tests computed for whole arrays of counts give the p-values of scipy for each table.
+"""
+
+import numpy as np
+import pytest
+from scipy import stats
+
+import Exact_tests
+
+
+def random_tables(n, high, seed=0):
+    # Tables of counts with small and deep SNPs, and the tables with empty rows and columns
+    rng = np.random.default_rng(seed)
+    tables = rng.integers(0, high, size=(n, 4))
+    tables[:n // 4] = rng.integers(0, 6, size=(n // 4, 4))
+    edges = [[0, 0, 0, 0], [0, 0, 3, 4], [3, 0, 4, 0], [5, 5, 5, 5], [1, 0, 0, 1], [0, 7, 7, 0]]
+    return np.concatenate([tables, edges])
+
+
+def test_fisher_matches_scipy():
+    tables = random_tables(400, 300)
+    oddsratio, pvalue = Exact_tests.fisher_exact(*tables.T)
+    for (a, b, c, d), ratio, p in zip(tables, oddsratio, pvalue):
+        expected = stats.fisher_exact([[a, b], [c, d]])
+        assert p == pytest.approx(expected.pvalue, rel=1e-9, abs=1e-12), (a, b, c, d)
+        if np.isnan(ratio):
+            assert min(a + b, c + d, a + c, b + d) == 0
+        else:
+            assert ratio == pytest.approx(expected.statistic), (a, b, c, d)
+
+
+def test_fisher_rounding_of_averaged_counts():
+    a, b, c, d = np.array([7.5]), np.array([2.5]), np.array([1.5]), np.array([6.5])
+    floor = Exact_tests.fisher_exact(a, b, c, d)[1]
+    rint = Exact_tests.fisher_exact(a, b, c, d, "rint")[1]
+    assert floor[0] == pytest.approx(stats.fisher_exact([[7, 2], [1, 6]]).pvalue)
+    assert rint[0] == pytest.approx(stats.fisher_exact([[8, 2], [2, 6]]).pvalue)
+    with pytest.raises(ValueError):
+        Exact_tests.fisher_exact(a, b, c, d, "ceil")
+
+
+def test_fisher_keeps_the_shape():
+    tables = random_tables(24, 50).reshape(5, 6, 4)
+    oddsratio, pvalue = Exact_tests.fisher_exact(*np.moveaxis(tables, 2, 0))
+    assert pvalue.shape == (5, 6)
+    assert pvalue[2, 3] == pytest.approx(stats.fisher_exact(tables[2, 3].reshape(2, 2)).pvalue)
+
+
+@pytest.mark.parametrize("p", [0.5, 0.3, 0.62])
+def test_binomial_matches_scipy(p):
+    rng = np.random.default_rng(1)
+    n = np.concatenate([rng.integers(0, 400, size=300), [0, 1, 2, 10, 10, 1000]])
+    k = np.concatenate([rng.integers(0, n[:300] + 1), [0, 0, 1, 5, 0, 1000]])
+    pvalue = Exact_tests.binomial_test(k, n, p)
+    for successes, trials, value in zip(k, n, pvalue):
+        expected = 1.0 if trials == 0 else stats.binomtest(int(successes), int(trials), p).pvalue
+        assert value == pytest.approx(expected, rel=1e-9, abs=1e-12), (successes, trials)
+
+
+def test_binomial_proportion_per_test_and_errors():
+    k, n = np.array([[3, 9], [0, 4]]), np.array([[10, 12], [0, 8]])
+    p = np.array([[0.5, 0.4], [0.5, 0.45]])
+    pvalue = Exact_tests.binomial_test(k, n, p)
+    assert pvalue.shape == (2, 2)
+    assert pvalue[1, 0] == 1
+    assert pvalue[0, 1] == pytest.approx(stats.binomtest(9, 12, 0.4).pvalue)
+    with pytest.raises(ValueError):
+        Exact_tests.binomial_test([5], [4])
+    with pytest.raises(ValueError):
+        Exact_tests.binomial_test([1], [4], 1.5)
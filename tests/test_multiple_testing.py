@@ -0,0 +1,65 @@
+# Python 3.7
+# test_multiple_testing.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+The corrections of the p-values give the ones of statsmodels multipletests, in memory and with the external sort of
+the runs on disk, for the families of several columns and with the p-values that are not defined.
+"""
+
+import numpy as np
+import pytest
+from statsmodels.stats.multitest import multipletests
+
+import Multiple_testing
+
+# Method of statsmodels of each correction, the q-values of Storey are the ones of Benjamini-Hochberg times pi0
+STATSMODELS = {"bonferroni": "bonferroni", "holm": "holm", "bh": "fdr_bh", "by": "fdr_by", "storey": "fdr_bh"}
+
+
+def family(seed=0):
+    # Columns of p-values with ties, NaN and small p-values, as the columns of the tests of a run
+    rng = np.random.default_rng(seed)
+    columns = [rng.uniform(size=150), np.round(rng.uniform(size=90), 2), rng.uniform(size=60) ** 6]
+    columns[0][::11] = np.nan
+    columns[1][:5] = 1.0
+    columns[2][3] = 0.0
+    return columns
+
+
+def expected(columns, method):
+    # Corrected p-values of statsmodels for the family, NaN where the p-value is NaN
+    pvalues = np.concatenate(columns)
+    finite = np.isfinite(pvalues)
+    corrected = np.full(len(pvalues), np.nan)
+    corrected[finite] = multipletests(pvalues[finite], method=STATSMODELS[method])[1]
+    if method == "storey":
+        m = finite.sum()
+        pi0 = min(1.0, (pvalues[finite] >= Multiple_testing.STOREY_LAMBDA).sum() /
+                  (m * (1 - Multiple_testing.STOREY_LAMBDA)))
+        corrected = corrected * pi0
+    return np.split(corrected, np.cumsum([len(column) for column in columns])[:-1])
+
+
+@pytest.mark.parametrize("method", Multiple_testing.METHODS)
+@pytest.mark.parametrize("block", [Multiple_testing.BLOCK, 37])
+def test_correct_matches_statsmodels(tmp_path, method, block):
+    columns = family()
+    corrected = Multiple_testing.correct(columns, method, block, str(tmp_path))
+    for values, reference in zip(corrected, expected(columns, method)):
+        np.testing.assert_allclose(values, reference, rtol=1e-12, atol=1e-15)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_correct_into_arrays_and_errors():
+    columns = family(1)
+    out = [np.zeros(len(column)) for column in columns]
+    corrected = Multiple_testing.correct(columns, "bh", out=out)
+    assert all(values is array for values, array in zip(corrected, out))
+    assert np.isnan(out[0][0])
+    assert np.isnan(Multiple_testing.correct([np.full(4, np.nan)])[0]).all()
+    with pytest.raises(ValueError):
+        Multiple_testing.correct(columns, "sidak")
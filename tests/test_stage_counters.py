@@ -0,0 +1,45 @@
+# Python 3.7
+# test_stage_counters.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+Counters of the chunks and shards added together, and the errors of the run printed once with their sum.
+"""
+
+import numpy as np
+import pandas as pd
+
+import Stage_counters
+
+
+def chunk_counters(unclassified):
+    # Counters of a chunk of the comparison with the models
+    counters = Stage_counters.new_counters(verbosity=0)
+    df = pd.DataFrame({"CHROM": ["chr1"] * len(unclassified), "POS": np.arange(len(unclassified))})
+    mask = np.asarray(unclassified)[:, np.newaxis]
+    Stage_counters.count(counters, "Uniform", "unclassified", mask.any(axis=1).sum())
+    Stage_counters.record_unclassified(counters, "Uniform", df, mask, ["S1"])
+    return counters
+
+
+def test_errors_reported_once_for_the_run(capsys):
+    counters = Stage_counters.new_counters(verbosity=0)
+    for unclassified in ([True, False, True], [False, False], [False, True]):
+        Stage_counters.merge(counters, chunk_counters(unclassified))
+    assert capsys.readouterr().out == ""
+
+    Stage_counters.report_errors(counters)
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1
+    assert "no case for  3  SNPs" in lines[0]
+    assert len(Stage_counters.unclassified_table(counters)) == 3
+
+
+def test_no_error_without_unclassified_snps(capsys):
+    counters = Stage_counters.new_counters(verbosity=2)
+    Stage_counters.merge(counters, chunk_counters([False, False]))
+    Stage_counters.report_errors(counters)
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,85 @@
+# Python 3.7
+# test_table_format.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+Round trips of the tables of Table_format: a table written in chunks is read back as the table written at once, with the
+same types, whatever the types of the chunks.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import Table_format
+
+
+def snps(start, genotypes, genes):
+    # Small table of SNPs with the index numbered along the whole table
+    n = len(genotypes)
+    return pd.DataFrame({"CHROM": ["chr1"] * n, "POS": np.arange(start, start + n),
+                         "Gene.refGene": pd.Categorical(genes),
+                         "S1_R_.GT": pd.Categorical(genotypes),
+                         "S1_R_.AD": np.arange(n, dtype=np.float32)},
+                        index=pd.RangeIndex(start, start + n))
+
+
+def chunks():
+    # Chunks with other categories, and one chunk with the genotypes and the genes as strings
+    first = snps(0, ["A", "C", "A"], ["g1", "g1", "g2"])
+    second = snps(3, ["T", "."], ["g3", "g2"])
+    second = second.assign(**{"S1_R_.GT": second["S1_R_.GT"].astype(object),
+                              "Gene.refGene": second["Gene.refGene"].astype(object)})
+    third = snps(5, ["G", None], ["g4", "g1"])
+    return [first, second, third]
+
+
+def plain(df):
+    # Values of the table without the types of the categories
+    return df.assign(**{col: df[col].astype(object) for col in df.columns
+                        if isinstance(df[col].dtype, pd.CategoricalDtype)})
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "feather"])
+def test_chunks_read_as_one_table(tmp_path, fmt):
+    pytest.importorskip("pyarrow")
+    name = str(tmp_path / "SNPs_ready")
+    for k, chunk in enumerate(chunks()):
+        Table_format.write_table(chunk, name, fmt, append=k > 0)
+    df = Table_format.read_table(name, fmt)
+
+    expected = pd.concat([plain(chunk) for chunk in chunks()])
+    pd.testing.assert_frame_equal(plain(df), expected, check_dtype=False, check_index_type=False)
+    for col in ["Gene.refGene", "S1_R_.GT"]:
+        assert isinstance(df[col].dtype, pd.CategoricalDtype)
+    assert list(df["S1_R_.GT"].cat.categories) == ["A", "C", ".", "T", "G"]
+
+
+def test_concatenate_keeps_categories():
+    df = Table_format.concatenate(chunks())
+    assert isinstance(df["S1_R_.GT"].dtype, pd.CategoricalDtype)
+    assert list(df["Gene.refGene"].cat.categories) == ["g1", "g2", "g3", "g4"]
+    assert df["S1_R_.GT"].isna().sum() == 1
+
+
+def test_categorize_depends_on_the_rows_only():
+    df = Table_format.concatenate(chunks())
+    tail = Table_format.categorize(df.iloc[3:])
+    assert list(tail["S1_R_.GT"].cat.categories) == [".", "G", "T"]
+    assert list(tail["Gene.refGene"].cat.categories) == ["g1", "g2", "g3", "g4"]
+    fresh = Table_format.categorize(plain(df.iloc[3:]))
+    pd.testing.assert_frame_equal(tail, fresh)
+
+
+def test_csv_round_trip(tmp_path):
+    name = str(tmp_path / "SNPs_ready")
+    for k, chunk in enumerate(chunks()):
+        Table_format.write_table(chunk, name, "csv", append=k > 0)
+    df = Table_format.read_table(name, "csv", index_col=0)
+    assert df["S1_R_.AD"].dtype == np.float32
+    assert isinstance(df["S1_R_.GT"].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(plain(df), pd.concat([plain(chunk) for chunk in chunks()]), check_dtype=False,
+                                  check_index_type=False)
@@ -0,0 +1,94 @@
+# Python 3.7
+# test_test_cache.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+The test cache gives the results of the test for every table, computes each distinct table once, keeps the tables
+used most recently and is read again from its file only by the same version of the tests.
+"""
+
+import numpy as np
+
+import Exact_tests
+import Test_cache
+
+
+def counted(test, calls):
+    # Test that records the number of tables of each call
+    def run(*counts):
+        calls.append(len(counts[0]))
+        return test(*counts)
+    return run
+
+
+def fisher(a, b, c, d):
+    return Exact_tests.fisher_exact(a, b, c, d)
+
+
+def tables(seed, shape=(60, 4)):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 6, size=shape) for k in range(4)]
+
+
+def test_results_of_every_table():
+    counts = tables(0)
+    calls = []
+    cache = Test_cache.new_cache()
+    results = Test_cache.apply(cache, "fisher", counted(fisher, calls), counts)
+    expected = fisher(*counts)
+    for result, reference in zip(results, expected):
+        assert result.shape == (60, 4)
+        np.testing.assert_array_equal(result, reference)
+    distinct = len(np.unique(np.stack([x.ravel() for x in counts], axis=1), axis=0))
+    assert calls == [distinct]
+
+    # The same tables again are all read from the cache
+    again = Test_cache.apply(cache, "fisher", counted(fisher, calls), counts)
+    np.testing.assert_array_equal(again[1], expected[1])
+    assert calls == [distinct, 0]
+    assert cache["computed"] == distinct
+
+
+def test_without_cache_and_other_names():
+    counts = tables(1)
+    calls = []
+    Test_cache.apply(None, "fisher", counted(fisher, calls), counts)
+    cache = Test_cache.new_cache()
+    Test_cache.apply(cache, "binomial p=0.5", counted(lambda k, n, x, y: (k + n,), calls), counts)
+    Test_cache.apply(cache, "binomial p=0.4", counted(lambda k, n, x, y: (k + n,), calls), counts)
+    assert calls[1] == calls[2] == calls[0]
+
+
+def test_eviction_keeps_recent_tables():
+    recent = tables(3, (20, 1))
+    distinct = len(np.unique(np.stack([x.ravel() for x in recent], axis=1), axis=0))
+    cache = Test_cache.new_cache(max_entries=distinct)
+    old = [np.arange(100, 110) for k in range(4)]
+    Test_cache.apply(cache, "fisher", fisher, old)
+    Test_cache.apply(cache, "fisher", fisher, recent)
+    assert len(cache["tests"]["fisher"]["used"]) == distinct
+    calls = []
+    Test_cache.apply(cache, "fisher", counted(fisher, calls), recent)
+    Test_cache.apply(cache, "fisher", counted(fisher, calls), old)
+    assert calls == [0, 10]
+
+
+def test_save_and_load(tmp_path, monkeypatch):
+    file_name = str(tmp_path / "tests.npz")
+    counts = tables(4)
+    cache = Test_cache.new_cache()
+    expected = Test_cache.apply(cache, "fisher", fisher, counts)
+    Test_cache.save(cache, file_name)
+
+    calls = []
+    loaded = Test_cache.load(file_name)
+    results = Test_cache.apply(loaded, "fisher", counted(fisher, calls), counts)
+    assert calls == [0]
+    np.testing.assert_array_equal(results[1], expected[1])
+
+    monkeypatch.setattr(Test_cache, "VERSION", Test_cache.VERSION + 1)
+    assert Test_cache.load(file_name)["tests"] == {}
+    assert Test_cache.load(str(tmp_path / "missing.npz"))["tests"] == {}
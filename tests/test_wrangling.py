@@ -0,0 +1,87 @@
+# Python 3.7
+# test_wrangling.py
+
+"""
+python 3.7
+
+    @version : 0.1
+
+The wrangling of synthetic data gives the same tables when it runs on the whole table, in chunks or in shards: the same
+rows, the same values and the same column types.
+"""
+
+import contextlib
+import os
+import shutil
+import subprocess
+import sys
+from os import path
+
+import pandas as pd
+import pytest
+
+import Synthetic_data
+import Table_format
+
+SCRIPT = path.join(path.dirname(path.dirname(path.abspath(__file__))), "ASE_data_wrangling.py")
+
+
+@pytest.fixture(scope="module")
+def data(tmp_path_factory):
+    # Synthetic tables with SNPs that match no genotype case
+    folder = str(tmp_path_factory.mktemp("synthetic"))
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        Synthetic_data.write(Synthetic_data.Config(snps=3000, dropouts=1, seed=3), folder)
+    return folder
+
+
+def wrangle(data, folder, *options):
+    # Run the wrangling on a copy of the synthetic data
+    shutil.copytree(data, folder)
+    os.makedirs(path.join(folder, "temp"))
+    subprocess.run([sys.executable, SCRIPT, "--verbosity", "0"] + list(options), cwd=folder, check=True,
+                   stdout=subprocess.DEVNULL)
+    return folder
+
+
+def read(folder, name, fmt):
+    cwd = os.getcwd()
+    os.chdir(folder)
+    try:
+        return Table_format.read_table(name, fmt, index_col=0) if fmt == "csv" else Table_format.read_table(name, fmt)
+    finally:
+        os.chdir(cwd)
+
+
+def plain(df):
+    # Rows in the order of the coordinates, with the categories as their values
+    df = df.sort_values(["CHROM", "POS"]).reset_index(drop=True)
+    return df.assign(**{col: df[col].astype(object) for col in df.columns
+                        if isinstance(df[col].dtype, pd.CategoricalDtype)})
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "csv"])
+def test_chunks_give_the_whole_table(data, tmp_path, fmt):
+    if fmt != "csv":
+        pytest.importorskip("pyarrow")
+    whole = wrangle(data, str(tmp_path / "whole"), "--format", fmt)
+    chunks = wrangle(data, str(tmp_path / "chunks"), "--format", fmt, "--chunksize", "400")
+    for name in ["SNPs_ready", path.join("temp", "Average_SNPs"), path.join("temp", "Uniform_SNPs")]:
+        expected = read(whole, name, fmt)
+        df = read(chunks, name, fmt)
+        assert dict(df.dtypes.map(str)) == dict(expected.dtypes.map(str)), name
+        pd.testing.assert_frame_equal(plain(df), plain(expected))
+    if fmt == "csv":
+        # The numbers are written the same way in all the chunks
+        with open(path.join(whole, "SNPs_ready.csv")) as expected, open(path.join(chunks, "SNPs_ready.csv")) as df:
+            assert sorted(line.split(",", 1)[1] for line in df) == sorted(line.split(",", 1)[1] for line in expected)
+
+
+def test_shards_give_the_whole_table(data, tmp_path):
+    pytest.importorskip("pyarrow")
+    whole = wrangle(data, str(tmp_path / "whole"), "--format", "parquet")
+    shards = wrangle(data, str(tmp_path / "shards"), "--format", "parquet", "--shards", "3")
+    expected = read(whole, "SNPs_ready", "parquet")
+    df = read(shards, "SNPs_ready", "parquet")
+    assert dict(df.dtypes.map(str)) == dict(expected.dtypes.map(str))
+    pd.testing.assert_frame_equal(plain(df), plain(expected))